@@ -0,0 +1,261 @@
+import json
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
+from datetime import datetime, timedelta, timezone
+
+import boto3
+
+from modules.aws_config import get_client
+from modules.regions import resolve_regions, tag_region
+
+DEFAULT_ROLE_NAME = 'CSPMAuditRole'
+SESSION_NAME = 'cspm-scan'
+
+# Refresh assumed-role credentials this long before they expire
+EXPIRY_MARGIN = timedelta(minutes=10)
+
+# Field used when a check returns plain strings and the finding has to be
+# turned into a dict to carry the account tag
+STRING_FINDING_FIELDS = {'s3': 'Bucket', 'iam': 'UserName'}
+
+
+def load_accounts(path=None):
+    """Read the account list (YAML or JSON).
+
+    accounts:
+      - account_id: "111111111111"
+        name: prod
+        role_arn: arn:aws:iam::111111111111:role/CSPMAuditRole   # optional
+        regions: [us-east-1, eu-west-1]                          # optional
+    role_name: CSPMAuditRole    # used when role_arn is not given
+    external_id: ...            # optional, passed to AssumeRole
+    """
+    path = path or os.getenv('CSPM_ACCOUNTS_FILE', 'accounts.yaml')
+    with open(path) as f:
+        if path.endswith('.json'):
+            config = json.load(f)
+        else:
+            import yaml
+            config = yaml.safe_load(f)
+
+    role_name = config.get('role_name', DEFAULT_ROLE_NAME)
+    accounts = []
+    for entry in config.get('accounts', []):
+        account_id = str(entry['account_id'])
+        accounts.append({
+            'account_id': account_id,
+            'name': entry.get('name', account_id),
+            'role_arn': entry.get('role_arn') or f"arn:aws:iam::{account_id}:role/{role_name}",
+            'external_id': entry.get('external_id', config.get('external_id')),
+            'regions': entry.get('regions'),
+        })
+    return accounts
+
+
+class CredentialCache:
+    """Assumed-role credentials per role ARN, reused until shortly before they expire"""
+
+    def __init__(self, base_session):
+        self.base_session = base_session
+        self.credentials = {}
+        self.lock = threading.Lock()
+        self.role_locks = {}
+
+    def _role_lock(self, role_arn):
+        with self.lock:
+            return self.role_locks.setdefault(role_arn, threading.Lock())
+
+    def get(self, account):
+        role_arn = account['role_arn']
+        # One AssumeRole per role at a time, other roles don't wait
+        with self._role_lock(role_arn):
+            cached = self.credentials.get(role_arn)
+            if cached and cached['Expiration'] - EXPIRY_MARGIN > datetime.now(timezone.utc):
+                return cached
+            params = {'RoleArn': role_arn, 'RoleSessionName': SESSION_NAME}
+            if account.get('external_id'):
+                params['ExternalId'] = account['external_id']
+            sts = get_client(self.base_session, 'sts')
+            credentials = sts.assume_role(**params)['Credentials']
+            self.credentials[role_arn] = credentials
+            return credentials
+
+    def session(self, account, region=None):
+        return session_from_credentials(self.get(account), region)
+
+
+def session_from_credentials(credentials, region=None):
+    return boto3.Session(
+        aws_access_key_id=credentials['AccessKeyId'],
+        aws_secret_access_key=credentials['SecretAccessKey'],
+        aws_session_token=credentials['SessionToken'],
+        region_name=region or 'us-east-1',
+    )
+
+
+def tag_account(check, finding, account_id):
+    """Return a copy of a finding tagged with the account it came from"""
+    if isinstance(finding, dict):
+        tagged = dict(finding)
+    else:
+        tagged = {STRING_FINDING_FIELDS.get(check, 'Resource'): finding}
+    tagged['Account'] = account_id
+    return tagged
+
+
+def _scan_unit(unit):
+    """Run the checks of one (account, region) unit. Executed in a worker process."""
+    from modules.cache import get_inventory_cache
+    from modules.scanner import REGIONAL_CHECKS, run_scan
+
+    session = session_from_credentials(unit['credentials'], unit['region'])
+    # The other workers write to the same cache file at the same time
+    cache = get_inventory_cache(shared=True)
+    if cache is not None:
+        cache.attach(session, account=unit['account_id'])
+    scan = run_scan(session, checks=unit['checks'], check_options=unit['check_options'])
+    for name, result in scan['checks'].items():
+        findings = result['findings']
+        if unit['region'] and name in REGIONAL_CHECKS:
+            findings = [tag_region(f, unit['region']) for f in findings]
+        result['findings'] = [tag_account(name, f, unit['account_id']) for f in findings]
+    return scan
+
+
+def run_multi_account_scan(base_session, accounts, checks=None, regions=None, check_options=None,
+                           max_workers=None):
+    """Scan many accounts by assuming a role in each one.
+
+    Work is split into (account, region) units: one unit per account for
+    the global checks (S3, IAM) and one per region for the regional ones.
+    Units run on a pool of worker processes, each handed the account's
+    credentials as it is submitted, so units that wait for a free worker
+    don't start with credentials about to expire. Returns a result per
+    account, shaped like run_scan's, with every finding tagged with
+    'Account'.
+    """
+    from modules.scanner import CHECKS, REGIONAL_CHECKS
+
+    names = list(checks) if checks else list(CHECKS)
+    global_checks = [name for name in names if name not in REGIONAL_CHECKS]
+    regional_checks = [name for name in names if name in REGIONAL_CHECKS]
+    max_workers = max_workers or int(os.getenv('CSPM_ACCOUNT_WORKERS', os.cpu_count() or 4))
+    credentials = CredentialCache(base_session)
+
+    result = {
+        'started': datetime.now().isoformat(),
+        'started_utc': datetime.now(timezone.utc).isoformat(),
+        'finished': None,
+        'duration': None,
+        'accounts': {},
+        'total_issues': 0,
+        'errors': 0,
+    }
+    start = time.perf_counter()
+
+    def prepare(account):
+        """Assume the role and work out the regions for one account (I/O bound, runs on threads)"""
+        session = credentials.session(account, base_session.region_name)
+        account_regions = resolve_regions(session, account.get('regions') or regions) or [session.region_name]
+        return account_regions
+
+    units = []
+    with ThreadPoolExecutor(max_workers=min(32, max(1, len(accounts)))) as pool:
+        futures = {pool.submit(prepare, account): account for account in accounts}
+        for future in as_completed(futures):
+            account = futures[future]
+            entry = {'name': account['name'], 'regions': [], 'checks': {}, 'error': None}
+            result['accounts'][account['account_id']] = entry
+            try:
+                entry['regions'] = future.result()
+            except Exception as e:
+                entry['error'] = str(e)
+                print(f"[WARN] Skipping account {account['account_id']}: {e}")
+                continue
+            base = {
+                'account': account,
+                'account_id': account['account_id'],
+                'check_options': check_options,
+            }
+            if global_checks:
+                units.append(dict(base, region=None, checks=global_checks))
+            for region in entry['regions'] if regional_checks else []:
+                units.append(dict(base, region=region, checks=regional_checks))
+
+    # spawn rather than fork: worker processes must not inherit locks, SQLite
+    # connections or boto3 state from a multi-threaded parent
+    context = multiprocessing.get_context('spawn')
+    workers = max(1, min(max_workers, len(units) or 1))
+    queued = iter(units)
+
+    def merge(unit, scan):
+        entry = result['accounts'][unit['account_id']]
+        for name, check_result in scan['checks'].items():
+            merged = entry['checks'].setdefault(name, {'findings': [], 'errors': {}, 'error': None, 'duration': 0})
+            merged['findings'].extend(check_result['findings'])
+            merged['duration'] = max(merged['duration'], check_result.get('duration') or 0)
+            if check_result.get('error'):
+                merged['errors'][unit['region'] or 'global'] = check_result['error']
+
+    def failed(unit, e):
+        return {'checks': {name: {'findings': [], 'error': str(e), 'duration': 0} for name in unit['checks']}}
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        futures = {}
+
+        def submit_next():
+            # Only as many units as there are workers are submitted at a time, and each
+            # one gets the credentials from the cache (re-assumed near expiry) as it goes
+            for unit in queued:
+                try:
+                    unit_credentials = credentials.get(unit['account'])
+                except Exception as e:
+                    merge(unit, failed(unit, e))
+                    continue
+                work = {key: value for key, value in unit.items() if key != 'account'}
+                futures[pool.submit(_scan_unit, dict(work, credentials=unit_credentials))] = unit
+                return
+
+        for _ in range(workers):
+            submit_next()
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                unit = futures.pop(future)
+                try:
+                    scan = future.result()
+                except Exception as e:
+                    scan = failed(unit, e)
+                merge(unit, scan)
+                submit_next()
+
+    for entry in result['accounts'].values():
+        for check_result in entry['checks'].values():
+            if check_result['errors'] and not check_result['findings']:
+                check_result['error'] = '; '.join(f"{k}: {v}" for k, v in check_result['errors'].items())
+            result['total_issues'] += len(check_result['findings'])
+        result['errors'] += int(bool(entry['error'])) + sum(1 for c in entry['checks'].values() if c['error'])
+
+    result['duration'] = round(time.perf_counter() - start, 3)
+    result['finished'] = datetime.now().isoformat()
+    return result
+
+
+def test_accounts(base_session, accounts):
+    """Assume the role in every account and report the caller identity, like /api/aws/test"""
+    credentials = CredentialCache(base_session)
+
+    def identify(account):
+        try:
+            identity = credentials.session(account).client('sts').get_caller_identity()
+            return {'account_id': account['account_id'], 'name': account['name'], 'status': 'connected',
+                    'user_arn': identity.get('Arn')}
+        except Exception as e:
+            return {'account_id': account['account_id'], 'name': account['name'], 'status': 'error',
+                    'error': str(e)}
+
+    with ThreadPoolExecutor(max_workers=min(32, max(1, len(accounts)))) as pool:
+        return list(pool.map(identify, accounts))
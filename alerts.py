@@ -0,0 +1,259 @@
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+
+from modules.cache import state_path
+from modules.ratelimit import TokenBucket
+
+# A finding already alerted on a channel isn't sent there again within this
+# many seconds (CSPM_ALERT_DEDUPE_WINDOW)
+DEFAULT_DEDUPE_WINDOW = 6 * 3600
+
+# Lines per check in one digest, the rest is summarized as "... and N more"
+MAX_LINES_PER_SECTION = 50
+
+PLACEHOLDER_WEBHOOK = "https://hooks.slack.com/services/XXXXXXXXX"
+
+
+class SMTPChannel:
+    """Email digests over one SMTP connection that is kept open and reused"""
+
+    name = 'email'
+
+    def __init__(self, host, port=587, username=None, password=None, starttls=True, sender=None,
+                 recipients=(), rate=1.0):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.sender = sender or username
+        self.recipients = list(recipients)
+        self.bucket = TokenBucket(rate, 1)
+        self._server = None
+
+    def _connection(self):
+        import smtplib
+
+        if self._server is not None:
+            try:
+                if self._server.noop()[0] == 250:
+                    return self._server
+            except (smtplib.SMTPException, OSError):
+                pass
+        server = smtplib.SMTP(self.host, self.port, timeout=30)
+        if self.starttls:
+            server.starttls()
+        if self.username:
+            server.login(self.username, self.password)
+        self._server = server
+        return server
+
+    def send(self, subject, body):
+        from email.message import EmailMessage
+
+        msg = EmailMessage()
+        msg.set_content(body)
+        msg['Subject'] = subject
+        msg['From'] = self.sender
+        msg['To'] = ', '.join(self.recipients)
+        self._connection().send_message(msg)
+
+    def close(self):
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except Exception:
+                pass
+            self._server = None
+
+
+class SlackChannel:
+    """Slack digests through an incoming webhook, on a pooled HTTP session"""
+
+    name = 'slack'
+
+    def __init__(self, webhook_url, rate=1.0):
+        self.webhook_url = webhook_url
+        self.bucket = TokenBucket(rate, 1)
+        self._session = None
+
+    def send(self, subject, body):
+        if self._session is None:
+            import requests
+            self._session = requests.Session()
+        response = self._session.post(self.webhook_url, json={"text": f"*{subject}*\n{body}"}, timeout=30)
+        if response.status_code != 200:
+            raise RuntimeError(f"Slack returned {response.status_code}: {response.text}")
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+
+def _line_key(channel, title, line):
+    return hashlib.sha256(f"{channel}\0{title}\0{line}".encode('utf-8')).hexdigest()[:32]
+
+
+class AlertDispatcher:
+    """Collects alert lines from every check and sends one digest per channel in the background.
+
+    add() queues lines under a section title, flush() hands everything
+    collected so far to the sender thread as one digest, and close() sends
+    what is left and waits for delivery. Lines sent on a channel within the
+    dedupe window are dropped from later digests on that channel (the
+    window is kept in .cspm/alerts.json so it spans runs). Each channel is
+    rate limited with its own token bucket.
+    """
+
+    def __init__(self, channels, dedupe_window=DEFAULT_DEDUPE_WINDOW, state_file=None):
+        self.channels = list(channels)
+        self.dedupe_window = dedupe_window
+        self.state_file = state_file
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.sent = self._load_state()
+        self.delivered = 0
+        self._queue = queue.Queue()
+        self._thread = None
+
+    def _load_state(self):
+        if not self.state_file or not os.path.exists(self.state_file):
+            return {}
+        try:
+            with open(self.state_file) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_state(self):
+        if not self.state_file:
+            return
+        now = time.time()
+        with self.lock:
+            sent = {key: at for key, at in self.sent.items() if now - at < self.dedupe_window}
+        with open(self.state_file, 'w') as f:
+            json.dump(sent, f)
+
+    def add(self, title, lines):
+        lines = [str(line) for line in lines]
+        if not lines or not self.channels:
+            return
+        with self.lock:
+            section = self.pending.setdefault(title, [])
+            section.extend(line for line in lines if line not in section)
+
+    def flush(self):
+        with self.lock:
+            digest, self.pending = self.pending, {}
+        if not digest:
+            return
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='cspm-alerts', daemon=True)
+            self._thread.start()
+        self._queue.put(digest)
+
+    def close(self, timeout=60):
+        self.flush()
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                # Still sending: its channels are in use and its sent keys aren't final
+                print(f"[WARN] Alert delivery still running after {timeout}s, not closing channels")
+                return
+            self._thread = None
+        for channel in self.channels:
+            channel.close()
+        self._save_state()
+
+    def _run(self):
+        while True:
+            digest = self._queue.get()
+            if digest is None:
+                return
+            for channel in self.channels:
+                self._deliver(channel, digest)
+
+    def _deliver(self, channel, digest):
+        now = time.time()
+        sections = {}
+        keys = []
+        with self.lock:
+            for title, lines in digest.items():
+                fresh = []
+                for line in lines:
+                    key = _line_key(channel.name, title, line)
+                    if now - self.sent.get(key, 0) < self.dedupe_window:
+                        continue
+                    fresh.append(line)
+                    # Lines past the section limit are only counted, so they stay unsent
+                    if len(fresh) <= MAX_LINES_PER_SECTION:
+                        keys.append(key)
+                if fresh:
+                    sections[title] = fresh
+        if not sections:
+            print(f"[INFO] No new alerts for {channel.name}, skipping")
+            return
+
+        total = sum(len(lines) for lines in sections.values())
+        subject = f"CSPM Alert: {total} finding(s) in {len(sections)} check(s)"
+        body = []
+        for title, lines in sections.items():
+            body.append(f"{title} ({len(lines)}):")
+            body.extend(f"- {line}" for line in lines[:MAX_LINES_PER_SECTION])
+            if len(lines) > MAX_LINES_PER_SECTION:
+                body.append(f"... and {len(lines) - MAX_LINES_PER_SECTION} more")
+            body.append("")
+
+        channel.bucket.acquire()
+        try:
+            channel.send(subject, "\n".join(body))
+        except Exception as e:
+            print(f"[WARN] Failed to send {channel.name} alert: {e}")
+            return
+        with self.lock:
+            for key in keys:
+                self.sent[key] = now
+            self.delivered += 1
+        print(f"[INFO] {channel.name} alert sent ({total} finding(s))")
+
+
+def dispatcher_from_env():
+    """AlertDispatcher with the channels configured in the environment.
+
+    Email: CSPM_SMTP_HOST, CSPM_SMTP_PORT (587), CSPM_SMTP_USER,
+    CSPM_SMTP_PASSWORD, CSPM_SMTP_STARTTLS (1), CSPM_ALERT_FROM and
+    CSPM_ALERT_TO (comma separated). Slack: CSPM_SLACK_WEBHOOK.
+    CSPM_ALERT_RATE limits messages per second per channel (default 1).
+    """
+    rate = float(os.getenv('CSPM_ALERT_RATE', '1'))
+    channels = []
+    recipients = [r.strip() for r in os.getenv('CSPM_ALERT_TO', '').split(',') if r.strip()]
+    if os.getenv('CSPM_SMTP_HOST') and recipients:
+        channels.append(SMTPChannel(
+            os.getenv('CSPM_SMTP_HOST'),
+            int(os.getenv('CSPM_SMTP_PORT', '587')),
+            os.getenv('CSPM_SMTP_USER'),
+            os.getenv('CSPM_SMTP_PASSWORD'),
+            starttls=os.getenv('CSPM_SMTP_STARTTLS', '1') == '1',
+            sender=os.getenv('CSPM_ALERT_FROM'),
+            recipients=recipients,
+            rate=rate,
+        ))
+    else:
+        print("[WARN] Email alerts not configured (CSPM_SMTP_HOST, CSPM_ALERT_TO). Skipping email alerts.")
+    webhook = os.getenv('CSPM_SLACK_WEBHOOK')
+    if webhook and not webhook.startswith(PLACEHOLDER_WEBHOOK):
+        channels.append(SlackChannel(webhook, rate=rate))
+    else:
+        print("[WARN] Slack webhook not set or invalid. Skipping Slack alert.")
+    return AlertDispatcher(
+        channels,
+        dedupe_window=int(os.getenv('CSPM_ALERT_DEDUPE_WINDOW', DEFAULT_DEDUPE_WINDOW)),
+        state_file=state_path('alerts.json'),
+    )
@@ -1,5 +1,6 @@
-from flask import Flask, render_template, jsonify, request
+from flask import Flask, render_template, jsonify, request, Response
 import boto3
+import hashlib
 import json
 import os
 from datetime import datetime
@@ -11,132 +12,505 @@ from dotenv import load_dotenv
 load_dotenv()
 
 # Import CSPM modules
-from modules.s3_check import check_public_buckets
-from modules.iam_check import list_admin_users
-from modules.ec2_check import check_public_ec2
-from modules.cloudtrail_check import check_cloudtrail_enabled
-from modules.sg_check import check_security_groups
+from modules.scanner import run_scan
+from modules.cache import get_inventory_cache
+from modules.checkpoint import get_checkpoint_store
+from modules.incremental import run_incremental_scan, save_scan_state
+from modules.metrics import api_metrics
+from modules.accounts import load_accounts, run_multi_account_scan, test_accounts
+from modules.cache import state_path
+from modules.fingerprints import delta_counts, update_fingerprints
+from modules.results import CATEGORIES, ResultsStore
+from modules.progress import ScanCancelled, ScanEvents
+from modules.jobs import JobManager
+from modules.scheduler import scheduler_from_env
+from modules.scanner import CHECKS
 
 app = Flask(__name__)
 
-# Global variable to store scan results
-scan_results = {
-    'last_scan': None,
-    's3_findings': [],
-    'iam_findings': [],
-    'ec2_findings': [],
-    'cloudtrail_findings': [],
-    'sg_findings': [],
-    'scan_status': 'idle',
-    'total_issues': 0
-}
-
-def perform_aws_scan():
-    """Perform AWS security scan and update global results"""
-    global scan_results
+# Scan results and history. Scans run as jobs on a bounded pool of background
+# threads (see job_manager below); a scan's findings become visible all at
+# once when it completes.
+results_store = ResultsStore()
+
+aws_session = None
+aws_session_lock = threading.Lock()
+
+# Live progress of running (and recently finished) scans for /api/scan/events
+scan_events = ScanEvents()
+
+# Seconds between SSE keep-alive comments while a scan has nothing new to report
+SSE_KEEPALIVE = 15
+
+def _value(finding, field):
+    # Findings are plain strings for S3/IAM, except in multi-account scans where they carry the account
+    return finding[field] if isinstance(finding, dict) else finding
+
+def _account(finding):
+    return finding.get('Account') if isinstance(finding, dict) else None
+
+def format_findings(checks):
+    """Turn raw check findings into the dashboard's finding lists"""
+    def findings(name):
+        return checks.get(name, {}).get('findings', [])
+    
+    return {
+        's3_findings': [{'bucket': _value(bucket, 'Bucket'), 'account': _account(bucket), 'risk': 'High', 'type': 'Public Access'} for bucket in findings('s3')],
+        'iam_findings': [{'user': _value(user, 'UserName'), 'account': _account(user), 'risk': 'Medium', 'type': 'Admin Access'} for user in findings('iam')],
+        'ec2_findings': [{'instance': f"{ec2['InstanceId']}", 'ip': ec2['PublicIp'], 'region': ec2.get('Region'), 'account': ec2.get('Account'), 'risk': 'High', 'type': 'Public Instance'} for ec2 in findings('ec2')],
+        'cloudtrail_findings': [{'issue': ct['Issue'], 'region': ct.get('Region'), 'account': ct.get('Account'), 'risk': 'Medium', 'type': 'Logging Issue'} for ct in findings('cloudtrail')],
+        'sg_findings': [{'group': sg['GroupId'], 'port': sg['Port'], 'protocol': sg['Protocol'], 'cidr': sg['Cidr'], 'region': sg.get('Region'), 'account': sg.get('Account'), 'risk': 'High', 'type': 'Open Access'} for sg in findings('sg')],
+        'exposure_findings': [{'instance': ex['InstanceId'], 'ip': ex['PublicIp'], 'groups': ex['GroupIds'], 'ports': ex['OpenPorts'], 'region': ex.get('Region'), 'account': ex.get('Account'), 'risk': 'Critical', 'type': 'Reachable Public Instance'} for ex in findings('exposure')],
+    }
+
+def _scan_progress(events):
+    """run_scan progress callback publishing to a scan's event stream, findings in the dashboard format"""
+    keys = dict(CATEGORIES)
+    def progress(event, data):
+        if event == 'findings':
+            check = data['check']
+            findings = format_findings({check: {'findings': data['findings']}})[keys[check]]
+            data = dict(data, type=_api_key(check), findings=findings)
+        events.publish(event, data)
+    return progress
+
+def _aws_session():
+    """The boto3 session shared by all scans, so they share its clients and inventory cache hooks.
     
+    A forced refresh is a setting of its scan (run_scan(refresh=True)), checked
+    by the cache hooks on every call, so it shares the session too.
+    """
+    global aws_session
+    with aws_session_lock:
+        if aws_session is None:
+            aws_session = boto3.Session()
+        return aws_session
+
+def _select_accounts(account):
+    """Accounts from CSPM_ACCOUNTS_FILE for a job's 'account': 'all', an account ID or a name"""
+    accounts = load_accounts()
+    if account == 'all':
+        return accounts
+    selected = [a for a in accounts if account in (a['account_id'], a['name'])]
+    if not selected:
+        raise ValueError(f"Unknown account: {account}")
+    return selected
+
+def perform_aws_scan(job):
+    """Run a scan job and store its results as scan job.id"""
+    scan_id, params = job.id, job.params
+    events = scan_events.get(scan_id) or scan_events.open(scan_id)
     try:
-        scan_results['scan_status'] = 'scanning'
-        scan_results['last_scan'] = datetime.now().isoformat()
-        
-        # Initialize AWS session
-        session = boto3.Session()
-        
-        print("Starting AWS security scan...")
-        
-        # S3 Check
-        print("Scanning S3 buckets...")
-        s3_findings = check_public_buckets(session)
-        scan_results['s3_findings'] = [{'bucket': bucket, 'risk': 'High', 'type': 'Public Access'} for bucket in s3_findings]
-        
-        # IAM Check
-        print("Scanning IAM users...")
-        iam_findings = list_admin_users(session)
-        scan_results['iam_findings'] = [{'user': user, 'risk': 'Medium', 'type': 'Admin Access'} for user in iam_findings]
+        if job.cancelled.is_set():
+            raise ScanCancelled()
+        results_store.start_scan(scan_id)
+        # Checkpointed scans pick up what an interrupted scan with the same parameters collected
+        checkpoints = None if params.get('account') or params.get('incremental') else get_checkpoint_store()
+        session = _aws_session()
         
-        # EC2 Check
-        print("Scanning EC2 instances...")
-        ec2_findings = check_public_ec2(session)
-        scan_results['ec2_findings'] = [{'instance': f"{ec2['InstanceId']}", 'ip': ec2['PublicIp'], 'risk': 'High', 'type': 'Public Instance'} for ec2 in ec2_findings]
+        print(f"Starting AWS security scan {scan_id}...")
+        if params.get('account'):
+            # Accounts from CSPM_ACCOUNTS_FILE, through STS AssumeRole. The accounts are scanned
+            # in worker processes, so only the scan's start and end are streamed, and a
+            # cancelled scan is only discarded once its processes finish.
+            events.publish('scan_started', {'scan_mode': 'multi_account'})
+            result = run_multi_account_scan(session, _select_accounts(params['account']), checks=params.get('checks'),
+                                            regions=params.get('regions'), check_options=params.get('check_options'))
+            if job.cancelled.is_set():
+                raise ScanCancelled()
+            results = {key: [] for key in format_findings({})}
+            for account in result['accounts'].values():
+                for key, findings in format_findings(account['checks']).items():
+                    results[key].extend(findings)
+            meta = {
+                'accounts': {
+                    account_id: {'name': account['name'], 'regions': account['regions'], 'error': account['error'],
+                                 'checks': {name: {k: v for k, v in r.items() if k != 'findings'} for name, r in account['checks'].items()}}
+                    for account_id, account in result['accounts'].items()
+                },
+                'checks': {},
+                'scan_duration': result['duration'],
+                'regions': sorted({r for a in result['accounts'].values() for r in a['regions']}),
+                'scan_mode': 'multi_account',
+            }
+            delta = update_fingerprints(result, state_path('fingerprints_accounts.json'))
+        else:
+            if params.get('incremental'):
+                events.publish('scan_started', {'scan_mode': 'incremental'})
+                scan = run_incremental_scan(session, cache=get_inventory_cache())
+                if job.cancelled.is_set():
+                    raise ScanCancelled()
+            else:
+                scan = run_scan(session, checks=params.get('checks'), regions=params.get('regions'),
+                                check_options=params.get('check_options'), cache=get_inventory_cache(),
+                                refresh=params.get('force_refresh'), progress=_scan_progress(events),
+                                cancelled=job.cancelled, checkpoints=checkpoints, restart=params.get('restart'))
+                save_scan_state(scan)
+            checks = scan['checks']
+            results = format_findings(checks)
+            meta = {
+                # Per-check timing and errors
+                'checks': {
+                    name: {key: value for key, value in result.items() if key != 'findings'}
+                    for name, result in checks.items()
+                },
+                'accounts': {},
+                'scan_duration': scan['duration'],
+                'regions': scan['regions'],
+                'scan_mode': scan.get('mode', 'full'),
+            }
+            if scan.get('checkpoint'):
+                meta['checkpoint'] = scan['checkpoint']
+            delta = update_fingerprints(scan)
         
-        # CloudTrail Check
-        print("Checking CloudTrail...")
-        ct_findings = check_cloudtrail_enabled(session)
-        scan_results['cloudtrail_findings'] = [{'issue': issue, 'risk': 'Medium', 'type': 'Logging Issue'} for issue in ct_findings]
-        
-        # Security Groups Check
-        print("Scanning Security Groups...")
-        sg_findings = check_security_groups(session)
-        scan_results['sg_findings'] = [{'group': sg['GroupId'], 'port': sg['Port'], 'protocol': sg['Protocol'], 'risk': 'High', 'type': 'Open Access'} for sg in sg_findings]
-        
-        # Calculate total issues
-        scan_results['total_issues'] = (
-            len(scan_results['s3_findings']) +
-            len(scan_results['iam_findings']) +
-            len(scan_results['ec2_findings']) +
-            len(scan_results['cloudtrail_findings']) +
-            len(scan_results['sg_findings'])
-        )
+        # What changed since the previous scan, for /api/findings?changes=1
+        meta['delta'] = {
+            'counts': delta_counts(delta),
+            'new': format_findings({name: {'findings': findings} for name, findings in delta['new'].items()}),
+            'resolved': delta['resolved'],
+        }
         
-        scan_results['scan_status'] = 'completed'
-        print(f"Scan completed. Total issues found: {scan_results['total_issues']}")
+        # A scan of some checks only (scheduled or requested) keeps the other checks' latest findings
+        carry_forward = []
+        if params.get('checks') and not params.get('account'):
+            carry_forward = [category for category, _ in CATEGORIES if category not in params['checks']]
+        results_store.complete_scan(scan_id, results, meta, carry_forward)
+        total = sum(len(v) for v in results.values())
+        events.publish('scan_completed', {'scan_id': scan_id, 'total_issues': total, 'scan_duration': meta['scan_duration'],
+                                          'changes': meta['delta']['counts']})
+        print(f"Scan {scan_id} completed. Total issues found: {total}")
         
+    except ScanCancelled:
+        results_store.cancel_scan(scan_id)
+        events.publish('scan_cancelled', {'scan_id': scan_id})
+        print(f"Scan {scan_id} cancelled")
     except Exception as e:
-        scan_results['scan_status'] = 'error'
-        scan_results['error'] = str(e)
-        print(f"Scan failed: {e}")
+        results_store.fail_scan(scan_id, str(e))
+        events.publish('scan_failed', {'scan_id': scan_id, 'error': str(e)})
+        print(f"Scan {scan_id} failed: {e}")
+
+# Scan jobs, run by perform_aws_scan on CSPM_JOB_WORKERS threads
+job_manager = JobManager(perform_aws_scan)
+
+def _api_key(category):
+    # The API calls the security group findings 'security_groups'
+    return 'security_groups' if category == 'sg' else category
+
+def _conditional(etag):
+    """304 response if the client already has this ETag, else None"""
+    if etag in request.if_none_match:
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+    return None
+
+def _etag(*parts):
+    # Completed scans never change, so the scan IDs and statuses and the query
+    # fully determine a response
+    raw = json.dumps([parts, sorted(request.args.items(multi=True))], default=str)
+    return hashlib.sha1(raw.encode()).hexdigest()
 
 @app.route('/')
 def dashboard():
     """Serve the main dashboard"""
     return render_template('dashboard.html')
 
-@app.route('/api/scan/start', methods=['POST'])
-def start_scan():
-    """Start a new AWS security scan"""
-    if scan_results['scan_status'] == 'scanning':
-        return jsonify({'status': 'already_scanning'})
+def _job_params(body):
+    """Scan job parameters from a request body, raising ValueError for invalid ones"""
+    # Optional region fan-out: {"regions": "all"} or {"regions": ["us-east-1", "eu-west-1"]}
+    regions = body.get('regions')
+    
+    # Optional check selection: {"checks": ["sg", "exposure"]} (default: every check)
+    checks = body.get('checks')
+    if isinstance(checks, str):
+        checks = [c.strip() for c in checks.split(',') if c.strip()]
+    if checks:
+        checks = ['sg' if c == 'security_groups' else c for c in checks]
+        unknown = [c for c in checks if c not in CHECKS]
+        if unknown:
+            raise ValueError(f"Unknown check(s): {', '.join(unknown)}")
+    
+    # Optional S3 subset: {"s3_prefix": "logs-"} and/or {"s3_tags": {"env": "prod"}}
+    check_options = {}
+    if body.get('s3_prefix') or body.get('s3_tags'):
+        check_options['s3'] = {'prefix': body.get('s3_prefix'), 'tags': body.get('s3_tags')}
     
-    # Start scan in background thread
-    scan_thread = threading.Thread(target=perform_aws_scan)
-    scan_thread.daemon = True
-    scan_thread.start()
+    # {"account": "prod"} scans one account from CSPM_ACCOUNTS_FILE (by ID or name) through
+    # STS AssumeRole, {"account": "all"} (or {"multi_account": true}) every listed account
+    account = body.get('account') or ('all' if body.get('multi_account') else None)
     
-    return jsonify({'status': 'scan_started'})
+    # {"incremental": true} only re-checks what changed since the last scan (from CloudTrail events)
+    incremental = bool(body.get('incremental'))
+    if incremental and (checks or account):
+        raise ValueError("incremental scans cover every check of the default account")
+    
+    return {
+        'regions': regions,
+        'checks': checks or None,
+        'check_options': check_options,
+        'account': str(account) if account else None,
+        # {"force_refresh": true} skips the inventory cache and re-fetches everything
+        'force_refresh': bool(body.get('force_refresh')),
+        'incremental': incremental,
+        # {"restart": true} starts over instead of resuming an interrupted scan with the same parameters
+        'restart': bool(body.get('restart')),
+    }
+
+def _submit_scan(params):
+    scan_id = results_store.queue_scan(params)
+    # Open the event stream before the scan runs so subscribers never miss the first events
+    scan_events.open(scan_id)
+    job_manager.submit(scan_id, params)
+    return scan_id
+
+def _job(scan):
+    """A scan as a job status"""
+    return {
+        'job_id': scan['id'],
+        'status': scan['status'],
+        'params': scan.get('params', {}),
+        'started': scan['started'],
+        'finished': scan['finished'],
+        'error': scan.get('error'),
+        'total_issues': scan.get('total_issues'),
+        'counts': scan.get('counts'),
+        'checks': scan.get('checks'),
+    }
+
+def _submit_scheduled(checks):
+    # Scheduled scans cover CSPM_REGIONS, like the CLI
+    return _submit_scan(dict(_job_params({'checks': checks, 'regions': os.getenv('CSPM_REGIONS')}), scheduled=True))
+
+# Periodic background scans with an interval per check (CSPM_SCHEDULE=1, see scheduler.py)
+scheduler = scheduler_from_env(_submit_scheduled, lambda job_id: job_manager.get(job_id) is not None)
+
+@app.route('/api/scan/start', methods=['POST'])
+def start_scan():
+    """Start a new AWS security scan (same body as POST /api/jobs)"""
+    try:
+        params = _job_params(request.get_json(silent=True) or {})
+    except ValueError as e:
+        return jsonify({'status': 'error', 'error': str(e)}), 400
+    scan_id = _submit_scan(params)
+    return jsonify({'status': 'scan_started', 'scan_id': scan_id, 'job_id': scan_id})
+
+@app.route('/api/jobs', methods=['POST'])
+def submit_job():
+    """Queue a scan job: {"account": ..., "regions": ..., "checks": [...]}, all optional"""
+    try:
+        params = _job_params(request.get_json(silent=True) or {})
+    except ValueError as e:
+        return jsonify({'status': 'error', 'error': str(e)}), 400
+    scan_id = _submit_scan(params)
+    return jsonify({'job_id': scan_id, 'status': 'queued'}), 202
+
+@app.route('/api/jobs')
+def list_jobs():
+    """Jobs, newest first (?status=queued,scanning&limit=N)"""
+    status = [s for s in request.args.get('status', '').split(',') if s] or None
+    limit = request.args.get('limit', 20, type=int)
+    return jsonify({'jobs': [_job(scan) for scan in results_store.scans(limit, status=status)]})
+
+@app.route('/api/jobs/<int:job_id>')
+def job_status(job_id):
+    """Status of one job, with per-check progress while it is running"""
+    scan = results_store.get_scan(job_id)
+    if scan is None:
+        return jsonify({'status': 'error', 'error': 'no such job'}), 404
+    job = _job(scan)
+    stream = scan_events.get(job_id)
+    if stream is not None and scan['status'] == 'scanning':
+        job['progress'] = {
+            event: sum(1 for _, name, _ in stream.events if name == event)
+            for event in ('check_completed', 'region_completed')
+        }
+    return jsonify(job)
+
+@app.route('/api/jobs/<int:job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    """Cancel a queued or running job"""
+    state = job_manager.cancel(job_id)
+    if state is None:
+        scan = results_store.get_scan(job_id)
+        if scan is None:
+            return jsonify({'status': 'error', 'error': 'no such job'}), 404
+        return jsonify({'job_id': job_id, 'status': scan['status']}), 409
+    if state == 'queued':
+        # Never started, so nothing else will record it
+        results_store.cancel_scan(job_id)
+        scan_events.get(job_id).publish('scan_cancelled', {'scan_id': job_id})
+        return jsonify({'job_id': job_id, 'status': 'cancelled'})
+    # The scan stops at its next finding, region or check and records itself as cancelled
+    return jsonify({'job_id': job_id, 'status': 'cancelling'}), 202
 
 @app.route('/api/scan/status')
 def scan_status():
-    """Get current scan status and results"""
-    return jsonify(scan_results)
+    """Get current scan status and the latest completed results"""
+    current = results_store.latest()
+    completed = results_store.latest(completed=True)
+    etag = _etag(current and (current['id'], current['status']), completed and completed['id'])
+    cached = _conditional(etag)
+    if cached:
+        return cached
+    
+    status = {
+        'last_scan': current['started'] if current else None,
+        'scan_status': current['status'] if current else 'idle',
+        'scan_id': current['id'] if current else None,
+        'total_issues': 0,
+        'checks': {},
+    }
+    if current and current['status'] == 'error':
+        status['error'] = current.get('error')
+    if completed:
+        results, _ = results_store.findings(completed['id'])
+        status.update(results)
+        status.update({key: completed.get(key) for key in ('checks', 'accounts', 'scan_duration', 'regions', 'scan_mode', 'total_issues')})
+        status['completed_scan_id'] = completed['id']
+    else:
+        status.update({key: [] for _, key in CATEGORIES})
+    response = jsonify(status)
+    response.set_etag(etag)
+    return response
+
+def _sse(seq, event, data):
+    return f"id: {seq}\nevent: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+@app.route('/api/scan/events')
+def scan_progress_events():
+    """Live progress of the latest (or ?scan_id=N) scan as Server-Sent Events.
+    
+    Events: scan_started, check_started, findings (a batch of new findings in
+    the /api/findings format), region_completed, check_completed, and finally
+    scan_completed or scan_failed, after which the stream ends. Reconnecting
+    clients resume after the Last-Event-ID they received; replayed findings
+    events past the most recent ones only have their 'count'.
+    """
+    scan_id = request.args.get('scan_id', type=int)
+    scan = results_store.get_scan(scan_id) if scan_id else results_store.latest()
+    if scan is None:
+        return jsonify({'status': 'error', 'error': 'no such scan'}), 404
+    stream = scan_events.get(scan['id'])
+    after = request.headers.get('Last-Event-ID', request.args.get('last_event_id', 0), type=int)
+    
+    def events():
+        if stream is None:
+            # Finished before this process started (or fell out of the retained streams)
+            if scan['status'] == 'completed':
+                yield _sse(1, 'scan_completed', {'scan_id': scan['id'], 'total_issues': scan.get('total_issues', 0),
+                                                 'scan_duration': scan.get('scan_duration'),
+                                                 'changes': (scan.get('delta') or {}).get('counts', {})})
+            else:
+                yield _sse(1, 'scan_failed', {'scan_id': scan['id'], 'error': scan.get('error')})
+            return
+        seq = after
+        while True:
+            batch, closed = stream.read(seq, timeout=SSE_KEEPALIVE)
+            for seq, event, data in batch:
+                yield _sse(seq, event, data)
+            if closed:
+                return
+            if not batch:
+                yield ': keepalive\n\n'
+    
+    return Response(events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/scans')
+def scan_history():
+    """Previous scans, newest first (?limit=N)"""
+    limit = request.args.get('limit', 20, type=int)
+    return jsonify({'scans': [
+        {key: value for key, value in scan.items() if key != 'delta'}
+        for scan in results_store.scans(limit)
+    ]})
 
 @app.route('/api/findings')
 def get_findings():
-    """Get all security findings"""
-    return jsonify({
-        'summary': {
-            's3_issues': len(scan_results['s3_findings']),
-            'iam_issues': len(scan_results['iam_findings']),
-            'ec2_issues': len(scan_results['ec2_findings']),
-            'cloudtrail_issues': len(scan_results['cloudtrail_findings']),
-            'sg_issues': len(scan_results['sg_findings']),
-            'total_issues': scan_results['total_issues'],
-            'last_scan': scan_results['last_scan'],
-            'status': scan_results['scan_status']
-        },
-        'findings': {
-            's3': scan_results['s3_findings'],
-            'iam': scan_results['iam_findings'],
-            'ec2': scan_results['ec2_findings'],
-            'cloudtrail': scan_results['cloudtrail_findings'],
-            'security_groups': scan_results['sg_findings']
-        }
-    })
+    """Security findings of the latest (or ?scan_id=N) scan.
+    
+    Filters: type (s3, iam, ec2, cloudtrail, security_groups, exposure), risk,
+    region, account; each can be repeated or comma separated. Pagination:
+    page and per_page (all findings when per_page is not given). With
+    ?changes=1 only the findings new or resolved since the previous scan.
+    Responses carry an ETag; If-None-Match gets a 304 while nothing changed.
+    """
+    current = results_store.latest()
+    scan_id = request.args.get('scan_id', type=int)
+    scan = results_store.get_scan(scan_id) if scan_id else results_store.latest(completed=True)
+    # ?scan_id=N may name a scan that is still queued or running, so its own status is part of the ETag
+    etag = _etag(current and (current['id'], current['status']),
+                 scan and (scan['id'], scan['status'], scan['finished']))
+    cached = _conditional(etag)
+    if cached:
+        return cached
+    
+    summary = {
+        'scan_id': scan['id'] if scan else None,
+        'last_scan': current['started'] if current else None,
+        'status': current['status'] if current else 'idle',
+    }
+    if request.args.get('changes'):
+        delta = (scan or {}).get('delta') or {'counts': {}, 'new': format_findings({}), 'resolved': {}}
+        new = delta['new']
+        response = jsonify({
+            'summary': dict(delta['counts'], **summary),
+            'new': {_api_key(category): new[key] for category, key in CATEGORIES},
+            'resolved': delta['resolved']
+        })
+        response.set_etag(etag)
+        return response
+    
+    def values(name):
+        values = [v.strip() for value in request.args.getlist(name) for v in value.split(',') if v.strip()]
+        return values or None
+    
+    categories = values('type')
+    if categories:
+        categories = ['sg' if c == 'security_groups' else c for c in categories]
+    per_page = request.args.get('per_page', type=int)
+    page = max(1, request.args.get('page', 1, type=int))
+    results, total = ({key: [] for _, key in CATEGORIES}, 0)
+    if scan and scan['status'] == 'completed':
+        results, total = results_store.findings(
+            scan['id'], category=categories, risk=values('risk'), region=values('region'), account=values('account'),
+            offset=(page - 1) * per_page if per_page else 0, limit=per_page,
+        )
+    counts = (scan or {}).get('counts', {})
+    summary.update({f"{category}_issues": counts.get(category, 0) for category, _ in CATEGORIES})
+    summary['total_issues'] = (scan or {}).get('total_issues', 0)
+    
+    payload = {
+        'summary': summary,
+        'findings': {_api_key(category): results[key] for category, key in CATEGORIES},
+        'total': total,
+    }
+    if per_page:
+        payload.update({'page': page, 'per_page': per_page, 'pages': (total + per_page - 1) // per_page})
+    response = jsonify(payload)
+    response.set_etag(etag)
+    return response
+
+@app.route('/api/schedule')
+def schedule_status():
+    """Interval, last run, next run and last job of every scheduled check"""
+    if scheduler is None:
+        return jsonify({'enabled': False, 'checks': {}})
+    return jsonify({'enabled': True, 'checks': scheduler.status()})
+
+@app.route('/metrics')
+def metrics():
+    """AWS API call counts, latency, retries and throttling in Prometheus format"""
+    return Response(api_metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/api/aws/test')
 def test_aws_connection():
     """Test AWS credentials and connection"""
     try:
         session = boto3.Session()
+        if request.args.get('all_accounts'):
+            # Check that the audit role can be assumed in every configured account
+            return jsonify({'status': 'checked', 'accounts': test_accounts(session, load_accounts())})
         sts = session.client('sts')
         identity = sts.get_caller_identity()
         
@@ -152,6 +526,11 @@ def test_aws_connection():
             'error': str(e)
         })
 
+# Under a WSGI server the scheduler starts on import. With `python app.py` it
+# starts in the reloader's child process only (see below), not in both.
+if scheduler is not None and __name__ != '__main__':
+    scheduler.start()
+
 if __name__ == '__main__':
     # Create templates directory if it doesn't exist
     os.makedirs('templates', exist_ok=True)
@@ -162,4 +541,7 @@ if __name__ == '__main__':
     print("   - Use 'aws configure' or set environment variables")
     print("   - AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, AWS_DEFAULT_REGION")
     
+    if scheduler is not None and os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        scheduler.start()
+    
     app.run(debug=True, port=5000)
\ No newline at end of file
@@ -1,5 +1,83 @@
+import os
+import threading
+import weakref
+
 import boto3
+from botocore.config import Config
+
+from modules.metrics import api_metrics
+from modules.ratelimit import get_rate_limiter
+
+# Settings for clients created by get_client, overridable with environment
+# variables or configure_clients(). botocore's default pool of 10
+# connections starves the concurrent checks, hence the larger default.
+# Request rates are handled by the shared limiter in ratelimit.py, so the
+# default retry mode is 'standard' rather than botocore's per-client
+# 'adaptive' limiter.
+CLIENT_SETTINGS = {
+    'max_pool_connections': int(os.getenv('CSPM_MAX_POOL_CONNECTIONS', '50')),
+    'retry_mode': os.getenv('CSPM_RETRY_MODE', 'standard'),
+    'max_attempts': int(os.getenv('CSPM_MAX_ATTEMPTS', '10')),
+}
+
+# Values EC2 accepts in one Describe* filter
+MAX_FILTER_VALUES = 200
+
+# session -> {(account, region, service): client}. Weak keys so the clients
+# go away together with the session they were created from.
+_clients = weakref.WeakKeyDictionary()
+_clients_lock = threading.Lock()
+
 
 def get_aws_session(region=None):
     """Returns a boto3 session (uses default credentials chain)."""
     return boto3.Session(region_name=region)
+
+
+def configure_clients(max_pool_connections=None, retry_mode=None, max_attempts=None):
+    """Change the connection pool and retry settings for clients created from now on"""
+    if max_pool_connections is not None:
+        CLIENT_SETTINGS['max_pool_connections'] = max_pool_connections
+    if retry_mode is not None:
+        CLIENT_SETTINGS['retry_mode'] = retry_mode
+    if max_attempts is not None:
+        CLIENT_SETTINGS['max_attempts'] = max_attempts
+
+
+def client_config():
+    return Config(
+        max_pool_connections=CLIENT_SETTINGS['max_pool_connections'],
+        retries={'mode': CLIENT_SETTINGS['retry_mode'], 'max_attempts': CLIENT_SETTINGS['max_attempts']},
+    )
+
+
+def _account_key(session):
+    credentials = session.get_credentials()
+    return credentials.access_key if credentials else None
+
+
+def get_client(session, service, region=None):
+    """Shared client for (region, service), created once per session.
+
+    Thread-safe: boto3 sessions must not create clients from several threads
+    at once, so creation happens under a lock and every check module and
+    worker thread reuses the same client afterwards. Clients are
+    instrumented for the API call metrics and go through the shared rate
+    limiter. Clients are kept per session rather than per access key:
+    refreshed or assumed-role credentials rotate the key but still sign
+    through the same session and its clients.
+    """
+    region = region or session.region_name
+    with _clients_lock:
+        clients = _clients.setdefault(session, {})
+        key = (region, service)
+        client = clients.get(key)
+        if client is None:
+            client = session.client(service, region_name=region, config=client_config())
+            api_metrics.instrument(client)
+            limiter = get_rate_limiter()
+            if limiter is not None:
+                # The key the session signs with when the client is created names its budget
+                limiter.attach(client, account=_account_key(session))
+            clients[key] = client
+        return client
@@ -0,0 +1,78 @@
+"""Measure CLI startup time: `cli.py --help`, and everything a run does
+before its first AWS call (importing the CLI and the selected check modules,
+creating their clients) for a single check versus every check.
+
+Runs each case in a fresh interpreter (no AWS calls are made, clients are
+created with dummy credentials) and prints the median wall time. Run from
+anywhere:
+
+    python benchmarks/cli_startup.py [--runs 10]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# AWS services each check creates clients for
+CHECK_SERVICES = {
+    's3': ['s3'],
+    'iam': ['iam'],
+    'ec2': ['ec2'],
+    'cloudtrail': ['cloudtrail'],
+    'sg': ['ec2'],
+    'exposure': ['ec2'],
+}
+
+LOAD_CHECKS = (
+    "import cli\n"
+    "import boto3\n"
+    "from modules.aws_config import get_client\n"
+    "from modules.scanner import get_check\n"
+    "session = boto3.Session(aws_access_key_id='x', aws_secret_access_key='x', region_name='us-east-1')\n"
+    "for name in {names!r}:\n"
+    "    get_check(name)\n"
+    "for service in {services!r}:\n"
+    "    get_client(session, service)\n"
+)
+
+
+def load_checks(names):
+    services = sorted({service for name in names for service in CHECK_SERVICES[name]})
+    return [sys.executable, '-c', LOAD_CHECKS.format(names=names, services=services)]
+
+
+CASES = [
+    ('python -c pass (interpreter)', [sys.executable, '-c', 'pass']),
+    ('cli.py --help', [sys.executable, 'cli.py', '--help']),
+    ('--check iam (imports + clients)', load_checks(['iam'])),
+    ('--check sg (imports + clients)', load_checks(['sg'])),
+    ('--check all (imports + clients)', load_checks(list(CHECK_SERVICES))),
+]
+
+
+def measure(command, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=ROOT, check=True, stdout=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings), min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+
+    print(f"{'case':<36} {'median':>9} {'best':>9}")
+    for name, command in CASES:
+        median, best = measure(command, args.runs)
+        print(f"{name:<36} {median * 1000:>7.1f}ms {best * 1000:>7.1f}ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+"""Benchmark every check, and the rule engine, against a large synthetic account.
+
+Runs each check offline against SyntheticAccount (10k buckets, 50k
+instances, 5k IAM users, 20k security group rules at --scale 1): no AWS
+account, credentials or network needed. For each case it reports the
+median wall time, throughput (resources processed per second), API calls
+made, findings and peak Python memory (tracemalloc, in a separate run so
+it doesn't skew the timings). The inventory cache and rate limiter are
+disabled, so every run does the full work. The 'scan' case runs all the
+checks through run_scan, as the CLI and dashboard do, writing to an empty
+inventory cache and checkpoint store in a temporary directory.
+
+--save-baseline writes the results to benchmarks/baselines.json (per
+scale); later runs are compared against it and exit with status 1 if a
+case got slower or used more memory than --tolerance allows, or if its
+API calls or findings changed at all. Timings depend on the machine, so
+save the baseline on the machine you compare on. Run from anywhere:
+
+    python benchmarks/scan_benchmark.py [--scale 0.1] [--checks s3 iam scan] [--save-baseline]
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINES = os.path.join(ROOT, 'benchmarks', 'baselines.json')
+
+# The checks are imported as modules.<name>, like the CLI does
+sys.path.insert(0, os.path.dirname(ROOT))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ['CSPM_CACHE'] = '0'
+os.environ['CSPM_RATE_LIMIT'] = '0'
+
+import boto3  # noqa: E402
+
+from synthetic_account import RULES_PER_GROUP, SyntheticAccount  # noqa: E402
+
+# Resources each case works through, for throughput
+CASE_RESOURCES = {
+    's3': lambda account: account.buckets,
+    'iam': lambda account: account.users + account.iam_groups + account.roles,
+    'ec2': lambda account: account.instances,
+    'cloudtrail': lambda account: account.trails,
+    'sg': lambda account: account.groups * RULES_PER_GROUP,
+    'exposure': lambda account: account.instances,
+    'rules': lambda account: account.buckets + account.users + account.iam_groups + account.roles
+    + account.instances + account.groups * RULES_PER_GROUP + account.trails,
+    'scan': lambda account: account.buckets + account.users + account.iam_groups + account.roles
+    + 2 * account.instances + account.groups * RULES_PER_GROUP + account.trails,
+}
+
+DEFAULT_TOLERANCE = 0.5
+
+# Slowdowns smaller than this many seconds are noise, not regressions
+MIN_SLOWDOWN = 0.1
+
+
+def make_account(scale):
+    return SyntheticAccount(buckets=int(10_000 * scale), instances=int(50_000 * scale),
+                            users=int(5_000 * scale), sg_rules=int(20_000 * scale))
+
+
+def run_case(name, account):
+    """Run one case on a fresh session, returning (seconds, findings, calls)"""
+    session = account.attach(boto3.Session(aws_access_key_id='synthetic', aws_secret_access_key='synthetic',
+                                           region_name=account.region))
+    account.calls.clear()
+    start = time.perf_counter()
+    if name == 'rules':
+        from modules.rules import run_rule_scan
+        scan = run_rule_scan(session)
+        findings = sum(len(result['findings']) for result in scan['checks'].values())
+    elif name == 'scan':
+        findings = _run_full_scan(session)
+    else:
+        from modules.scanner import get_check
+        findings = len(get_check(name)(session))
+    seconds = time.perf_counter() - start
+    return seconds, findings, dict(sorted(account.calls.items()))
+
+
+def _run_full_scan(session):
+    """run_scan with every check, a cold inventory cache and a checkpoint store"""
+    from modules.cache import InventoryCache
+    from modules.checkpoint import CheckpointStore
+    from modules.scanner import run_scan
+    with tempfile.TemporaryDirectory() as state:
+        cache = InventoryCache(os.path.join(state, 'inventory.db'))
+        checkpoints = CheckpointStore(os.path.join(state, 'checkpoints.db'))
+        try:
+            scan = run_scan(session, cache=cache, checkpoints=checkpoints)
+        finally:
+            cache.close()
+            checkpoints.close()
+    return scan['total_issues']
+
+
+def benchmark(name, account, runs, memory=True):
+    # Import the check and load the service models on a tiny account first,
+    # so that isn't timed
+    run_case(name, make_account(0.001))
+    timings = []
+    for _ in range(runs):
+        seconds, findings, calls = run_case(name, account)
+        timings.append(seconds)
+    seconds = statistics.median(timings)
+    result = {
+        'seconds': round(seconds, 3),
+        'per_second': round(CASE_RESOURCES[name](account) / seconds) if seconds else None,
+        'api_calls': sum(calls.values()),
+        'calls': calls,
+        'findings': findings,
+        'peak_mb': None,
+    }
+    if memory:
+        tracemalloc.start()
+        try:
+            run_case(name, account)
+            result['peak_mb'] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 1)
+        finally:
+            tracemalloc.stop()
+    return result
+
+
+def compare(name, result, baseline, tolerance):
+    """Regressions of result against its baseline, as messages"""
+    problems = []
+    for key in ('api_calls', 'findings'):
+        if result[key] != baseline.get(key):
+            problems.append(f"{name}: {key} {baseline.get(key)} -> {result[key]}")
+    if result['calls'] != baseline.get('calls') and result['api_calls'] == baseline.get('api_calls'):
+        problems.append(f"{name}: calls per operation changed: {baseline.get('calls')} -> {result['calls']}")
+    for key in ('seconds', 'peak_mb'):
+        before, after = baseline.get(key), result[key]
+        if not (before and after) or after <= before * (1 + tolerance):
+            continue
+        if key == 'seconds' and after - before < MIN_SLOWDOWN:
+            continue
+        problems.append(f"{name}: {key} {before} -> {after} (+{(after / before - 1) * 100:.0f}%)")
+    return problems
+
+
+def load_baselines():
+    if not os.path.exists(BASELINES):
+        return {}
+    with open(BASELINES) as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', type=float, default=1.0, help='Account size relative to the default (1.0)')
+    parser.add_argument('--checks', nargs='+', choices=list(CASE_RESOURCES), default=list(CASE_RESOURCES))
+    parser.add_argument('--runs', type=int, default=3, help='Timed runs per case (median is reported)')
+    parser.add_argument('--no-memory', action='store_true', help='Skip the peak memory runs')
+    parser.add_argument('--save-baseline', action='store_true', help=f"Write the results to {BASELINES}")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='Allowed slowdown / memory growth against the baseline (0.5 = 50%%)')
+    parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+    args = parser.parse_args()
+
+    account = make_account(args.scale)
+    scale_key = f"{args.scale:g}"
+    baselines = load_baselines()
+    baseline = baselines.get(scale_key, {}).get('cases', {})
+
+    results = {}
+    if not args.json:
+        print('Account: ' + ', '.join(f"{v:,} {k.replace('_', ' ')}" for k, v in account.sizes().items()))
+        print(f"{'case':<12} {'time':>9} {'resources/s':>12} {'API calls':>10} {'findings':>9} {'peak MB':>8}")
+    for name in args.checks:
+        result = results[name] = benchmark(name, account, args.runs, memory=not args.no_memory)
+        if not args.json:
+            peak = f"{result['peak_mb']:.1f}" if result['peak_mb'] is not None else '-'
+            print(f"{name:<12} {result['seconds']:>8.3f}s {result['per_second'] or 0:>12,} "
+                  f"{result['api_calls']:>10,} {result['findings']:>9,} {peak:>8}")
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+
+    if args.save_baseline:
+        saved = baselines.setdefault(scale_key, {'sizes': account.sizes(), 'cases': {}})
+        saved['sizes'] = account.sizes()
+        saved['cases'].update(results)
+        with open(BASELINES, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"Baseline for scale {scale_key} saved to {BASELINES}", file=sys.stderr)
+        return
+
+    if not baseline:
+        print(f"No baseline for scale {scale_key}, run with --save-baseline to record one", file=sys.stderr)
+        return
+    problems = [p for name, result in results.items() if name in baseline
+                for p in compare(name, result, baseline[name], args.tolerance)]
+    if problems:
+        print(f"\n{len(problems)} regression(s) against the baseline:", file=sys.stderr)
+        for problem in problems:
+            print(f"  {problem}", file=sys.stderr)
+        sys.exit(1)
+    print(f"\nNo regressions against the baseline (tolerance {args.tolerance:.0%})", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,234 @@
+"""A synthetic AWS account served from botocore event hooks, for offline benchmarks.
+
+SyntheticAccount(...).attach(session) answers every API call the checks
+make from generated data, before anything is sent: no network, no
+credentials and no moto needed. Responses are built per page on demand from
+the resource index, so the stand-in doesn't hold the account in memory,
+and the same sizes always produce the same account (and findings).
+Calls are counted per operation in `calls`.
+
+Requests still go through botocore's parameter validation, serialization
+and event handling; only HTTP and response parsing are skipped.
+"""
+import json
+import threading
+from collections import Counter
+from urllib.parse import quote
+
+from botocore.awsrequest import AWSResponse
+
+ALL_USERS = 'http://acs.amazonaws.com/groups/global/AllUsers'
+ADMIN_DOCUMENT = quote(json.dumps({'Version': '2012-10-17',
+                                   'Statement': [{'Effect': 'Allow', 'Action': '*', 'Resource': '*'}]}))
+READ_DOCUMENT = quote(json.dumps({'Version': '2012-10-17',
+                                  'Statement': [{'Effect': 'Allow', 'Action': 's3:Get*', 'Resource': '*'}]}))
+
+# Page sizes, matching the service maximums the paginators ask for
+PAGE_SIZES = {
+    'ListBuckets': 1000,
+    'GetAccountAuthorizationDetails': 100,
+    'DescribeInstances': 1000,
+    'DescribeSecurityGroups': 1000,
+}
+
+RULES_PER_GROUP = 5
+INSTANCES_PER_RESERVATION = 5
+
+
+class SyntheticAccount:
+    """Generated account of the given size, served to any number of sessions"""
+
+    def __init__(self, buckets=10_000, instances=50_000, users=5_000, sg_rules=20_000, trails=5,
+                 region='us-east-1'):
+        self.buckets = buckets
+        self.instances = instances
+        self.users = users
+        self.groups = max(1, sg_rules // RULES_PER_GROUP)
+        self.trails = trails
+        self.region = region
+        self.iam_groups = max(1, users // 100)
+        self.roles = max(1, users // 10)
+        self.calls = Counter()
+        self._lock = threading.Lock()
+
+    def sizes(self):
+        return {'s3_buckets': self.buckets, 'ec2_instances': self.instances, 'iam_users': self.users,
+                'sg_rules': self.groups * RULES_PER_GROUP, 'cloudtrail_trails': self.trails}
+
+    # --- Hooks ---
+
+    def attach(self, session):
+        """Serve every API call made through clients of this (boto3) session"""
+        session.events.register('before-parameter-build.*.*', self._remember_params)
+        session.events.register('before-call.*.*', self._respond)
+        return session
+
+    def _remember_params(self, params, context, **kwargs):
+        context['synthetic_params'] = dict(params)
+
+    def _respond(self, model, context, **kwargs):
+        with self._lock:
+            self.calls[model.name] += 1
+        handler = getattr(self, f"_{model.name}", None)
+        response = handler(context.get('synthetic_params', {})) if handler else {}
+        response.setdefault('ResponseMetadata', {'HTTPStatusCode': 200})
+        return AWSResponse(None, 200, {}, None), response
+
+    @staticmethod
+    def _page(params, token_key, total, operation):
+        start = int(params.get(token_key) or 0)
+        end = min(total, start + PAGE_SIZES[operation])
+        return start, end, (str(end) if end < total else None)
+
+    # --- S3: every 50th bucket has a public ACL, every 100th a public policy,
+    # every 3rd blocks public access (so its ACL and policy aren't read)
+
+    def _ListBuckets(self, params):
+        start, end, token = self._page(params, 'ContinuationToken', self.buckets, 'ListBuckets')
+        response = {'Buckets': [{'Name': f"bench-bucket-{i:06d}", 'BucketRegion': self.region}
+                                for i in range(start, end)]}
+        if token:
+            response['ContinuationToken'] = token
+        return response
+
+    @staticmethod
+    def _bucket_index(params):
+        return int(params['Bucket'].rsplit('-', 1)[1])
+
+    def _GetPublicAccessBlock(self, params):
+        blocked = self._bucket_index(params) % 3 == 0
+        return {'PublicAccessBlockConfiguration': {
+            'BlockPublicAcls': blocked, 'IgnorePublicAcls': blocked,
+            'BlockPublicPolicy': blocked, 'RestrictPublicBuckets': blocked,
+        }}
+
+    def _GetBucketAcl(self, params):
+        grants = [{'Grantee': {'Type': 'CanonicalUser', 'ID': 'owner'}, 'Permission': 'FULL_CONTROL'}]
+        if self._bucket_index(params) % 50 == 1:
+            grants.append({'Grantee': {'Type': 'Group', 'URI': ALL_USERS}, 'Permission': 'READ'})
+        return {'Owner': {'ID': 'owner'}, 'Grants': grants}
+
+    def _GetBucketPolicyStatus(self, params):
+        return {'PolicyStatus': {'IsPublic': self._bucket_index(params) % 100 == 2}}
+
+    def _GetBucketLocation(self, params):
+        return {'LocationConstraint': None if self.region == 'us-east-1' else self.region}
+
+    # --- IAM: users are spread over groups, one group in 10 has AdministratorAccess,
+    # every 200th user an inline admin policy
+
+    def _GetAccountAuthorizationDetails(self, params):
+        # Users first, then groups, roles and managed policies, in one index space
+        policies = 2
+        total = self.users + self.iam_groups + self.roles + policies
+        start, end, token = self._page(params, 'Marker', total, 'GetAccountAuthorizationDetails')
+        response = {'UserDetailList': [], 'GroupDetailList': [], 'RoleDetailList': [], 'Policies': [],
+                    'IsTruncated': token is not None}
+        if token:
+            response['Marker'] = token
+        admin = {'PolicyName': 'AdministratorAccess', 'PolicyArn': 'arn:aws:iam::aws:policy/AdministratorAccess'}
+        read = {'PolicyName': 'BenchRead', 'PolicyArn': 'arn:aws:iam::123456789012:policy/BenchRead'}
+        for i in range(start, end):
+            if i < self.users:
+                user = {'UserName': f"bench-user-{i:05d}", 'UserId': f"AIDA{i:016d}", 'Path': '/',
+                        'Arn': f"arn:aws:iam::123456789012:user/bench-user-{i:05d}",
+                        'GroupList': [f"bench-group-{i % self.iam_groups:04d}"],
+                        'AttachedManagedPolicies': [read]}
+                if i % 200 == 7:
+                    user['UserPolicyList'] = [{'PolicyName': 'everything', 'PolicyDocument': ADMIN_DOCUMENT}]
+                response['UserDetailList'].append(user)
+                continue
+            i -= self.users
+            if i < self.iam_groups:
+                response['GroupDetailList'].append({
+                    'GroupName': f"bench-group-{i:04d}", 'GroupId': f"AGPA{i:016d}", 'Path': '/',
+                    'Arn': f"arn:aws:iam::123456789012:group/bench-group-{i:04d}",
+                    'AttachedManagedPolicies': [admin if i % 10 == 0 else read],
+                })
+                continue
+            i -= self.iam_groups
+            if i < self.roles:
+                response['RoleDetailList'].append({
+                    'RoleName': f"bench-role-{i:05d}", 'RoleId': f"AROA{i:016d}", 'Path': '/',
+                    'Arn': f"arn:aws:iam::123456789012:role/bench-role-{i:05d}",
+                    'AttachedManagedPolicies': [admin if i % 25 == 0 else read],
+                })
+                continue
+            i -= self.roles
+            policy, document = (admin, ADMIN_DOCUMENT) if i == 0 else (read, READ_DOCUMENT)
+            response['Policies'].append({
+                'PolicyName': policy['PolicyName'], 'Arn': policy['PolicyArn'], 'PolicyId': f"ANPA{i:016d}",
+                'DefaultVersionId': 'v1',
+                'PolicyVersionList': [{'VersionId': 'v1', 'IsDefaultVersion': True, 'Document': document}],
+            })
+        return response
+
+    # --- EC2: one instance in 10 is stopped, one in 5 has a public IP; security groups
+    # have 5 rules each, one group in 25 opens SSH to 0.0.0.0/0
+
+    def _instance(self, i):
+        group = f"sg-{i % self.groups:08x}"
+        public_ip = f"198.51.{(i // 250) % 250}.{i % 250}" if i % 5 == 0 else None
+        interface = {'NetworkInterfaceId': f"eni-{i:08x}", 'Groups': [{'GroupId': group, 'GroupName': group}],
+                     'PrivateIpAddress': f"10.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}"}
+        if public_ip:
+            interface['Association'] = {'PublicIp': public_ip}
+        instance = {
+            'InstanceId': f"i-{i:017x}",
+            'InstanceType': 't3.micro',
+            'State': {'Code': 80, 'Name': 'stopped'} if i % 10 == 9 else {'Code': 16, 'Name': 'running'},
+            'SecurityGroups': [{'GroupId': group, 'GroupName': group}],
+            'NetworkInterfaces': [interface],
+            'Tags': [{'Key': 'Name', 'Value': f"bench-{i}"}],
+        }
+        if public_ip:
+            instance['PublicIpAddress'] = public_ip
+        return instance
+
+    def _DescribeInstances(self, params):
+        filters = {f['Name']: f['Values'] for f in params.get('Filters', [])}
+        start, end, token = self._page(params, 'NextToken', self.instances, 'DescribeInstances')
+        instances = [self._instance(i) for i in range(start, end)]
+        if 'instance-state-name' in filters:
+            instances = [inst for inst in instances if inst['State']['Name'] in filters['instance-state-name']]
+        response = {'Reservations': [
+            {'ReservationId': f"r-{start + i:017x}", 'Instances': instances[i:i + INSTANCES_PER_RESERVATION]}
+            for i in range(0, len(instances), INSTANCES_PER_RESERVATION)
+        ]}
+        if token:
+            response['NextToken'] = token
+        return response
+
+    def _security_group(self, i):
+        group_id = f"sg-{i:08x}"
+        permissions = [
+            {'IpProtocol': 'tcp', 'FromPort': 443, 'ToPort': 443, 'IpRanges': [{'CidrIp': '10.0.0.0/8'}]},
+            {'IpProtocol': 'tcp', 'FromPort': 8080, 'ToPort': 8090, 'IpRanges': [{'CidrIp': '172.16.0.0/12'}]},
+            {'IpProtocol': 'udp', 'FromPort': 53, 'ToPort': 53, 'IpRanges': [{'CidrIp': '192.168.0.0/16'}]},
+            {'IpProtocol': '-1', 'UserIdGroupPairs': [{'GroupId': f"sg-{(i + 1) % self.groups:08x}"}]},
+            {'IpProtocol': 'tcp', 'FromPort': 22, 'ToPort': 22,
+             'IpRanges': [{'CidrIp': '0.0.0.0/0' if i % 25 == 0 else '10.1.0.0/16'}]},
+        ]
+        return {'GroupId': group_id, 'GroupName': group_id, 'Description': f"bench group {i}",
+                'IpPermissions': permissions[:RULES_PER_GROUP]}
+
+    def _DescribeSecurityGroups(self, params):
+        start, end, token = self._page(params, 'NextToken', self.groups, 'DescribeSecurityGroups')
+        response = {'SecurityGroups': [self._security_group(i) for i in range(start, end)]}
+        if token:
+            response['NextToken'] = token
+        return response
+
+    # --- CloudTrail: the last trail is not logging
+
+    def _DescribeTrails(self, params):
+        return {'trailList': [{'Name': f"bench-trail-{i}", 'HomeRegion': self.region, 'IsMultiRegionTrail': i == 0,
+                               'LogFileValidationEnabled': i % 2 == 0} for i in range(self.trails)]}
+
+    def _GetTrailStatus(self, params):
+        return {'IsLogging': not params['Name'].endswith(f"-{self.trails - 1}")}
+
+    # --- STS: the inventory cache keys its entries on the account
+
+    def _GetCallerIdentity(self, params):
+        return {'Account': '000000000000', 'Arn': 'arn:aws:iam::000000000000:user/synthetic', 'UserId': 'synthetic'}
@@ -0,0 +1,311 @@
+import base64
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from botocore.awsrequest import AWSResponse
+
+from modules.context import scan_setting
+
+STATE_DIR = os.getenv('CSPM_STATE_DIR', '.cspm')
+
+# Seconds a cached describe/list/get result stays fresh, per service.
+# Override with CSPM_CACHE_TTL_<SERVICE>, e.g. CSPM_CACHE_TTL_EC2=60.
+DEFAULT_TTLS = {
+    's3': 900,
+    'iam': 3600,
+    'ec2': 300,
+    'cloudtrail': 300,
+    'sts': 3600,
+}
+DEFAULT_TTL = 300
+
+# Only read-only calls are cached
+CACHEABLE_PREFIXES = ('Describe', 'List', 'Get')
+
+# Fresh responses are committed in batches, at most this many seconds after
+# they were stored
+COMMIT_DELAY = 0.5
+
+# Seconds a write waits for another connection (e.g. a multi-account
+# worker process) to release the database before giving up
+BUSY_TIMEOUT = 10
+
+# Expired responses are purged on open and then at most this often (seconds)
+PURGE_INTERVAL = 600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    account TEXT NOT NULL,
+    region TEXT,
+    service TEXT NOT NULL,
+    operation TEXT NOT NULL,
+    fetched_at REAL NOT NULL,
+    response TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_scope ON responses (account, region, service);
+CREATE TABLE IF NOT EXISTS identities (
+    access_key TEXT PRIMARY KEY,
+    account TEXT NOT NULL,
+    fetched_at REAL NOT NULL
+);
+"""
+
+
+def state_path(filename):
+    """Path of a file in the local CSPM state directory"""
+    os.makedirs(STATE_DIR, exist_ok=True)
+    return os.path.join(STATE_DIR, filename)
+
+
+def _encode(value):
+    # Parsed responses hold datetimes (timestamps) and bytes (blobs) besides JSON types
+    if isinstance(value, datetime):
+        return {'__datetime__': value.isoformat()}
+    if isinstance(value, (bytes, bytearray)):
+        return {'__bytes__': base64.b64encode(value).decode()}
+    raise TypeError(f"can't cache a {type(value).__name__}")
+
+
+def _decode(obj):
+    if '__datetime__' in obj:
+        return datetime.fromisoformat(obj['__datetime__'])
+    if '__bytes__' in obj:
+        return base64.b64decode(obj['__bytes__'])
+    return obj
+
+
+def dump_response(response):
+    return json.dumps(response, default=_encode)
+
+
+def load_response(data):
+    """A response stored by dump_response, or None if it can't be read (e.g. a row from an older version)"""
+    try:
+        return json.loads(data, object_hook=_decode)
+    except (ValueError, TypeError):
+        return None
+
+
+def _request_key(account, region, service, operation, request_dict):
+    body = request_dict.get('body')
+    if isinstance(body, bytes):
+        body = body.decode('utf-8', 'replace')
+    raw = json.dumps({
+        'account': account,
+        'region': region,
+        'service': service,
+        'operation': operation,
+        'method': request_dict.get('method'),
+        'url': request_dict.get('url'),
+        'body': body,
+    }, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class InventoryCache:
+    """On-disk cache of raw AWS describe/list/get responses.
+
+    attach() hooks into a boto3 session through botocore events, so every
+    client created from that session afterwards reads from the cache
+    while an entry is within its service TTL, and stores every fresh
+    response. Check modules don't need to know about it.
+
+    With shared=True every write is committed at once instead of in
+    batches, so no write transaction is held open between batches while
+    other processes use the same file.
+    """
+
+    def __init__(self, path=None, ttls=None, shared=False):
+        self.path = path or state_path('inventory.db')
+        self.ttls = dict(DEFAULT_TTLS)
+        for service in list(self.ttls):
+            env_ttl = os.getenv(f"CSPM_CACHE_TTL_{service.upper()}")
+            if env_ttl:
+                self.ttls[service] = int(env_ttl)
+        self.ttls.update(ttls or {})
+        self.hits = 0
+        self.misses = 0
+        self.shared = shared
+        self.lock = threading.Lock()
+        self._commit_timer = None
+        self.closed = False
+        self._purged = 0
+        self.db = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript(SCHEMA)
+        with self.lock:
+            self._purge()
+            self.db.commit()
+
+    def ttl(self, service):
+        return self.ttls.get(service, DEFAULT_TTL)
+
+    def get(self, key, service):
+        with self.lock:
+            row = self.db.execute(
+                'SELECT fetched_at, response FROM responses WHERE key = ?', (key,)
+            ).fetchone()
+        if row is None or time.time() - row[0] > self.ttl(service):
+            return None
+        return load_response(row[1])
+
+    def put(self, key, account, region, service, operation, response):
+        """Store a parsed response; it is committed with the next batch (at once if shared)"""
+        data = dump_response(response)
+        with self.lock:
+            self.db.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (key, account, region, service, operation, time.time(), data),
+            )
+            if time.time() - self._purged > PURGE_INTERVAL:
+                self._purge()
+            self._schedule_commit()
+
+    def _schedule_commit(self):
+        # Caller holds the lock
+        if self.shared:
+            self.db.commit()
+        elif self._commit_timer is None:
+            self._commit_timer = threading.Timer(COMMIT_DELAY, self.flush)
+            self._commit_timer.daemon = True
+            self._commit_timer.start()
+
+    def flush(self):
+        """Commit the responses stored since the last batch"""
+        with self.lock:
+            self._commit_timer = None
+            if self.closed:
+                return
+            try:
+                self.db.commit()
+            except sqlite3.Error as e:
+                # The batch stays in the open transaction and goes with the next commit
+                print(f"[WARN] Inventory cache commit failed: {e}")
+
+    def _purge(self):
+        """Delete expired responses and identities (caller holds the lock and commits)"""
+        now = time.time()
+        for service, ttl in self.ttls.items():
+            self.db.execute('DELETE FROM responses WHERE service = ? AND fetched_at < ?', (service, now - ttl))
+        self.db.execute(
+            f"DELETE FROM responses WHERE service NOT IN ({','.join('?' * len(self.ttls))}) AND fetched_at < ?",
+            list(self.ttls) + [now - DEFAULT_TTL],
+        )
+        self.db.execute('DELETE FROM identities WHERE fetched_at < ?', (now - self.ttl('sts'),))
+        self._purged = now
+
+    def resolve_account(self, session):
+        """Account ID for the session's credentials, looked up through STS at most once per TTL"""
+        credentials = session.get_credentials()
+        access_key = credentials.access_key if credentials else 'anonymous'
+        with self.lock:
+            row = self.db.execute(
+                'SELECT account, fetched_at FROM identities WHERE access_key = ?', (access_key,)
+            ).fetchone()
+        if row and time.time() - row[1] <= self.ttl('sts'):
+            return row[0]
+        account = session.client('sts').get_caller_identity()['Account']
+        try:
+            with self.lock:
+                self.db.execute(
+                    'INSERT OR REPLACE INTO identities VALUES (?, ?, ?)', (access_key, account, time.time())
+                )
+                self._schedule_commit()
+        except sqlite3.Error as e:
+            print(f"[WARN] Could not cache the account ID: {e}")
+        return account
+
+    def invalidate(self, account=None, region=None, service=None):
+        """Drop cached responses, optionally only for one account, region and/or service"""
+        clauses, params = [], []
+        for column, value in (('account', account), ('region', region), ('service', service)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ''
+        with self.lock:
+            self.db.execute(f"DELETE FROM responses{where}", params)
+            self.db.commit()
+
+    def attach(self, session, account=None):
+        """Serve this session's read-only calls from the cache.
+
+        Calls made with the 'cache_refresh' scan setting (see
+        context.scan_settings) aren't read from the cache, but their fresh
+        responses are still stored for the next run; the setting is checked
+        on every call, so scans sharing the session can differ. Attaching
+        the same session again is a no-op. Attach before creating clients:
+        clients copy the session's event hooks when created.
+        """
+        account = account or self.resolve_account(session)
+
+        def before_call(model, params, request_signer, context, **kwargs):
+            operation = model.name
+            if not operation.startswith(CACHEABLE_PREFIXES):
+                return None
+            service = kwargs['event_name'].split('.')[1]
+            region = request_signer.region_name
+            key = _request_key(account, region, service, operation, params)
+            context['cspm_cache'] = (key, region, service)
+            if scan_setting('cache_refresh'):
+                return None
+            cached = self.get(key, service)
+            if cached is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            context['cspm_cache_hit'] = True
+            return AWSResponse(None, 200, {}, None), cached
+
+        def after_call(http_response, parsed, model, context, **kwargs):
+            # Registered first so the raw response is stored before botocore's
+            # own after-call handlers (e.g. IAM policy decoding) modify it
+            if 'cspm_cache' not in context or context.get('cspm_cache_hit'):
+                return
+            if http_response.status_code >= 300:
+                return
+            key, region, service = context['cspm_cache']
+            try:
+                self.put(key, account, region, service, model.name, parsed)
+            except sqlite3.Error as e:
+                # A response that can't be cached is still returned to the check
+                print(f"[WARN] Could not cache {service} {model.name}: {e}")
+
+        unique = f"cspm-cache-{id(self)}"
+        session.events.register('before-call.*.*', before_call, unique_id=f"{unique}-before")
+        session.events.register_first('after-call.*.*', after_call, unique_id=f"{unique}-after")
+        return account
+
+    def close(self):
+        with self.lock:
+            if self._commit_timer is not None:
+                self._commit_timer.cancel()
+                self._commit_timer = None
+            self.db.commit()
+            self.db.close()
+            self.closed = True
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_inventory_cache(shared=False):
+    """Process-wide inventory cache, or None if disabled with CSPM_CACHE=0.
+
+    shared is used when the cache is first opened in this process: pass
+    True where other processes write to the same file at the same time.
+    """
+    global _cache
+    if os.getenv('CSPM_CACHE', '1') == '0':
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = InventoryCache(shared=shared)
+        return _cache
@@ -0,0 +1,198 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from modules.cache import COMMIT_DELAY, dump_response, load_response, state_path
+
+# An interrupted scan older than this (seconds, CSPM_CHECKPOINT_MAX_AGE) is
+# started over rather than resumed: the account has moved on
+DEFAULT_MAX_AGE = 6 * 3600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS checkpoints (
+    id TEXT PRIMARY KEY,
+    key TEXT NOT NULL,
+    params TEXT NOT NULL,
+    started REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS checkpoints_key ON checkpoints (key, started);
+CREATE TABLE IF NOT EXISTS units (
+    checkpoint TEXT NOT NULL,
+    check_name TEXT NOT NULL,
+    region TEXT NOT NULL,
+    findings TEXT NOT NULL,
+    PRIMARY KEY (checkpoint, check_name, region)
+);
+DROP TABLE IF EXISTS pages;
+"""
+
+
+class ScanCheckpoint:
+    """Progress of one scan, saved as it goes so an interrupted run can pick it up.
+
+    A scan is split into units of work, one per check and region ('' for
+    the global checks). A completed unit's findings are saved, and a
+    resumed scan reuses them instead of running the unit again. A unit
+    that was cut short runs again; the pages it had already fetched are
+    served by the inventory cache, if the scan has one.
+    """
+
+    def __init__(self, store, checkpoint_id, resumed=False):
+        self.store = store
+        self.id = checkpoint_id
+        self.resumed = resumed
+        self.units_reused = 0
+
+    def unit(self, check, region=None):
+        """Findings of a unit completed before the scan was interrupted, or None"""
+        if not self.resumed:
+            return None
+        findings = self.store.unit(self.id, check, region or '')
+        if findings is not None:
+            with self.store.lock:
+                self.units_reused += 1
+        return findings
+
+    def complete_unit(self, check, region, findings):
+        self.store.save_unit(self.id, check, region or '', findings)
+
+    def summary(self):
+        return {'id': self.id, 'resumed': self.resumed, 'units_reused': self.units_reused}
+
+    def release(self):
+        """Keep the checkpoint of a scan that didn't complete, for a later run to resume"""
+        self.store.release(self.id)
+
+    def finish(self):
+        """Drop the checkpoint once the scan has completed"""
+        self.store.discard(self.id)
+
+
+class CheckpointStore:
+    """Checkpoints of running and interrupted scans, in .cspm/checkpoints.db.
+
+    Like the inventory cache, saved units are committed in batches (see
+    flush()). Space freed by dropped checkpoints is returned to the file
+    system, so the database only ever holds the scans in flight.
+    """
+
+    def __init__(self, path=None, max_age=None):
+        self.path = path or state_path('checkpoints.db')
+        self.max_age = max_age if max_age is not None else int(os.getenv('CSPM_CHECKPOINT_MAX_AGE', DEFAULT_MAX_AGE))
+        self.lock = threading.Lock()
+        self.active = set()
+        self._commit_timer = None
+        self.closed = False
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        if self.db.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+            # Only takes effect on an existing database once it is rebuilt
+            self.db.execute('PRAGMA auto_vacuum=INCREMENTAL')
+            self.db.execute('VACUUM')
+        self.db.executescript(SCHEMA)
+
+    def open(self, params, restart=False):
+        """Checkpoint for a scan with these parameters: the latest interrupted one, or a new one.
+
+        With restart=True any interrupted scan with the same parameters is
+        discarded and the scan starts over. A checkpoint in use by another
+        scan in this process is never shared.
+        """
+        key = hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()
+        now = time.time()
+        with self.lock:
+            self._delete("updated < ?", (now - self.max_age,))
+            if restart:
+                self._delete("key = ?", (key,))
+            active = list(self.active)
+            row = self.db.execute(
+                f"SELECT id FROM checkpoints WHERE key = ? AND id NOT IN ({','.join('?' * len(active))}) "
+                "ORDER BY started DESC LIMIT 1", [key] + active
+            ).fetchone()
+            if row is not None:
+                checkpoint = ScanCheckpoint(self, row[0], resumed=True)
+            else:
+                checkpoint = ScanCheckpoint(self, uuid.uuid4().hex)
+                self.db.execute('INSERT INTO checkpoints VALUES (?, ?, ?, ?, ?)',
+                                (checkpoint.id, key, json.dumps(params, default=str), now, now))
+            self.db.commit()
+            self.db.execute('PRAGMA incremental_vacuum')
+            self.active.add(checkpoint.id)
+        return checkpoint
+
+    def _delete(self, where, params):
+        ids = [row[0] for row in self.db.execute(f"SELECT id FROM checkpoints WHERE {where}", params)]
+        for table, column in (('units', 'checkpoint'), ('checkpoints', 'id')):
+            self.db.executemany(f"DELETE FROM {table} WHERE {column} = ?", [(i,) for i in ids])
+
+    def unit(self, checkpoint_id, check, region):
+        with self.lock:
+            row = self.db.execute(
+                'SELECT findings FROM units WHERE checkpoint = ? AND check_name = ? AND region = ?',
+                (checkpoint_id, check, region),
+            ).fetchone()
+        return load_response(row[0]) if row else None
+
+    def save_unit(self, checkpoint_id, check, region, findings):
+        """Save a completed unit; it is committed with the next batch"""
+        data = dump_response(findings)
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO units VALUES (?, ?, ?, ?)',
+                            (checkpoint_id, check, region, data))
+            self.db.execute('UPDATE checkpoints SET updated = ? WHERE id = ?', (time.time(), checkpoint_id))
+            self._schedule_commit()
+
+    def _schedule_commit(self):
+        # Caller holds the lock
+        if self._commit_timer is None:
+            self._commit_timer = threading.Timer(COMMIT_DELAY, self.flush)
+            self._commit_timer.daemon = True
+            self._commit_timer.start()
+
+    def flush(self):
+        """Commit the units saved since the last batch"""
+        with self.lock:
+            self._commit_timer = None
+            if not self.closed:
+                self.db.commit()
+
+    def release(self, checkpoint_id):
+        self.flush()
+        with self.lock:
+            self.active.discard(checkpoint_id)
+
+    def discard(self, checkpoint_id):
+        with self.lock:
+            self._delete("id = ?", (checkpoint_id,))
+            self.db.commit()
+            self.db.execute('PRAGMA incremental_vacuum')
+            self.active.discard(checkpoint_id)
+
+    def close(self):
+        with self.lock:
+            if self._commit_timer is not None:
+                self._commit_timer.cancel()
+                self._commit_timer = None
+            self.db.commit()
+            self.db.close()
+            self.closed = True
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_checkpoint_store():
+    """Process-wide checkpoint store, or None if disabled with CSPM_CHECKPOINT=0"""
+    global _store
+    if os.getenv('CSPM_CHECKPOINT', '1') == '0':
+        return None
+    with _store_lock:
+        if _store is None:
+            _store = CheckpointStore()
+        return _store
@@ -1,146 +1,293 @@
-import boto3
+import argparse
 import os
-import subprocess
-import requests
-import smtplib
-from email.message import EmailMessage
-from dotenv import load_dotenv
-
-# Load environment variables from .env file
-load_dotenv()
-
-# Import CSPM modules
-from modules.s3_check import check_public_buckets
-from modules.iam_check import list_admin_users
-from modules.ec2_check import check_public_ec2
-from modules.cloudtrail_check import check_cloudtrail_enabled
-from modules.sg_check import check_security_groups
-from modules.report import export_csv
-
-# --- ALERT FUNCTIONS ---
-def send_email_alert(subject, body, to_email):
-    try:
-        msg = EmailMessage()
-        msg.set_content(body)
-        msg['Subject'] = subject
-        msg['From'] = "youremail@gmail.com"  # Replace with your email
-        msg['To'] = to_email
-
-        # Gmail SMTP (App Password required)
-        server = smtplib.SMTP('smtp.gmail.com', 587)
-        server.starttls()
-        server.login("youremail@gmail.com", "your-app-password")  # Replace with App Password
-        server.send_message(msg)
-        server.quit()
-        print(f"[INFO] Email alert sent to {to_email}")
-    except Exception as e:
-        print(f"[WARN] Failed to send email: {e}")
-
-def send_slack_alert(message, webhook_url):
-    if not webhook_url or webhook_url.startswith("https://hooks.slack.com/services/XXXXXXXXX"):
-        print("[WARN] Slack webhook not set or invalid. Skipping Slack alert.")
-        return
-    try:
-        response = requests.post(webhook_url, json={"text": message})
-        if response.status_code == 200:
-            print("[INFO] Slack alert sent successfully")
-        else:
-            print(f"[WARN] Slack alert failed: {response.text}")
-    except Exception as e:
-        print(f"[WARN] Error sending Slack alert: {e}")
+
+# Only the standard library and the (dependency free) check registry are
+# imported up front. boto3, the alert channels and the check modules are
+# loaded on first use, so `--help` and single-check runs start quickly.
+from modules.scanner import CHECKS
 
 # --- HELPER TO OPEN CSV ---
 def open_csv_in_excel(file_path):
     if os.name == 'nt':
+        import subprocess
         try:
             subprocess.Popen(['start', '', file_path], shell=True)
         except Exception as e:
             print(f"[WARN] Could not open {file_path} in Excel: {e}")
 
+def _merge_accounts(result):
+    """Combine a multi-account result into one run_scan-shaped dict, findings tagged with 'Account'"""
+    checks = {}
+    for account in result['accounts'].values():
+        for name, check in account['checks'].items():
+            merged = checks.setdefault(name, {'findings': [], 'error': None, 'duration': 0})
+            merged['findings'].extend(check['findings'])
+            merged['duration'] = max(merged['duration'], check['duration'])
+            if check['error']:
+                merged['error'] = check['error']
+    return {'checks': checks, 'total_issues': result['total_issues'], 'duration': result['duration']}
+
+def _names(findings, field):
+    return [f"{f[field]} ({f['Account']})" if isinstance(f, dict) else f for f in findings]
+
+def _check_names(values):
+    """--check values ('all', names, comma separated or repeated) -> list of check names"""
+    names = []
+    for value in values or ['all']:
+        for name in value.split(','):
+            name = name.strip().lower()
+            if name == 'all':
+                names.extend(n for n in CHECKS if n not in names)
+            elif name not in CHECKS:
+                raise argparse.ArgumentTypeError(f"unknown check '{name}' (choose from all, {', '.join(CHECKS)})")
+            elif name not in names:
+                names.append(name)
+    return names
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Scan an AWS account for security misconfigurations.")
+    parser.add_argument("--check", action="append", metavar="CHECK",
+                        help=f"check(s) to run: all (default), {', '.join(CHECKS)}; comma separated or repeated")
+    parser.add_argument("--region", default=os.getenv("CSPM_REGIONS"),
+                        help="region(s) for EC2, CloudTrail and Security Groups: 'all' or us-east-1,eu-west-1 "
+                             "(default $CSPM_REGIONS, else the session's region)")
+    parser.add_argument("--s3-prefix", default=os.getenv("CSPM_S3_PREFIX"),
+                        help="only scan S3 buckets whose name starts with this prefix")
+    parser.add_argument("-o", "--output", default=os.getenv("CSPM_REPORT", "logs/cspm_report.jsonl"),
+                        help="report file (.jsonl or .csv, add .gz to compress; default %(default)s)")
+    parser.add_argument("--format", choices=["jsonl", "csv"], help="report format (default: from the file extension)")
+    parser.add_argument("--csv-views", action="store_true", default=os.getenv("CSPM_CSV_VIEWS") == "1",
+                        help="also write one CSV per check next to the report")
+    parser.add_argument("--no-alerts", action="store_true", help="don't send email/Slack alerts")
+    parser.add_argument("--changes-only", action="store_true", default=os.getenv("CSPM_CHANGES_ONLY") == "1",
+                        help="only alert on and report findings that are new or resolved since the last scan")
+    parser.add_argument("--force-refresh", action="store_true", default=os.getenv("CSPM_FORCE_REFRESH") == "1",
+                        help="ignore the local inventory cache")
+    parser.add_argument("--incremental", action="store_true", default=os.getenv("CSPM_INCREMENTAL") == "1",
+                        help="only re-check resources changed since the last scan (CloudTrail)")
+    parser.add_argument("--multi-account", action="store_true", default=os.getenv("CSPM_MULTI_ACCOUNT") == "1",
+                        help="scan every account in $CSPM_ACCOUNTS_FILE through STS AssumeRole")
+    parser.add_argument("--restart", action="store_true",
+                        help="start over instead of resuming an interrupted scan of the same checks and regions")
+    parser.add_argument("--rules", nargs="?", const="", metavar="FILE",
+                        help="evaluate the YAML rules in FILE (default: $CSPM_RULES, else the bundled rules.yaml) "
+                             "instead of running the checks")
+    args = parser.parse_args(argv)
+    if args.rules is not None and (args.multi_account or args.incremental or args.check):
+        parser.error("--rules can't be combined with --check, --multi-account or --incremental")
+    if args.rules is not None:
+        return args
+    try:
+        args.check = _check_names(args.check)
+    except argparse.ArgumentTypeError as e:
+        parser.error(str(e))
+    return args
+
 # --- MAIN FUNCTION ---
-def main():
+def main(argv=None):
+    from dotenv import load_dotenv
+
+    # Load environment variables from .env file (before parsing, the option defaults read them)
+    load_dotenv()
+    args = parse_args(argv)
+
+    import boto3
+    from modules.scanner import run_scan
+    from modules.cache import get_inventory_cache
+    from modules.metrics import api_metrics
+    from modules.report import export_views, iter_scan_findings, write_delta_report, write_report
+    from modules.fingerprints import delta_counts, update_fingerprints
+
     session = boto3.Session()
     os.makedirs("logs", exist_ok=True)
 
-    # Slack webhook (replace with your valid webhook URL)
-    slack_webhook = "https://hooks.slack.com/services/XXXXXXXXX/XXXXXXXXX/XXXXXXXXXXXXXXXXX"
+    # Alerts from every check go out as one digest per channel (email/Slack, configured
+    # through CSPM_SMTP_* / CSPM_SLACK_WEBHOOK), sent in the background while the report is written
+    from modules.alerts import AlertDispatcher, dispatcher_from_env
+    alerts = AlertDispatcher([]) if args.no_alerts else dispatcher_from_env()
 
-    # --- S3 ---
-    print("\n--- Public S3 Buckets ---")
-    s3_findings = check_public_buckets(session)
-    if not s3_findings:
-        print("No findings.")
+    # Optional region fan-out for EC2, CloudTrail and Security Groups: "all" or "us-east-1,eu-west-1"
+    regions = args.region
+
+    # Optional S3 subset by bucket name prefix
+    check_options = {}
+    if args.s3_prefix:
+        check_options['s3'] = {'prefix': args.s3_prefix}
+
+    # Run the selected checks concurrently, then report on each one. With --incremental only the
+    # resources changed since the last scan (according to CloudTrail) are re-checked.
+    # With --multi-account every account in CSPM_ACCOUNTS_FILE is scanned through STS AssumeRole.
+    # Repeat runs within the cache TTL are served from the local inventory cache unless --force-refresh.
+    # An interrupted run is picked up where it stopped by the next run of the same scan unless --restart.
+    if args.multi_account:
+        from modules.accounts import load_accounts, run_multi_account_scan
+        result = run_multi_account_scan(session, load_accounts(), checks=args.check, regions=regions,
+                                        check_options=check_options)
+        print("\n--- Accounts ---")
+        for account_id, account in result['accounts'].items():
+            if account['error']:
+                print(f"{account_id} ({account['name']}): ERROR: {account['error']}")
+                continue
+            issues = sum(len(c['findings']) for c in account['checks'].values())
+            print(f"{account_id} ({account['name']}): {issues} issue(s) in {len(account['regions'])} region(s)")
+        scan = _merge_accounts(result)
+    elif args.rules is not None:
+        # Collect the inventory the rules need once, then evaluate every rule in one pass
+        from modules.rules import load_rules, run_rule_scan
+        scan = run_rule_scan(session, load_rules(args.rules or None), regions=regions, s3_prefix=args.s3_prefix)
+        print("\n--- Inventory ---")
+        for resource_type, count in scan['inventory'].items():
+            print(f"{resource_type:<20} {count:>6}")
+    elif args.incremental:
+        from modules.incremental import run_incremental_scan
+        scan = run_incremental_scan(session, cache=get_inventory_cache())
+        # The incremental result carries every check of the previous scan
+        scan['checks'] = {name: r for name, r in scan['checks'].items() if name in args.check}
     else:
-        for f in s3_findings:
-            print(f)
-        alert_msg = "CSPM ALERT: Public S3 Buckets:\n" + "\n".join(s3_findings)
-        send_email_alert("CSPM Alert: Public S3 Buckets", alert_msg, "admin@example.com")
-        send_slack_alert(alert_msg, slack_webhook)
-    s3_file = "logs/public_s3_buckets.csv"
-    export_csv([{"Bucket": b} for b in s3_findings], s3_file)
-    open_csv_in_excel(s3_file)
+        from modules.checkpoint import get_checkpoint_store
+        from modules.incremental import save_scan_state
+        scan = run_scan(session, checks=args.check, regions=regions, check_options=check_options,
+                        cache=get_inventory_cache(), refresh=args.force_refresh,
+                        checkpoints=get_checkpoint_store(), restart=args.restart)
+        if scan.get('checkpoint', {}).get('resumed'):
+            print(f"[INFO] Resumed scan reused {scan['checkpoint']['units_reused']} completed unit(s)")
+        # A --check subset only updates its own checks in the state the next --incremental run starts from
+        save_scan_state(scan)
+    checks = scan['checks']
 
-    # --- IAM ---
-    print("\n--- IAM Admin Users ---")
-    iam_findings = list_admin_users(session)
-    if not iam_findings:
-        print("No findings.")
+    # Compare with the previous scan (by finding fingerprint): new, resolved and unchanged
+    if args.multi_account:
+        from modules.cache import state_path
+        delta = update_fingerprints(result, state_path('fingerprints_accounts.json'))
     else:
-        for f in iam_findings:
-            print(f)
-        alert_msg = "CSPM ALERT: IAM Admin Users:\n" + "\n".join(iam_findings)
-        send_email_alert("CSPM Alert: IAM Admin Users", alert_msg, "admin@example.com")
-        send_slack_alert(alert_msg, slack_webhook)
-    iam_file = "logs/iam_admin_users.csv"
-    export_csv([{"AdminUser": u} for u in iam_findings], iam_file)
-    open_csv_in_excel(iam_file)
+        delta = update_fingerprints(scan)
+
+    def alerted(name):
+        # With --changes-only, alerts only carry findings that weren't there last time
+        return delta['new'].get(name, []) if args.changes_only else checks[name]['findings']
+
+    # --- S3 ---
+    if 's3' in checks:
+        print("\n--- Public S3 Buckets ---")
+        s3_findings = _names(checks['s3']['findings'], 'Bucket')
+        if not s3_findings:
+            print("No findings.")
+        else:
+            for f in s3_findings:
+                print(f)
+            alerts.add("Public S3 Buckets", _names(alerted('s3'), 'Bucket'))
+
+    # --- IAM ---
+    if 'iam' in checks:
+        print("\n--- IAM Admin Users ---")
+        iam_findings = _names(checks['iam']['findings'], 'UserName')
+        if not iam_findings:
+            print("No findings.")
+        else:
+            for f in iam_findings:
+                print(f)
+            alerts.add("IAM Admin Users", _names(alerted('iam'), 'UserName'))
 
     # --- EC2 ---
-    print("\n--- Public EC2 Instances ---")
-    ec2_findings = check_public_ec2(session)
-    if not ec2_findings:
-        print("No findings.")
-    else:
-        for f in ec2_findings:
-            print(f)
-        alert_msg = "CSPM ALERT: Public EC2 Instances:\n" + "\n".join([f"{i['InstanceId']} - {i['PublicIp']}" for i in ec2_findings])
-        send_email_alert("CSPM Alert: Public EC2 Instances", alert_msg, "admin@example.com")
-        send_slack_alert(alert_msg, slack_webhook)
-    ec2_file = "logs/public_ec2_instances.csv"
-    export_csv(ec2_findings, ec2_file)
-    open_csv_in_excel(ec2_file)
+    if 'ec2' in checks:
+        print("\n--- Public EC2 Instances ---")
+        ec2_findings = checks['ec2']['findings']
+        if not ec2_findings:
+            print("No findings.")
+        else:
+            for f in ec2_findings:
+                print(f)
+            alerts.add("Public EC2 Instances", [f"{i['InstanceId']} - {i['PublicIp']}" for i in alerted('ec2')])
 
     # --- CloudTrail ---
-    print("\n--- CloudTrail Logging ---")
-    cloudtrail_findings = check_cloudtrail_enabled(session)
-    if not cloudtrail_findings:
-        print("All CloudTrails are logging or no CloudTrails configured.")
-    else:
-        for f in cloudtrail_findings:
-            print(f)
-        alert_msg = "CSPM ALERT: CloudTrail Issues:\n" + "\n".join(cloudtrail_findings)
-        send_email_alert("CSPM Alert: CloudTrail Issues", alert_msg, "admin@example.com")
-        send_slack_alert(alert_msg, slack_webhook)
-    ct_file = "logs/cloudtrail_status.csv"
-    export_csv([{"CloudTrailIssue": f} for f in cloudtrail_findings], ct_file)
-    open_csv_in_excel(ct_file)
+    if 'cloudtrail' in checks:
+        print("\n--- CloudTrail Logging ---")
+        cloudtrail_findings = checks['cloudtrail']['findings']
+        if not cloudtrail_findings:
+            print("All CloudTrails are logging or no CloudTrails configured.")
+        else:
+            for f in cloudtrail_findings:
+                print(f)
+            alerts.add("CloudTrail Issues", [f['Issue'] for f in alerted('cloudtrail')])
 
     # --- Security Groups ---
-    print("\n--- Security Groups (0.0.0.0/0) ---")
-    sg_findings = check_security_groups(session)
-    if not sg_findings:
-        print("No overly permissive Security Groups found.")
+    if 'sg' in checks:
+        print("\n--- Security Groups (0.0.0.0/0, ::/0) ---")
+        sg_findings = checks['sg']['findings']
+        if not sg_findings:
+            print("No overly permissive Security Groups found.")
+        else:
+            for f in sg_findings:
+                print(f"- {f['GroupId']} allows {f['Protocol']}:{f['Port']} to {f['Cidr']} ({f['Description']})")
+            alerts.add("Security Groups open to the internet",
+                       [f"{f['GroupId']} allows {f['Protocol']}:{f['Port']}" for f in alerted('sg')])
+
+    # --- Network Exposure (public instances reachable through an open Security Group) ---
+    if 'exposure' in checks:
+        print("\n--- Reachable Public EC2 Instances ---")
+        exposure_findings = checks['exposure']['findings']
+        if not exposure_findings:
+            print("No public instances reachable from the internet.")
+        else:
+            for f in exposure_findings:
+                print(f"- {f['InstanceId']} ({f['PublicIp']}) reachable on {', '.join(f['OpenPorts'])} via {', '.join(f['GroupIds'])}")
+            alerts.add("Public EC2 Instances reachable from the internet",
+                       [f"{f['InstanceId']} ({f['PublicIp']}) on {', '.join(f['OpenPorts'])}" for f in alerted('exposure')])
+
+    # --- Rules ---
+    if args.rules is not None:
+        for name, result in checks.items():
+            if not result['findings']:
+                continue
+            print(f"\n--- {result['title']} ---")
+            for f in result['findings']:
+                print(f"- {f['Resource']}" + (f" ({f['Region']})" if f.get('Region') else ""))
+            alerts.add(result['title'], [f"{f['Resource']}" + (f" ({f['Region']})" if f.get('Region') else "")
+                                         for f in alerted(name)])
+
+    # --- Changes ---
+    print("\n--- Changes Since Last Scan ---")
+    counts = delta_counts(delta)
+    print(f"{counts['new']} new, {counts['resolved']} resolved, {counts['unchanged']} unchanged")
+    for name, resolved in delta['resolved'].items():
+        for entry in resolved:
+            print(f"- resolved: {name} {entry['resource']}" + (f" ({entry['region']})" if entry['region'] else ""))
+    if args.changes_only:
+        alerts.add("Resolved since last scan",
+                   [f"{name}: {entry['resource']}" for name, resolved in delta['resolved'].items() for entry in resolved])
+
+    alerts.flush()
+
+    # --- Report ---
+    # Every finding goes into one normalized file (JSONL or CSV, .gz to compress). The
+    # per-check CSVs of earlier versions can still be generated from it with --csv-views.
+    # With --changes-only it holds just the new and resolved findings.
+    report_file = args.output
+    if args.changes_only:
+        write_delta_report(delta, report_file, args.format)
     else:
-        for f in sg_findings:
-            print(f"- {f['GroupId']} allows {f['Protocol']}:{f['Port']} to 0.0.0.0/0 ({f['Description']})")
-        alert_msg = "CSPM ALERT: Security Groups open to 0.0.0.0/0:\n"
-        for f in sg_findings:
-            alert_msg += f"- {f['GroupId']} allows {f['Protocol']}:{f['Port']}\n"
-        send_email_alert("CSPM Alert: Security Groups", alert_msg, "admin@example.com")
-        send_slack_alert(alert_msg, slack_webhook)
-    sg_file = "logs/security_groups.csv"
-    export_csv(sg_findings, sg_file)
-    open_csv_in_excel(sg_file)
+        write_report(iter_scan_findings(scan), report_file, args.format)
+    if args.csv_views:
+        for view_file in export_views(report_file, os.path.dirname(report_file) or ".").values():
+            print(f"[INFO] Report exported to {view_file}")
+            open_csv_in_excel(view_file)
+
+    # --- Summary ---
+    print("\n--- Scan Summary ---")
+    for name, result in checks.items():
+        status = f"ERROR: {result['error']}" if result['error'] else f"{len(result['findings'])} finding(s)"
+        print(f"{name:<12} {result['duration']:>8.2f}s  {status}")
+    print(f"Total: {sum(len(r['findings']) for r in checks.values())} issue(s) in {scan['duration']:.2f}s")
+
+    print("\n--- AWS API Calls ---")
+    for service, totals in api_metrics.summary().items():
+        print(f"{service:<12} {int(totals.get('calls', 0)):>6} call(s)  {totals.get('seconds', 0):>8.2f}s  "
+              f"{int(totals.get('retries', 0))} retries, {int(totals.get('throttles', 0))} throttled, "
+              f"{int(totals.get('errors', 0))} errors, {int(totals.get('cache_hits', 0))} from cache, "
+              f"{totals.get('rate_limited', 0):.2f}s rate limited")
+
+    # Wait for the alert digests to go out
+    alerts.close()
 
 if __name__ == "__main__":
     main()
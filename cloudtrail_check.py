@@ -1,16 +1,20 @@
-import boto3
+from modules.aws_config import get_client
 
-def check_cloudtrail_enabled(session):
-    client = session.client('cloudtrail')
+def iter_cloudtrail_issues(session, region=None):
+    client = get_client(session, 'cloudtrail', region)
     trails = client.describe_trails()['trailList']
+    current_region = client.meta.region_name
     
-    findings = []
     if not trails:
-        findings.append("No CloudTrails configured!")
-    else:
-        for trail in trails:
-            status = client.get_trail_status(Name=trail['Name'])
-            if not status['IsLogging']:
-                findings.append(f"CloudTrail '{trail['Name']}' is NOT logging")
-    
-    return findings
+        yield {"Trail": None, "Issue": "No CloudTrails configured!"}
+        return
+    for trail in trails:
+        # Multi-region trails show up in every region; only check them from their home region
+        if trail.get('HomeRegion', current_region) != current_region:
+            continue
+        status = client.get_trail_status(Name=trail['Name'])
+        if not status['IsLogging']:
+            yield {"Trail": trail['Name'], "Issue": f"CloudTrail '{trail['Name']}' is NOT logging"}
+
+def check_cloudtrail_enabled(session, region=None):
+    return list(iter_cloudtrail_issues(session, region))
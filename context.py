@@ -0,0 +1,32 @@
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+# Settings of the scan running in the current thread, read by session-wide
+# botocore hooks on every call (e.g. whether the inventory cache may serve
+# it). Concurrent scans share one session and its clients, so per-scan
+# settings can't live on either; they follow the scan onto its worker
+# threads through ScanThreadPool instead.
+_settings = contextvars.ContextVar('cspm_scan_settings', default={})
+
+
+def scan_setting(name, default=None):
+    """A setting of the scan running in this thread"""
+    return _settings.get().get(name, default)
+
+
+@contextmanager
+def scan_settings(**settings):
+    """Apply settings to the calls made in this block, and by the ScanThreadPool tasks it submits"""
+    token = _settings.set({**_settings.get(), **settings})
+    try:
+        yield
+    finally:
+        _settings.reset(token)
+
+
+class ScanThreadPool(ThreadPoolExecutor):
+    """ThreadPoolExecutor whose tasks see the scan settings of the thread that submitted them"""
+
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
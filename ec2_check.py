@@ -1,16 +1,39 @@
-def check_public_ec2(session):
-    ec2 = session.client('ec2')
+from modules.aws_config import MAX_FILTER_VALUES, get_client
+from modules.inventory import shared_listing
+
+
+def iter_public_ec2(session, region=None, instance_ids=None):
+    """Yield instances with a public IP as each DescribeInstances page arrives"""
+    ec2 = get_client(session, 'ec2', region)
+    paginator = ec2.get_paginator('describe_instances')
+    if instance_ids is not None:
+        # Only re-check the given instances (used by incremental scans), a filter rather
+        # than InstanceIds so terminated instances don't fail the call
+        instance_ids = list(instance_ids)
+        pages = (page for i in range(0, len(instance_ids), MAX_FILTER_VALUES)
+                 for page in paginator.paginate(Filters=[{'Name': 'instance-id',
+                                                          'Values': instance_ids[i:i + MAX_FILTER_VALUES]}]))
+    else:
+        listings = shared_listing('instances')
+        pages = listings.pages('instances', region, paginator) if listings else paginator.paginate()
+    for page in pages:
+        for reservation in page.get('Reservations', []):
+            for inst in reservation.get('Instances', []):
+                if inst.get('PublicIpAddress'):
+                    yield {
+                        'InstanceId': inst.get('InstanceId'),
+                        'PublicIp': inst.get('PublicIpAddress')
+                    }
+
+
+def check_public_ec2(session, region=None, instance_ids=None):
+    if region is not None or instance_ids is not None:
+        # Region fan-outs and incremental re-checks record the error, an empty
+        # result would read as "no public instances"
+        return list(iter_public_ec2(session, region, instance_ids))
     public_instances = []
     try:
-        paginator = ec2.get_paginator('describe_instances')
-        for page in paginator.paginate():
-            for reservation in page.get('Reservations', []):
-                for inst in reservation.get('Instances', []):
-                    if inst.get('PublicIpAddress'):
-                        public_instances.append({
-                            'InstanceId': inst.get('InstanceId'),
-                            'PublicIp': inst.get('PublicIpAddress')
-                        })
+        public_instances.extend(iter_public_ec2(session, region, instance_ids))
     except Exception:
         pass
     return public_instances
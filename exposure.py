@@ -0,0 +1,101 @@
+from collections import defaultdict
+
+from modules.aws_config import get_client
+from modules.inventory import shared_listing
+from modules.sg_check import SecurityGroupIndex, get_security_groups
+
+INTERNET_SOURCES = {'ipv4': '0.0.0.0/0', 'ipv6': '::/0'}
+
+
+def iter_running_instances(session, region=None):
+    ec2 = get_client(session, 'ec2', region)
+    paginator = ec2.get_paginator('describe_instances')
+    listings = shared_listing('instances')
+    if listings is None:
+        pages = paginator.paginate(Filters=[{'Name': 'instance-state-name', 'Values': ['running']}])
+    else:
+        # The scan's ec2 check lists every instance anyway, filter its pages here
+        pages = listings.pages('instances', region, paginator)
+    for page in pages:
+        for reservation in page.get('Reservations', []):
+            for instance in reservation.get('Instances', []):
+                if listings is None or instance.get('State', {}).get('Name') == 'running':
+                    yield instance
+
+
+def get_running_instances(session, region=None):
+    return list(iter_running_instances(session, region))
+
+
+def _interfaces(instance):
+    """(eni id, public IPv4, public IPv6 addresses, group ids) for each network interface"""
+    interfaces = instance.get('NetworkInterfaces') or []
+    if not interfaces:
+        # Older responses / EC2-Classic style instances without ENI details
+        groups = [g['GroupId'] for g in instance.get('SecurityGroups', [])]
+        yield None, instance.get('PublicIpAddress'), [], groups
+        return
+    for eni in interfaces:
+        groups = [g['GroupId'] for g in eni.get('Groups', [])]
+        ipv4 = eni.get('Association', {}).get('PublicIp')
+        ipv6 = [a['Ipv6Address'] for a in eni.get('Ipv6Addresses', []) if a.get('Ipv6Address')]
+        yield eni.get('NetworkInterfaceId'), ipv4, ipv6, groups
+
+
+def iter_network_exposure(instances, sg_index):
+    """Instances that have a public address and a security group rule open to the internet on that address family.
+
+    Works out each group's internet exposure once, then joins instance ->
+    ENI -> group through hash lookups, so the join is linear in the number
+    of instances and rules. instances can be any iterable; findings are
+    yielded as they are found.
+    """
+    # group id -> {'ipv4': [rules], 'ipv6': [rules]} for rules open to the internet
+    group_exposure = {}
+    for group_id in sg_index.groups:
+        open_rules = defaultdict(list)
+        for rule in sg_index.group_exposure(group_id, internet_only=True):
+            open_rules[rule['SourceType']].append(rule)
+        group_exposure[group_id] = open_rules
+
+    for instance in instances:
+        for eni_id, ipv4, ipv6, groups in _interfaces(instance):
+            addresses = {'ipv4': [ipv4] if ipv4 else [], 'ipv6': ipv6}
+            for family, public_addresses in addresses.items():
+                if not public_addresses:
+                    continue
+                open_ports = []
+                open_groups = []
+                for group_id in groups:
+                    rules = group_exposure.get(group_id, {}).get(family, [])
+                    if rules and group_id not in open_groups:
+                        open_groups.append(group_id)
+                    for rule in rules:
+                        port = f"{rule['Protocol']}:{rule['FromPort']}"
+                        if rule['ToPort'] != rule['FromPort']:
+                            port += f"-{rule['ToPort']}"
+                        if port not in open_ports:
+                            open_ports.append(port)
+                if open_ports:
+                    yield {
+                        'InstanceId': instance.get('InstanceId'),
+                        'PublicIp': ', '.join(public_addresses),
+                        'NetworkInterfaceId': eni_id,
+                        'GroupIds': open_groups,
+                        'OpenPorts': open_ports,
+                        'Source': INTERNET_SOURCES[family],
+                    }
+
+
+def compute_network_exposure(instances, sg_index):
+    return list(iter_network_exposure(instances, sg_index))
+
+
+def iter_exposure_findings(session, region=None):
+    """Stream instances page by page against the region's security group index"""
+    sg_index = SecurityGroupIndex(get_security_groups(session, region))
+    yield from iter_network_exposure(iter_running_instances(session, region), sg_index)
+
+
+def check_network_exposure(session, region=None):
+    return list(iter_exposure_findings(session, region))
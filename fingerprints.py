@@ -0,0 +1,139 @@
+import hashlib
+import json
+import os
+import threading
+
+from modules.cache import state_path
+from modules.report import normalize_finding
+
+# Fields besides the resource, region and account that make a finding a
+# different finding, e.g. another open port on the same security group.
+# Everything else (descriptions, messages) can change without it counting
+# as new.
+IDENTITY_FIELDS = {
+    's3': (),
+    'iam': (),
+    'ec2': ('PublicIp',),
+    'cloudtrail': ('Issue',),
+    'sg': ('Protocol', 'Port', 'ToPort', 'Cidr'),
+    'exposure': ('NetworkInterfaceId', 'Source', 'OpenPorts'),
+}
+
+
+def _identity(check, finding):
+    row = normalize_finding(check, finding)
+    identity = {field: row['detail'].get(field) for field in IDENTITY_FIELDS.get(check, ())}
+    return row, identity
+
+
+def fingerprint(check, finding):
+    """Stable id of a finding: the same exposure on the same resource gets the same fingerprint every scan"""
+    row, identity = _identity(check, finding)
+    key = json.dumps([check, row['resource'], row['region'], row['account'], identity], sort_keys=True, default=str)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:20]
+
+
+class FingerprintStore:
+    """Fingerprints of the previous scan's findings, with just enough to report them once resolved.
+
+    Kept in .cspm/fingerprints.json as {fingerprint: [check, resource, region, account, identity]}.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or state_path('fingerprints.json')
+        self.findings = {}
+        self.scanned = None
+        if os.path.exists(self.path):
+            try:
+                with open(self.path) as f:
+                    state = json.load(f)
+                self.findings = state.get('findings', {})
+                self.scanned = state.get('scanned')
+            except (OSError, ValueError) as e:
+                print(f"[WARN] Ignoring unreadable fingerprint store {self.path}: {e}")
+
+    def save(self, findings, scanned=None):
+        self.findings = findings
+        self.scanned = scanned
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'scanned': scanned, 'findings': findings}, f, separators=(',', ':'), default=str)
+        os.replace(tmp_path, self.path)
+
+
+# Scans running side by side in the dashboard share one fingerprint store
+_update_lock = threading.Lock()
+
+
+def _check_results(scan):
+    """(account, check, result, scanned regions, failed regions) for every check that ran,
+    from a single or multi-account scan"""
+    if 'accounts' in scan:
+        for account_id, account in scan['accounts'].items():
+            for name, result in account['checks'].items():
+                yield account_id, name, result, set(account.get('regions') or ()), set(result.get('errors') or {})
+        return
+    for name, result in scan['checks'].items():
+        yield None, name, result, set(scan.get('regions') or ()), set(result.get('region_errors') or {})
+
+
+def diff_scan(scan, previous):
+    """Compare a scan with the previous scan's fingerprints.
+
+    Returns (delta, fingerprints): delta has 'new' (findings by check),
+    'resolved' (stored summaries by check) and 'unchanged' (count by
+    check); fingerprints is what to store for the next comparison.
+    Findings of checks, accounts or regions that weren't scanned or failed
+    this time are carried over rather than reported as resolved.
+    """
+    delta = {'new': {}, 'resolved': {}, 'unchanged': {}}
+    current = {}
+    ran = set()
+    scanned = {}
+    failed = set()
+
+    for account, name, result, regions, failed_regions in _check_results(scan):
+        if result.get('error'):
+            continue
+        ran.add((name, account))
+        scanned[(name, account)] = regions
+        failed.update((name, account, region) for region in failed_regions)
+        delta['unchanged'].setdefault(name, 0)
+        for finding in result['findings']:
+            row, identity = _identity(name, finding)
+            fp = fingerprint(name, finding)
+            current[fp] = [name, row['resource'], row['region'], row['account'], identity]
+            if fp in previous:
+                delta['unchanged'][name] += 1
+            else:
+                delta['new'].setdefault(name, []).append(finding)
+
+    for fp, stored in previous.items():
+        if fp in current:
+            continue
+        name, resource, region, account, identity = stored
+        # Single-account findings are stored without an account, multi-account ones with it
+        scope_account = account if 'accounts' in scan else None
+        regions = scanned.get((name, scope_account))
+        if (name, scope_account) not in ran or (name, scope_account, region) in failed or \
+                (name, scope_account, 'global') in failed or (region and regions and region not in regions):
+            current[fp] = stored
+            continue
+        delta['resolved'].setdefault(name, []).append(
+            {'resource': resource, 'region': region, 'account': account, 'detail': identity})
+
+    return delta, current
+
+
+def update_fingerprints(scan, path=None):
+    """Diff a scan against the stored fingerprints and store the new ones. Returns the delta."""
+    with _update_lock:
+        store = FingerprintStore(path)
+        delta, fingerprints = diff_scan(scan, store.findings)
+        store.save(fingerprints, scan.get('started_utc'))
+    return delta
+
+
+def delta_counts(delta):
+    return {key: sum(len(v) if isinstance(v, list) else v for v in delta[key].values())
+            for key in ('new', 'resolved', 'unchanged')}
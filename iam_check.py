@@ -1,16 +1,119 @@
-def list_admin_users(session):
-    iam = session.client('iam')
-    paginator = iam.get_paginator('list_users')
-    admin_users = []
+import json
+from collections import defaultdict
+from urllib.parse import unquote
+
+from modules.aws_config import get_client
+
+ADMIN_POLICY_NAME = 'AdministratorAccess'
+
+
+def get_authorization_details(session):
+    """Fetch all users, groups, roles and managed policies with a few paginated calls"""
+    iam = get_client(session, 'iam')
+    paginator = iam.get_paginator('get_account_authorization_details')
+    details = {'UserDetailList': [], 'GroupDetailList': [], 'RoleDetailList': [], 'Policies': []}
     for page in paginator.paginate():
-        for user in page.get('Users', []):
-            username = user['UserName']
-            try:
-                policies = iam.list_attached_user_policies(UserName=username).get('AttachedPolicies', [])
-                for policy in policies:
-                    if policy.get('PolicyName') == 'AdministratorAccess' or 'AdministratorAccess' in policy.get('PolicyName', ''):
-                        admin_users.append(username)
-                        break
-            except Exception:
+        for key in details:
+            details[key].extend(page.get(key, []))
+    return details
+
+
+def _load_document(document):
+    # boto3 normally decodes policy documents, but they can come back URL-encoded
+    if isinstance(document, str):
+        return json.loads(unquote(document))
+    return document or {}
+
+
+def _as_list(value):
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def grants_admin(document):
+    """True if a policy document allows every action on every resource"""
+    for statement in _as_list(_load_document(document).get('Statement')):
+        if statement.get('Effect') != 'Allow':
+            continue
+        actions = _as_list(statement.get('Action'))
+        resources = _as_list(statement.get('Resource'))
+        if ('*' in actions or '*:*' in actions) and '*' in resources:
+            return True
+    return False
+
+
+class IAMAnalysis:
+    """Effective admin access worked out in memory from GetAccountAuthorizationDetails output"""
+
+    def __init__(self, details):
+        self.users = {u['UserName']: u for u in details.get('UserDetailList', [])}
+        self.groups = {g['GroupName']: g for g in details.get('GroupDetailList', [])}
+        self.roles = {r['RoleName']: r for r in details.get('RoleDetailList', [])}
+
+        # ARNs of managed policies whose default version grants admin
+        self.admin_policies = set()
+        for policy in details.get('Policies', []):
+            if ADMIN_POLICY_NAME in policy.get('PolicyName', ''):
+                self.admin_policies.add(policy['Arn'])
                 continue
-    return admin_users
+            for version in policy.get('PolicyVersionList', []):
+                if version.get('IsDefaultVersion') and grants_admin(version.get('Document')):
+                    self.admin_policies.add(policy['Arn'])
+
+        # Policy -> principals index. Managed policies are keyed by ARN,
+        # inline policies by "inline:<type>/<principal>/<policy name>".
+        self.policy_principals = defaultdict(set)
+        self._admin_reasons = {'user': defaultdict(list), 'group': defaultdict(list), 'role': defaultdict(list)}
+
+        for kind, entities, inline_key in (
+            ('user', self.users, 'UserPolicyList'),
+            ('group', self.groups, 'GroupPolicyList'),
+            ('role', self.roles, 'RolePolicyList'),
+        ):
+            for name, entity in entities.items():
+                for attached in entity.get('AttachedManagedPolicies', []):
+                    arn = attached['PolicyArn']
+                    self.policy_principals[arn].add((kind, name))
+                    if arn in self.admin_policies or ADMIN_POLICY_NAME in attached.get('PolicyName', ''):
+                        self._admin_reasons[kind][name].append(f"managed policy {attached['PolicyName']}")
+                for inline in entity.get(inline_key, []):
+                    key = f"inline:{kind}/{name}/{inline['PolicyName']}"
+                    self.policy_principals[key].add((kind, name))
+                    if grants_admin(inline.get('PolicyDocument')):
+                        self._admin_reasons[kind][name].append(f"inline policy {inline['PolicyName']}")
+
+        # Users inherit admin from their groups
+        for name, user in self.users.items():
+            for group in user.get('GroupList', []):
+                if group in self._admin_reasons['group']:
+                    self._admin_reasons['user'][name].append(f"group {group}")
+
+    def principals_for_policy(self, policy):
+        """Principals (type, name) a managed policy ARN or inline policy key is attached to"""
+        return sorted(self.policy_principals.get(policy, ()))
+
+    def admin_reasons(self, kind='user'):
+        """Map of principal name -> why it has admin access, for 'user', 'group' or 'role'"""
+        return {name: list(reasons) for name, reasons in self._admin_reasons[kind].items()}
+
+    def admin_users(self):
+        return sorted(self._admin_reasons['user'])
+
+    def admin_roles(self):
+        return sorted(self._admin_reasons['role'])
+
+
+def analyze_iam(session):
+    return IAMAnalysis(get_authorization_details(session))
+
+
+def iter_admin_users(session):
+    # Group and policy membership has to be known before any user can be
+    # judged, so the authorization details are read in full first (IAM quotas
+    # keep them small compared to EC2 or S3 inventories)
+    yield from analyze_iam(session).admin_users()
+
+
+def list_admin_users(session):
+    return analyze_iam(session).admin_users()
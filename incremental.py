@@ -0,0 +1,339 @@
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from modules.aws_config import get_client
+from modules.cache import state_path
+from modules.context import ScanThreadPool, scan_settings
+from modules.regions import get_enabled_regions, tag_region
+from modules.scanner import REGIONAL_CHECKS, get_check, run_scan
+
+# CloudTrail can take up to ~15 minutes to deliver an event, so every
+# lookup window overlaps the previous one by this much.
+DELIVERY_LAG = timedelta(minutes=15)
+
+# LookupEvents only goes back 90 days; older state needs a full scan
+MAX_LOOKBACK = timedelta(days=90)
+
+# Management event -> checks whose results it can change
+CHANGE_EVENTS = {
+    'CreateBucket': ('s3',),
+    'DeleteBucket': ('s3',),
+    'PutBucketAcl': ('s3',),
+    'PutBucketPolicy': ('s3',),
+    'DeleteBucketPolicy': ('s3',),
+    'PutBucketPublicAccessBlock': ('s3',),
+    'DeleteBucketPublicAccessBlock': ('s3',),
+
+    'AttachUserPolicy': ('iam',),
+    'DetachUserPolicy': ('iam',),
+    'PutUserPolicy': ('iam',),
+    'DeleteUserPolicy': ('iam',),
+    'AddUserToGroup': ('iam',),
+    'RemoveUserFromGroup': ('iam',),
+    'AttachGroupPolicy': ('iam',),
+    'DetachGroupPolicy': ('iam',),
+    'PutGroupPolicy': ('iam',),
+    'DeleteGroupPolicy': ('iam',),
+    'AttachRolePolicy': ('iam',),
+    'DetachRolePolicy': ('iam',),
+    'PutRolePolicy': ('iam',),
+    'DeleteRolePolicy': ('iam',),
+    'CreatePolicyVersion': ('iam',),
+    'SetDefaultPolicyVersion': ('iam',),
+    'DeleteUser': ('iam',),
+
+    'RunInstances': ('ec2', 'exposure'),
+    'StartInstances': ('ec2', 'exposure'),
+    'StopInstances': ('ec2', 'exposure'),
+    'TerminateInstances': ('ec2', 'exposure'),
+    'AssociateAddress': ('ec2', 'exposure'),
+    'DisassociateAddress': ('ec2', 'exposure'),
+    'ModifyInstanceAttribute': ('exposure',),
+    'ModifyNetworkInterfaceAttribute': ('exposure',),
+    'AttachNetworkInterface': ('exposure',),
+    'DetachNetworkInterface': ('exposure',),
+
+    'AuthorizeSecurityGroupIngress': ('sg', 'exposure'),
+    'RevokeSecurityGroupIngress': ('sg', 'exposure'),
+    'ModifySecurityGroupRules': ('sg', 'exposure'),
+    'CreateSecurityGroup': ('sg',),
+    'DeleteSecurityGroup': ('sg', 'exposure'),
+
+    'CreateTrail': ('cloudtrail',),
+    'DeleteTrail': ('cloudtrail',),
+    'UpdateTrail': ('cloudtrail',),
+    'StartLogging': ('cloudtrail',),
+    'StopLogging': ('cloudtrail',),
+}
+
+# Checks that can re-check individual resources: event field with the
+# resource ID, finding field it maps to, and the check keyword argument.
+# The other checks are re-run for the whole region (they are cheap or,
+# like IAM and exposure, depend on several resources at once).
+TARGETED_CHECKS = {
+    's3': ('bucketname', None, 'buckets'),
+    'sg': ('groupid', 'GroupId', 'group_ids'),
+    'ec2': ('instanceid', 'InstanceId', 'instance_ids'),
+}
+
+# IAM is global and its events are recorded in us-east-1
+GLOBAL_EVENTS_REGION = 'us-east-1'
+
+# Concurrent dashboard scans save their state one at a time
+_state_lock = threading.Lock()
+
+
+def load_scan_state(path=None):
+    path = path or state_path('last_scan.json')
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def _merge_state(previous, scan):
+    """The previous state with the checks of a scan (in the same regions) replaced.
+
+    Every check keeps its own high-water mark ('check_marks'); the state's
+    high_water_mark is the oldest of them, so the next incremental scan
+    looks far enough back for every check. A check that failed in this
+    scan keeps its previous results and mark, so what it missed is looked
+    up again. Returns None if the scan can't be merged (it ran in other
+    regions).
+    """
+    if sorted(previous.get('regions') or []) != sorted(scan.get('regions') or []):
+        return None
+    state = dict(scan)
+    state['checks'] = dict(previous['checks'])
+    state['check_options'] = dict(previous.get('check_options') or {})
+    marks = dict(previous.get('check_marks') or dict.fromkeys(previous['checks'], previous['high_water_mark']))
+    for name, result in scan['checks'].items():
+        if result.get('error') and name in previous['checks']:
+            continue
+        state['checks'][name] = result
+        state['check_options'].pop(name, None)
+        if (scan.get('check_options') or {}).get(name):
+            state['check_options'][name] = scan['check_options'][name]
+        marks[name] = scan['started_utc']
+    state['check_marks'] = marks
+    state['high_water_mark'] = min(marks.values())
+    state['total_issues'] = sum(len(r['findings']) for r in state['checks'].values())
+    state['errors'] = sum(1 for r in state['checks'].values() if r.get('error'))
+    return state
+
+
+def save_scan_state(scan, path=None):
+    """Store a scan's results and its high-water mark for the next incremental scan.
+
+    The scan is merged into the stored state (see _merge_state), so a scan
+    of only some of the checks (e.g. a scheduled 'sg' scan) leaves the
+    others as they were and a check that failed keeps its previous mark.
+    A scan in other regions than the stored state replaces it if it ran
+    every stored check, and is not saved otherwise.
+    """
+    path = path or state_path('last_scan.json')
+    with _state_lock:
+        previous = load_scan_state(path)
+        if previous and not previous.get('high_water_mark'):
+            previous = None
+        state = _merge_state(previous, scan) if previous else None
+        if state is None and previous and not set(previous['checks']) <= set(scan['checks']):
+            print("[INFO] Scan state not updated: a scan of only some checks in other regions can't be merged into it")
+            return
+        if state is None:
+            state = dict(scan, high_water_mark=scan['started_utc'],
+                         check_marks=dict.fromkeys(scan['checks'], scan['started_utc']))
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f, default=str)
+        os.replace(tmp_path, path)
+
+
+def _find_values(obj, key):
+    """Every value stored under key (case-insensitive) anywhere in a nested event document"""
+    values = []
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            if k.lower() == key and isinstance(v, str):
+                values.append(v)
+            else:
+                values.extend(_find_values(v, key))
+    elif isinstance(obj, list):
+        for item in obj:
+            values.extend(_find_values(item, key))
+    return values
+
+
+def lookup_changes(session, region, since):
+    """Change (non read-only) management events recorded in one region since a point in time"""
+    client = get_client(session, 'cloudtrail', region)
+    paginator = client.get_paginator('lookup_events')
+    events = []
+    pages = paginator.paginate(
+        LookupAttributes=[{'AttributeKey': 'ReadOnly', 'AttributeValue': 'false'}],
+        StartTime=since,
+    )
+    for page in pages:
+        for event in page.get('Events', []):
+            if event.get('EventName') in CHANGE_EVENTS:
+                events.append(event)
+    return events
+
+
+def affected_resources(events, checks, regions, default_region):
+    """Work out what to re-check: {(check, region): set of resource IDs, or None for everything}"""
+    affected = {}
+    for event in events:
+        detail = json.loads(event.get('CloudTrailEvent') or '{}')
+        event_region = detail.get('awsRegion', default_region)
+        for check in CHANGE_EVENTS[event['EventName']]:
+            if check not in checks:
+                continue
+            if check in REGIONAL_CHECKS:
+                if event_region not in (regions or [default_region]):
+                    continue
+                region = event_region
+            else:
+                region = None
+            key = (check, region)
+            if check not in TARGETED_CHECKS:
+                affected[key] = None
+                continue
+            event_field = TARGETED_CHECKS[check][0]
+            ids = set(_find_values(detail.get('requestParameters'), event_field))
+            ids.update(_find_values(detail.get('responseElements'), event_field))
+            if not ids:
+                # e.g. a default-VPC group referenced by name; re-check the whole region
+                affected[key] = None
+            elif affected.get(key, set()) is not None:
+                affected[key] = affected.get(key, set()) | ids
+    return affected
+
+
+def _recheck(session, check, region, resources, regional, options):
+    kwargs = dict(options or {})
+    if check in REGIONAL_CHECKS and region:
+        kwargs['region'] = region
+    if resources is not None:
+        kwargs[TARGETED_CHECKS[check][2]] = sorted(resources)
+    findings = get_check(check)(session, **kwargs)
+    if regional and check in REGIONAL_CHECKS:
+        findings = [tag_region(f, region) for f in findings]
+    return findings
+
+
+def _merge(check, old, new, region, resources, regional):
+    """Replace the previous findings for the re-checked resources with the new ones"""
+    finding_field = TARGETED_CHECKS.get(check, (None, None))[1]
+
+    def replaced(finding):
+        if regional and check in REGIONAL_CHECKS and finding.get('Region') != region:
+            return False
+        if resources is None:
+            return True
+        resource = finding.get(finding_field) if finding_field else finding
+        return resource in resources
+
+    return [f for f in old if not replaced(f)] + new
+
+
+def run_incremental_scan(session, cache=None, max_workers=10, state_file=None):
+    """Re-check only what changed since the last scan, according to CloudTrail.
+
+    Falls back to a full scan when there is no usable previous state or the
+    change events can't be read.
+    """
+    state = load_scan_state(state_file)
+    started_utc = datetime.now(timezone.utc)
+
+    def full_scan(reason):
+        print(f"[INFO] Running a full scan: {reason}")
+        scan = run_scan(session, checks=(state or {}).get('checks') or None,
+                        regions=(state or {}).get('regions') or None,
+                        check_options=(state or {}).get('check_options'), cache=cache)
+        scan['mode'] = 'full'
+        save_scan_state(scan, state_file)
+        return scan
+
+    if not state or not state.get('high_water_mark'):
+        return full_scan("no previous scan state")
+    since = datetime.fromisoformat(state['high_water_mark']) - DELIVERY_LAG
+    if started_utc - since > MAX_LOOKBACK:
+        return full_scan("previous scan is older than the CloudTrail lookup window")
+
+    if cache is not None:
+        cache.attach(session)
+
+    checks = list(state['checks'])
+    regions = state.get('regions') or []
+    default_region = session.region_name or GLOBAL_EVENTS_REGION
+    lookup_regions = set(regions or [default_region]) | {GLOBAL_EVENTS_REGION}
+    if 's3' in checks:
+        # S3 bucket events are recorded in the bucket's region, wherever that is
+        try:
+            lookup_regions.update(get_enabled_regions(session))
+        except Exception as e:
+            return full_scan(f"could not list the enabled regions for S3 change events ({e})")
+    lookup_regions = sorted(lookup_regions)
+
+    start = time.perf_counter()
+    try:
+        # Change events and changed resources must be fresh, not from the inventory cache
+        with scan_settings(cache_refresh=True), \
+                ScanThreadPool(max_workers=len(lookup_regions), thread_name_prefix='cspm-trail') as pool:
+            results = pool.map(lambda r: lookup_changes(session, r, since), lookup_regions)
+            events = [event for region_events in results for event in region_events]
+    except Exception as e:
+        return full_scan(f"could not read CloudTrail events ({e})")
+
+    affected = affected_resources(events, checks, regions, default_region)
+    print(f"[INFO] {len(events)} change event(s) since {since.isoformat()}, re-checking {len(affected)} unit(s)")
+
+    scan = dict(state)
+    scan.pop('high_water_mark', None)
+    scan.pop('check_marks', None)
+    scan['mode'] = 'incremental'
+    scan['started'] = datetime.now().isoformat()
+    scan['started_utc'] = started_utc.isoformat()
+    scan['changes'] = [
+        {'check': check, 'region': region, 'resources': sorted(resources) if resources is not None else None}
+        for (check, region), resources in affected.items()
+    ]
+    scan['checks'] = {name: dict(result) for name, result in state['checks'].items()}
+
+    if affected:
+        options = state.get('check_options') or {}
+        with scan_settings(cache_refresh=True), \
+                ScanThreadPool(max_workers=max(1, min(max_workers, len(affected))),
+                               thread_name_prefix='cspm-recheck') as pool:
+            futures = {
+                key: pool.submit(_recheck, session, key[0], key[1], resources, bool(regions), options.get(key[0]))
+                for key, resources in affected.items()
+            }
+            failed = set()
+            for (check, region), future in futures.items():
+                result = scan['checks'][check]
+                try:
+                    new_findings = future.result()
+                except Exception as e:
+                    result['error'] = str(e)
+                    result['status'] = 'error'
+                    failed.add(check)
+                    print(f"[WARN] Incremental re-check of '{check}' failed: {e}")
+                    continue
+                result['findings'] = _merge(check, result['findings'], new_findings, region,
+                                            affected[(check, region)], bool(regions))
+        # An error carried over from the previous state is cleared by a re-check that succeeded
+        for check in {check for check, _ in affected} - failed:
+            if scan['checks'][check].get('error'):
+                scan['checks'][check].update(error=None, status='completed')
+
+    scan['total_issues'] = sum(len(r['findings']) for r in scan['checks'].values())
+    scan['errors'] = sum(1 for r in scan['checks'].values() if r.get('error'))
+    scan['duration'] = round(time.perf_counter() - start, 3)
+    scan['finished'] = datetime.now().isoformat()
+    save_scan_state(scan, state_file)
+    return scan
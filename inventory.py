@@ -0,0 +1,497 @@
+import ipaddress
+import threading
+import time
+from collections import defaultdict
+
+from modules.aws_config import get_client
+from modules.context import ScanThreadPool, scan_setting
+from modules.regions import resolve_regions
+
+DEFAULT_MAX_WORKERS = 10
+
+# Resource type -> collector. A collector fetches one kind of AWS data and
+# returns normalized records (plain dicts with 'type', 'id' and 'region')
+# for one or more resource types; every record field is available to rules.
+# Only the collectors of the resource types a rule set uses are run.
+COLLECTED_BY = {
+    's3_bucket': 's3',
+    'iam_user': 'iam',
+    'iam_group': 'iam',
+    'iam_role': 'iam',
+    'ec2_instance': 'ec2',
+    'security_group_rule': 'security_groups',
+    'cloudtrail_trail': 'cloudtrail',
+    'region': 'cloudtrail',
+}
+
+# Collectors that run once per region, the others once per account
+REGIONAL_COLLECTORS = {'ec2', 'security_groups', 'cloudtrail'}
+
+# Collectors whose records are linked to other records after collection:
+# instances get the rules of their security groups
+LINKS = {'ec2': ('security_groups',)}
+
+
+class Inventory:
+    """Normalized records of every collected resource, indexed by type.
+
+    index(type, field) builds (once) a hash index from a field's value to
+    the records of that type, used to link resources to each other.
+    errors maps (collector, region) to the error of a collection that
+    failed; region is None for account-wide collectors.
+    """
+
+    def __init__(self):
+        self.records = defaultdict(list)
+        self.errors = {}
+        self.regions = []
+        self.duration = None
+        self._indexes = {}
+
+    def add(self, record):
+        self.records[record['type']].append(record)
+        self._indexes = {}
+
+    def of_type(self, resource_type):
+        return self.records.get(resource_type, [])
+
+    def index(self, resource_type, field):
+        key = (resource_type, field)
+        if key not in self._indexes:
+            index = defaultdict(list)
+            for record in self.of_type(resource_type):
+                index[record.get(field)].append(record)
+            self._indexes[key] = index
+        return self._indexes[key]
+
+    def counts(self):
+        return {resource_type: len(records) for resource_type, records in sorted(self.records.items())}
+
+
+# Listings that more than one check reads in full -> the checks reading them.
+# Within a scan that runs several of them, each region's listing is fetched
+# once and its pages are shared (see ScanListings).
+LISTING_READERS = {
+    'instances': {'ec2', 'exposure'},
+    'security_groups': {'sg', 'exposure'},
+}
+
+# Pages of a shared listing kept for readers that are behind the first one.
+# When that many are waiting to be read, the first reader waits for the
+# others to catch up, up to SHARED_LISTING_WAIT seconds in all (a reader
+# may never come, e.g. when its check failed). A reader that falls further
+# behind anyway lists the rest itself.
+MAX_SHARED_PAGES = 8
+SHARED_LISTING_WAIT = 2.0
+
+
+class _SharedListing:
+    def __init__(self, readers):
+        self.readers = readers
+        # Readers still reading the shared pages
+        self.sharing = readers
+        self.started = False
+        # Fetched pages (None once every reader is past it, or dropped to
+        # stay within MAX_SHARED_PAGES) and the token for the page after each
+        self.pages = []
+        self.tokens = []
+        self.unread = []
+        self.kept = 0
+        self.wait = SHARED_LISTING_WAIT
+        self.done = False
+        self.abandoned = False
+        self.error = None
+        self.cond = threading.Condition()
+
+    def add(self, page):
+        # Caller holds cond
+        while self.kept >= MAX_SHARED_PAGES and self.wait > 0:
+            start = time.monotonic()
+            self.cond.wait(self.wait)
+            self.wait -= time.monotonic() - start
+        self.pages.append(page)
+        self.tokens.append(page.get('NextToken'))
+        self.unread.append(self.sharing)
+        self.kept += 1
+        for index in range(len(self.pages) - 1):
+            if self.kept <= MAX_SHARED_PAGES:
+                break
+            self._drop(index)
+
+    def read(self, index):
+        """A reader is done with page index (caller holds cond)"""
+        self.unread[index] -= 1
+        if not self.unread[index]:
+            self._drop(index)
+
+    def leave(self, index):
+        """A reader stops reading the shared pages before page index (caller holds cond)"""
+        self.sharing -= 1
+        for i in range(index, len(self.pages)):
+            self.read(i)
+        self.cond.notify_all()
+
+    def _drop(self, index):
+        if self.pages[index] is not None:
+            self.pages[index] = None
+            self.kept -= 1
+
+
+class ScanListings:
+    """The pages of one scan's shared listings, fetched once per region.
+
+    The first check to read a listing drives the paginator and the pages it
+    gets are kept for the other readers, which follow it page by page
+    instead of listing the region again. A page is dropped once all the
+    listing's readers are past it; a reader that falls more than
+    MAX_SHARED_PAGES behind, or whose leader stops early, continues the
+    listing on its own from the pagination token of the last page it read.
+    """
+
+    def __init__(self, checks):
+        self.lock = threading.Lock()
+        self.readers = {listing: len(readers.intersection(checks)) for listing, readers in LISTING_READERS.items()}
+        self._listings = {}
+
+    def shares(self, listing):
+        return self.readers.get(listing, 0) > 1
+
+    def reads(self, check):
+        """Whether check reads a listing it shares with other checks of the scan"""
+        return any(check in LISTING_READERS[listing] for listing in self.readers if self.shares(listing))
+
+    def skip(self, check, region):
+        """check won't read its shared listings in region (e.g. its findings were resumed from a checkpoint)"""
+        for listing, readers in LISTING_READERS.items():
+            if check not in readers or not self.shares(listing):
+                continue
+            key = (listing, region)
+            with self.lock:
+                shared = self._listings.get(key)
+                if shared is None:
+                    shared = self._listings[key] = _SharedListing(self.readers[listing])
+                shared.readers -= 1
+                if not shared.readers:
+                    del self._listings[key]
+            with shared.cond:
+                shared.leave(0)
+
+    def pages(self, listing, region, paginator):
+        """Yield the listing's pages in region, paginating with paginator only if no other reader did"""
+
+        def fetch(token):
+            return paginator.paginate(PaginationConfig={'StartingToken': token})
+
+        key = (listing, region)
+        with self.lock:
+            shared = self._listings.get(key)
+            if shared is None:
+                shared = self._listings[key] = _SharedListing(self.readers[listing])
+            leader, shared.started = not shared.started, True
+        try:
+            yield from self._fetch(shared, fetch) if leader else self._follow(shared, fetch)
+        finally:
+            with self.lock:
+                shared.readers -= 1
+                if not shared.readers:
+                    del self._listings[key]
+
+    @staticmethod
+    def _fetch(shared, fetch):
+        index = 0
+        try:
+            for page in fetch(None):
+                with shared.cond:
+                    shared.add(page)
+                    shared.cond.notify_all()
+                yield page
+                with shared.cond:
+                    shared.read(index)
+                index += 1
+        except GeneratorExit:
+            # The leader stopped reading (its check failed or was cancelled), the others carry on alone
+            with shared.cond:
+                shared.abandoned = True
+                shared.leave(index)
+            raise
+        except BaseException as e:
+            shared.error = e
+            raise
+        finally:
+            with shared.cond:
+                shared.done = True
+                shared.cond.notify_all()
+
+    @staticmethod
+    def _follow(shared, fetch):
+        index = 0
+        while True:
+            with shared.cond:
+                if index:
+                    shared.read(index - 1)
+                    shared.cond.notify_all()
+                while index >= len(shared.pages) and not shared.done:
+                    shared.cond.wait()
+                if index < len(shared.pages) and shared.pages[index] is not None:
+                    page = shared.pages[index]
+                else:
+                    if index < len(shared.pages) or shared.abandoned:
+                        shared.leave(index)
+                        break
+                    if shared.error is not None:
+                        raise shared.error
+                    return
+            index += 1
+            try:
+                yield page
+            except GeneratorExit:
+                with shared.cond:
+                    shared.leave(index - 1)
+                raise
+        if not index:
+            yield from fetch(None)
+        elif shared.tokens[index - 1] is not None:
+            # Carry on after the last page read; no token means that was the last page
+            yield from fetch(shared.tokens[index - 1])
+
+
+def shared_listing(listing):
+    """The running scan's ScanListings if it shares listing between its checks, else None"""
+    listings = scan_setting('listings')
+    return listings if listings is not None and listings.shares(listing) else None
+
+
+# --- Collectors ---
+
+def collect_s3(session, region=None, prefix=None, tags=None, max_workers=16):
+    """Bucket records with their public access block, ACL grantees and policy status.
+
+    Makes the same calls as the S3 check: the ACL isn't read when the
+    public access block ignores ACLs, nor the policy status when it
+    restricts public policies ('acl_grantees' / 'policy_public' are None).
+    """
+    from modules.s3_check import (_bucket_region, _list_buckets, _matches_tags, _policy_is_public,
+                                  _public_access_block)
+
+    s3 = get_client(session, 's3')
+
+    def describe(bucket, bucket_region):
+        record = {'type': 's3_bucket', 'id': bucket, 'region': bucket_region}
+        try:
+            record['region'] = bucket_region = bucket_region or _bucket_region(s3, bucket)
+            client = get_client(session, 's3', bucket_region)
+            if tags and not _matches_tags(client, bucket, tags):
+                return None
+            block = _public_access_block(client, bucket)
+            record.update({
+                'block_public_acls': bool(block.get('BlockPublicAcls')),
+                'ignore_public_acls': bool(block.get('IgnorePublicAcls')),
+                'block_public_policy': bool(block.get('BlockPublicPolicy')),
+                'restrict_public_buckets': bool(block.get('RestrictPublicBuckets')),
+                'acl_grantees': None,
+                'policy_public': None,
+            })
+            if not (record['block_public_acls'] or record['ignore_public_acls']):
+                grants = client.get_bucket_acl(Bucket=bucket).get('Grants', [])
+                record['acl_grantees'] = [g['Grantee'].get('URI') or g['Grantee'].get('ID')
+                                          for g in grants if g.get('Grantee')]
+            if not record['restrict_public_buckets']:
+                record['policy_public'] = _policy_is_public(client, bucket)
+        except Exception as e:
+            record['error'] = str(e)
+        return record
+
+    with ScanThreadPool(max_workers=max_workers, thread_name_prefix='cspm-s3') as pool:
+        records = pool.map(lambda bucket: describe(*bucket), _list_buckets(s3, prefix))
+        return [record for record in records if record is not None]
+
+
+def collect_iam(session, region=None):
+    """User, group and role records with every policy that applies to them, from one paginated call.
+
+    Each policy is {'name', 'arn', 'via', 'allows_all'}: 'via' is 'attached',
+    'inline' or 'group:<name>', 'allows_all' whether the (default version of
+    the) document allows every action on every resource.
+    """
+    from modules.iam_check import get_authorization_details, grants_admin
+
+    details = get_authorization_details(session)
+    managed = {}
+    for policy in details.get('Policies', []):
+        document = next((v.get('Document') for v in policy.get('PolicyVersionList', []) if v.get('IsDefaultVersion')),
+                        None)
+        managed[policy['Arn']] = grants_admin(document) if document else False
+
+    def policies(entity, inline_key):
+        found = [{'name': p['PolicyName'], 'arn': p['PolicyArn'], 'via': 'attached',
+                  'allows_all': managed.get(p['PolicyArn'], False)}
+                 for p in entity.get('AttachedManagedPolicies', [])]
+        found.extend({'name': p['PolicyName'], 'arn': None, 'via': 'inline',
+                      'allows_all': grants_admin(p.get('PolicyDocument'))}
+                     for p in entity.get(inline_key, []))
+        return found
+
+    records = []
+    groups = {}
+    for group in details.get('GroupDetailList', []):
+        groups[group['GroupName']] = policies(group, 'GroupPolicyList')
+        records.append({'type': 'iam_group', 'id': group['GroupName'], 'region': None, 'arn': group.get('Arn'),
+                        'policies': groups[group['GroupName']]})
+    for user in details.get('UserDetailList', []):
+        inherited = [dict(p, via=f"group:{name}") for name in user.get('GroupList', []) for p in groups.get(name, [])]
+        records.append({'type': 'iam_user', 'id': user['UserName'], 'region': None, 'arn': user.get('Arn'),
+                        'groups': user.get('GroupList', []),
+                        'policies': policies(user, 'UserPolicyList') + inherited})
+    for role in details.get('RoleDetailList', []):
+        records.append({'type': 'iam_role', 'id': role['RoleName'], 'region': None, 'arn': role.get('Arn'),
+                        'policies': policies(role, 'RolePolicyList')})
+    return records
+
+
+def collect_ec2(session, region=None):
+    """Instance records: state, public IPv4/IPv6 addresses and security groups"""
+    from modules.exposure import _interfaces
+
+    ec2 = get_client(session, 'ec2', region)
+    records = []
+    for page in ec2.get_paginator('describe_instances').paginate():
+        for reservation in page.get('Reservations', []):
+            for instance in reservation.get('Instances', []):
+                groups, ipv6 = [], []
+                for _, _, addresses, group_ids in _interfaces(instance):
+                    ipv6.extend(addresses)
+                    groups.extend(g for g in group_ids if g not in groups)
+                records.append({
+                    'type': 'ec2_instance',
+                    'id': instance.get('InstanceId'),
+                    'region': region,
+                    'state': instance.get('State', {}).get('Name'),
+                    'public_ip': instance.get('PublicIpAddress'),
+                    'ipv6_addresses': ipv6,
+                    'security_groups': groups,
+                    'tags': {t['Key']: t['Value'] for t in instance.get('Tags', [])},
+                })
+    return records
+
+
+def _is_internet(source, networks):
+    if source not in networks:
+        try:
+            networks[source] = ipaddress.ip_network(source, strict=False).prefixlen == 0
+        except ValueError:
+            networks[source] = False
+    return networks[source]
+
+
+def collect_security_groups(session, region=None):
+    """One record per security group ingress rule and source, 'internet' if the source is 0.0.0.0/0 or ::/0"""
+    from modules.sg_check import iter_rules, iter_security_group_pages
+
+    networks = {}
+    records = []
+    for page in iter_security_group_pages(session, region):
+        for rule in iter_rules(page):
+            records.append({
+                'type': 'security_group_rule',
+                'id': f"{rule['GroupId']}:{rule['Protocol']}:{rule['FromPort']}-{rule['ToPort']}:{rule['Source']}",
+                'region': region,
+                'group_id': rule['GroupId'],
+                'group_description': rule['Description'],
+                'protocol': rule['Protocol'],
+                'from_port': rule['FromPort'],
+                'to_port': rule['ToPort'],
+                'source_type': rule['SourceType'],
+                'source': rule['Source'],
+                'internet': rule['SourceType'] in ('ipv4', 'ipv6') and _is_internet(rule['Source'], networks),
+            })
+    return records
+
+
+def collect_cloudtrail(session, region=None):
+    """Trail records (homed in this region) and a 'region' record with the number of trails it sees"""
+    client = get_client(session, 'cloudtrail', region)
+    current_region = client.meta.region_name
+    trails = client.describe_trails()['trailList']
+    records = [{'type': 'region', 'id': current_region, 'region': current_region, 'trail_count': len(trails)}]
+    for trail in trails:
+        # Multi-region trails show up in every region; only describe them from their home region
+        if trail.get('HomeRegion', current_region) != current_region:
+            continue
+        status = client.get_trail_status(Name=trail['Name'])
+        records.append({
+            'type': 'cloudtrail_trail',
+            'id': trail['Name'],
+            'region': current_region,
+            'is_logging': status.get('IsLogging', False),
+            'multi_region': trail.get('IsMultiRegionTrail', False),
+            'log_file_validation': trail.get('LogFileValidationEnabled', False),
+            'kms_key_id': trail.get('KmsKeyId'),
+        })
+    return records
+
+
+COLLECTORS = {
+    's3': collect_s3,
+    'iam': collect_iam,
+    'ec2': collect_ec2,
+    'security_groups': collect_security_groups,
+    'cloudtrail': collect_cloudtrail,
+}
+
+
+def link_instances(inventory):
+    """Give every instance the rules of its security groups ('security_group_rules')"""
+    rules_by_group = inventory.index('security_group_rule', 'group_id')
+    for instance in inventory.of_type('ec2_instance'):
+        instance['security_group_rules'] = [
+            rule for group_id in instance['security_groups'] for rule in rules_by_group.get(group_id, [])
+            if rule['region'] == instance['region']
+        ]
+
+
+def build_inventory(session, resource_types=None, regions=None, s3_prefix=None, max_workers=DEFAULT_MAX_WORKERS):
+    """Run the collectors needed for resource_types (default: all) and return the Inventory.
+
+    Regional collectors run once per region in regions ('all' or a list,
+    default the session's region). All collections run concurrently and
+    each one makes its API calls exactly once, however many rules use it.
+    """
+    resource_types = resource_types or list(COLLECTED_BY)
+    unknown = [t for t in resource_types if t not in COLLECTED_BY]
+    if unknown:
+        raise ValueError(f"Unknown resource type(s): {', '.join(unknown)}")
+    collectors = {COLLECTED_BY[t] for t in resource_types}
+    for name in list(collectors):
+        collectors.update(LINKS.get(name, ()))
+
+    inventory = Inventory()
+    session.get_credentials()
+    if collectors & REGIONAL_COLLECTORS:
+        inventory.regions = resolve_regions(session, regions) or [session.region_name]
+
+    units = []
+    for name in sorted(collectors):
+        if name in REGIONAL_COLLECTORS:
+            units.extend((name, region) for region in inventory.regions)
+        else:
+            units.append((name, None))
+
+    def collect(name, region):
+        kwargs = {'prefix': s3_prefix} if name == 's3' else {}
+        return COLLECTORS[name](session, region=region, **kwargs)
+
+    start = time.perf_counter()
+    with ScanThreadPool(max_workers=max(1, min(max_workers, len(units))), thread_name_prefix='cspm-collect') as pool:
+        futures = {unit: pool.submit(collect, *unit) for unit in units}
+        for (name, region), future in futures.items():
+            try:
+                for record in future.result():
+                    inventory.add(record)
+            except Exception as e:
+                inventory.errors[(name, region)] = str(e)
+                print(f"[WARN] Collecting {name}{f' in {region}' if region else ''} failed: {e}")
+
+    if 'ec2' in collectors:
+        link_instances(inventory)
+    inventory.duration = round(time.perf_counter() - start, 3)
+    return inventory
@@ -0,0 +1,74 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Scans run at the same time (CSPM_JOB_WORKERS); further jobs wait in the queue.
+# Every scan fans out over its own check and region threads, and all of them
+# share the clients, rate limits and inventory cache, so a few at a time is
+# plenty.
+DEFAULT_JOB_WORKERS = 3
+
+
+class Job:
+    """A submitted scan: its ID, parameters and cancellation flag"""
+
+    def __init__(self, job_id, params):
+        self.id = job_id
+        self.params = params
+        self.cancelled = threading.Event()
+        self.future = None
+
+
+class JobManager:
+    """Runs scan jobs on a bounded pool of worker threads.
+
+    submit() queues run(job) for a job ID handed out by the caller (the
+    results store's scan ID). cancel() drops a job that hasn't started yet,
+    or sets the cancelled event of a running one, which the scan checks
+    as it goes.
+    """
+
+    def __init__(self, run, max_workers=None):
+        self.run = run
+        self.max_workers = max_workers or int(os.getenv('CSPM_JOB_WORKERS', DEFAULT_JOB_WORKERS))
+        self.pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='cspm-job')
+        self.lock = threading.Lock()
+        self.jobs = {}
+
+    def submit(self, job_id, params):
+        job = Job(job_id, params)
+        with self.lock:
+            self.jobs[job_id] = job
+            job.future = self.pool.submit(self._run, job)
+        return job
+
+    def _run(self, job):
+        try:
+            self.run(job)
+        finally:
+            with self.lock:
+                self.jobs.pop(job.id, None)
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """Cancel a job: 'queued' if it was dropped before starting, 'running' if it was
+        asked to stop, None if there is no such job (anymore)"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            job.cancelled.set()
+            if job.future.cancel():
+                del self.jobs[job_id]
+                return 'queued'
+        return 'running'
+
+    def shutdown(self, wait=True):
+        with self.lock:
+            jobs = list(self.jobs.values())
+        for job in jobs:
+            job.cancelled.set()
+        self.pool.shutdown(wait=wait, cancel_futures=True)
@@ -0,0 +1,167 @@
+import threading
+import time
+from collections import defaultdict
+
+# Latency histogram buckets in seconds
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+THROTTLE_CODES = {
+    'Throttling', 'ThrottlingException', 'ThrottledException', 'RequestThrottledException',
+    'TooManyRequestsException', 'ProvisionedThroughputExceededException', 'RequestLimitExceeded',
+    'RequestThrottled', 'SlowDown', 'EC2ThrottledException', 'BandwidthLimitExceeded',
+    'PriorRequestNotComplete', 'LimitExceededException',
+}
+
+
+def _error_code(parsed):
+    return (parsed or {}).get('Error', {}).get('Code')
+
+
+def _operation_labels(event_name):
+    # Event names look like 'after-call.ec2.DescribeInstances'
+    _, service, operation = event_name.split('.', 2)
+    return service, operation
+
+
+class APIMetrics:
+    """Per service/operation AWS API call counters and latency histograms"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.calls = defaultdict(int)
+            self.errors = defaultdict(int)
+            self.throttles = defaultdict(int)
+            self.retries = defaultdict(int)
+            self.cache_hits = defaultdict(int)
+            self.rate_waits = defaultdict(float)
+            self.latency_buckets = defaultdict(lambda: [0] * len(LATENCY_BUCKETS))
+            self.latency_sum = defaultdict(float)
+            self.latency_count = defaultdict(int)
+
+    def record_call(self, service, operation, duration, retries=0, error_code=None):
+        key = (service, operation)
+        with self.lock:
+            self.calls[key] += 1
+            self.retries[key] += retries
+            if error_code:
+                self.errors[key + (error_code,)] += 1
+            self.latency_sum[key] += duration
+            self.latency_count[key] += 1
+            buckets = self.latency_buckets[key]
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if duration <= bound:
+                    buckets[i] += 1
+
+    def record_throttle(self, service, operation):
+        with self.lock:
+            self.throttles[(service, operation)] += 1
+
+    def record_cache_hit(self, service, operation):
+        with self.lock:
+            self.cache_hits[(service, operation)] += 1
+
+    def record_rate_wait(self, service, operation, seconds):
+        with self.lock:
+            self.rate_waits[(service, operation)] += seconds
+
+    def summary(self):
+        """Totals per service: calls, errors, throttles, retries, cache hits, time spent and time rate limited"""
+        totals = defaultdict(lambda: defaultdict(float))
+        with self.lock:
+            for (service, _), value in self.calls.items():
+                totals[service]['calls'] += value
+            for (service, _, _), value in self.errors.items():
+                totals[service]['errors'] += value
+            for (service, _), value in self.throttles.items():
+                totals[service]['throttles'] += value
+            for (service, _), value in self.retries.items():
+                totals[service]['retries'] += value
+            for (service, _), value in self.cache_hits.items():
+                totals[service]['cache_hits'] += value
+            for (service, _), value in self.latency_sum.items():
+                totals[service]['seconds'] += value
+            for (service, _), value in self.rate_waits.items():
+                totals[service]['rate_limited'] += value
+        return {service: dict(values) for service, values in sorted(totals.items())}
+
+    def render_prometheus(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+
+        def counter(name, help_text, values, label_names):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for labels, value in sorted(values.items()):
+                label_text = ','.join(f'{n}="{v}"' for n, v in zip(label_names, labels))
+                lines.append(f"{name}{{{label_text}}} {value}")
+
+        with self.lock:
+            counter('cspm_aws_api_calls_total', 'AWS API calls sent.', self.calls, ('service', 'operation'))
+            counter('cspm_aws_api_errors_total', 'AWS API calls that failed, by error code.', self.errors,
+                    ('service', 'operation', 'code'))
+            counter('cspm_aws_api_throttles_total', 'Throttling errors received, including retried attempts.',
+                    self.throttles, ('service', 'operation'))
+            counter('cspm_aws_api_retries_total', 'Retry attempts made by botocore.', self.retries,
+                    ('service', 'operation'))
+            counter('cspm_aws_api_cache_hits_total', 'AWS API calls served from the inventory cache.',
+                    self.cache_hits, ('service', 'operation'))
+            counter('cspm_aws_api_rate_limit_wait_seconds_total', 'Time spent waiting for the client-side rate limiter.',
+                    self.rate_waits, ('service', 'operation'))
+
+            name = 'cspm_aws_api_call_duration_seconds'
+            lines.append(f"# HELP {name} AWS API call latency, including retries.")
+            lines.append(f"# TYPE {name} histogram")
+            for (service, operation), buckets in sorted(self.latency_buckets.items()):
+                labels = f'service="{service}",operation="{operation}"'
+                for bound, count in zip(LATENCY_BUCKETS, buckets):
+                    lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {self.latency_count[(service, operation)]}')
+                lines.append(f"{name}_sum{{{labels}}} {self.latency_sum[(service, operation)]:.6f}")
+                lines.append(f"{name}_count{{{labels}}} {self.latency_count[(service, operation)]}")
+        return '\n'.join(lines) + '\n'
+
+    def instrument(self, client):
+        """Record every call made through a botocore client"""
+
+        def before_call(context, **kwargs):
+            context['cspm_metrics_start'] = time.perf_counter()
+
+        def after_call(http_response, parsed, context, **kwargs):
+            service, operation = _operation_labels(kwargs['event_name'])
+            if context.get('cspm_cache_hit'):
+                self.record_cache_hit(service, operation)
+                return
+            start = context.pop('cspm_metrics_start', None)
+            if start is None:
+                return
+            retries = (parsed or {}).get('ResponseMetadata', {}).get('RetryAttempts', 0)
+            error_code = _error_code(parsed) if http_response.status_code >= 300 else None
+            self.record_call(service, operation, time.perf_counter() - start, retries, error_code)
+
+        def after_call_error(exception, context, **kwargs):
+            start = context.pop('cspm_metrics_start', None)
+            if start is None:
+                return
+            service, operation = _operation_labels(kwargs['event_name'])
+            self.record_call(service, operation, time.perf_counter() - start, error_code=type(exception).__name__)
+
+        def needs_retry(response=None, **kwargs):
+            # Fires for every attempt, so throttled attempts that later succeed are counted too
+            if response is not None and _error_code(response[1]) in THROTTLE_CODES:
+                self.record_throttle(*_operation_labels(kwargs['event_name']))
+
+        unique = f"cspm-metrics-{id(self)}"
+        events = client.meta.events
+        events.register('before-call.*.*', before_call, unique_id=f"{unique}-before")
+        events.register('after-call.*.*', after_call, unique_id=f"{unique}-after")
+        events.register('after-call-error.*.*', after_call_error, unique_id=f"{unique}-error")
+        events.register('needs-retry.*.*', needs_retry, unique_id=f"{unique}-retry")
+        return client
+
+
+# Process-wide metrics, shared by every instrumented client
+api_metrics = APIMetrics()
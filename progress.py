@@ -0,0 +1,122 @@
+import threading
+import time
+from collections import deque
+
+# Findings are published in batches of at most this many, or whatever was
+# found within FLUSH_INTERVAL seconds, so a large page doesn't turn into
+# thousands of events
+BATCH_SIZE = 100
+FLUSH_INTERVAL = 0.5
+
+# Events that end a scan's stream
+FINAL_EVENTS = {'scan_completed', 'scan_failed', 'scan_cancelled'}
+
+# Streams of finished scans kept for late or reconnecting subscribers
+DEFAULT_RETAIN = 10
+
+# Findings a stream keeps for replay. Older batches, and every batch of a
+# finished scan once the next one starts, are replayed with their count
+# only: the findings themselves are in the ResultsStore (/api/findings).
+REPLAY_FINDINGS = 2000
+
+
+class ScanCancelled(Exception):
+    """Raised inside a running scan once it has been cancelled"""
+
+
+class EventStream:
+    """Ordered, replayable progress events of one scan.
+
+    Events are numbered from 1 so a subscriber can resume after the last
+    one it saw (SSE Last-Event-ID). Publishing is thread-safe; readers block
+    in read() until something new arrives or the timeout passes. Every
+    'findings' event has a 'count'; only the most recent replay_findings
+    findings are kept with theirs, older events are replayed without
+    'findings'.
+    """
+
+    def __init__(self, replay_findings=REPLAY_FINDINGS):
+        self.events = []
+        self.closed = False
+        self.condition = threading.Condition()
+        self.replay_findings = replay_findings
+        # Indexes of the events still carrying their findings, and how many
+        self.kept = deque()
+        self.kept_findings = 0
+
+    def publish(self, event, data):
+        with self.condition:
+            if event == 'findings':
+                data = dict(data, count=len(data['findings']))
+                self.kept.append(len(self.events))
+                self.kept_findings += data['count']
+            self.events.append((len(self.events) + 1, event, data))
+            while self.kept_findings > self.replay_findings:
+                self._drop_findings(self.kept.popleft())
+            if event in FINAL_EVENTS:
+                self.closed = True
+            self.condition.notify_all()
+
+    def compact(self):
+        """Keep only the counts of every findings event"""
+        with self.condition:
+            while self.kept:
+                self._drop_findings(self.kept.popleft())
+
+    def _drop_findings(self, index):
+        seq, event, data = self.events[index]
+        self.events[index] = (seq, event, {key: value for key, value in data.items() if key != 'findings'})
+        self.kept_findings -= data['count']
+
+    def read(self, after=0, timeout=None):
+        """(events after sequence number `after`, closed), waiting up to timeout for new ones"""
+        with self.condition:
+            if len(self.events) <= after and not self.closed:
+                self.condition.wait(timeout)
+            return self.events[after:], self.closed
+
+
+class ScanEvents:
+    """Event streams by scan ID, keeping the most recent finished ones (their findings events as counts)"""
+
+    def __init__(self, retain=DEFAULT_RETAIN):
+        self.retain = retain
+        self.lock = threading.Lock()
+        self.streams = {}
+
+    def open(self, scan_id):
+        with self.lock:
+            stream = self.streams[scan_id] = EventStream()
+            finished = [key for key, s in self.streams.items() if s.closed]
+            for key in finished[:max(0, len(finished) - self.retain)]:
+                del self.streams[key]
+            retained = [self.streams[key] for key in finished if key in self.streams]
+        for finished_stream in retained:
+            finished_stream.compact()
+        return stream
+
+    def get(self, scan_id):
+        with self.lock:
+            return self.streams.get(scan_id)
+
+
+class FindingBatcher:
+    """Collects findings as a check yields them and hands them on in batches"""
+
+    def __init__(self, publish, size=BATCH_SIZE, interval=FLUSH_INTERVAL):
+        self.publish = publish
+        self.size = size
+        self.interval = interval
+        self.batch = []
+        self.flushed = time.monotonic()
+
+    def add(self, finding):
+        self.batch.append(finding)
+        if len(self.batch) >= self.size or time.monotonic() - self.flushed >= self.interval:
+            self.flush()
+
+    def flush(self):
+        if self.batch:
+            self.publish(self.batch)
+        self.batch = []
+        self.flushed = time.monotonic()
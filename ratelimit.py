@@ -0,0 +1,155 @@
+import os
+import threading
+import time
+
+from modules.metrics import THROTTLE_CODES, _error_code, _operation_labels, api_metrics
+
+# Requests per second and burst size per service. AWS throttles per account,
+# region and API, so every (account, region, service, operation) gets its
+# own bucket.
+# Override with CSPM_RATE_<SERVICE> or CSPM_RATE_<SERVICE>_<OPERATION>
+# (requests per second), e.g. CSPM_RATE_IAM=5 or CSPM_RATE_EC2_DESCRIBEINSTANCES=50.
+DEFAULT_RATES = {
+    'ec2': (20.0, 100),
+    'iam': (10.0, 20),
+    's3': (50.0, 100),
+    'cloudtrail': (5.0, 10),
+    'sts': (50.0, 100),
+}
+DEFAULT_RATE = (20.0, 40)
+
+# Operations with much lower limits than the rest of their service
+OPERATION_RATES = {
+    ('cloudtrail', 'LookupEvents'): (2.0, 2),
+    ('iam', 'GetAccountAuthorizationDetails'): (5.0, 5),
+}
+
+# On a throttling error the rate is halved (not below MIN_RATE); every
+# successful call gives back RECOVERY of the configured rate
+BACKOFF = 0.5
+RECOVERY = 0.02
+MIN_RATE = 0.5
+
+# Throttling errors within this many seconds of a backoff belong to the same
+# burst and don't lower the rate again
+BACKOFF_WINDOW = 1.0
+
+
+def _configured_rate(service, operation):
+    rate, burst = OPERATION_RATES.get((service, operation), DEFAULT_RATES.get(service, DEFAULT_RATE))
+    for name in (f"CSPM_RATE_{service}_{operation}", f"CSPM_RATE_{service}"):
+        value = os.getenv(name.upper().replace('-', '_'))
+        if value:
+            rate = float(value)
+            burst = max(1, int(rate))
+            break
+    return rate, burst
+
+
+class TokenBucket:
+    """Token bucket whose refill rate backs off on throttling and slowly recovers"""
+
+    def __init__(self, rate, burst):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.backed_off = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        """Take a token, sleeping until one is available. Returns the seconds waited."""
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            # Reserve the token now (possibly going negative) so concurrent
+            # callers queue up behind each other instead of all waking at once
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+        return wait
+
+    def throttled(self):
+        with self.lock:
+            now = time.monotonic()
+            if now - self.backed_off < BACKOFF_WINDOW:
+                return
+            self._refill(now)
+            self.rate = max(MIN_RATE, self.rate * BACKOFF)
+            self.tokens = min(self.tokens, 0.0)
+            self.backed_off = now
+
+    def succeeded(self):
+        if self.rate >= self.max_rate:
+            return
+        with self.lock:
+            self._refill(time.monotonic())
+            self.rate = min(self.max_rate, self.rate + self.max_rate * RECOVERY)
+
+
+class RateLimiter:
+    """Token buckets per (account, region, service, operation), shared by every client"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = {}
+
+    def bucket(self, account, region, service, operation):
+        key = (account, region, service, operation)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            with self.lock:
+                bucket = self.buckets.get(key)
+                if bucket is None:
+                    bucket = self.buckets[key] = TokenBucket(*_configured_rate(service, operation))
+        return bucket
+
+    def rates(self):
+        """Current (possibly backed off) rate per (account, region, service, operation)"""
+        return {key: bucket.rate for key, bucket in sorted(self.buckets.items(), key=lambda item: str(item[0]))}
+
+    def attach(self, client, account=None):
+        """Rate limit every request sent by a botocore client, retries included.
+
+        account identifies the credentials the client signs with (their
+        access key), so scans of different accounts don't share a budget.
+        """
+        region = client.meta.region_name
+
+        def before_send(**kwargs):
+            # Fires once per attempt, after the cache had its chance to answer
+            service, operation = _operation_labels(kwargs['event_name'])
+            waited = self.bucket(account, region, service, operation).acquire()
+            if waited:
+                api_metrics.record_rate_wait(service, operation, waited)
+
+        def needs_retry(response=None, **kwargs):
+            if response is None:
+                return
+            bucket = self.bucket(account, region, *_operation_labels(kwargs['event_name']))
+            if _error_code(response[1]) in THROTTLE_CODES:
+                bucket.throttled()
+            elif response[0].status_code < 300:
+                bucket.succeeded()
+
+        unique = f"cspm-ratelimit-{id(self)}"
+        events = client.meta.events
+        events.register('before-send.*.*', before_send, unique_id=f"{unique}-send")
+        events.register('needs-retry.*.*', needs_retry, unique_id=f"{unique}-retry")
+        return client
+
+
+def get_rate_limiter():
+    """Process-wide rate limiter, or None when disabled with CSPM_RATE_LIMIT=0"""
+    if os.getenv('CSPM_RATE_LIMIT', '1') == '0':
+        return None
+    return rate_limiter
+
+
+rate_limiter = RateLimiter()
@@ -0,0 +1,57 @@
+from modules.aws_config import get_client
+from modules.context import ScanThreadPool
+from modules.progress import ScanCancelled
+
+DEFAULT_REGION_WORKERS = 20
+
+
+def get_enabled_regions(session):
+    """Return the regions enabled for this account (opted-in or not requiring opt-in)"""
+    ec2 = get_client(session, 'ec2', session.region_name or 'us-east-1')
+    response = ec2.describe_regions(
+        Filters=[{'Name': 'opt-in-status', 'Values': ['opt-in-not-required', 'opted-in']}]
+    )
+    return sorted(r['RegionName'] for r in response.get('Regions', []))
+
+
+def resolve_regions(session, regions):
+    """Turn a region selection ('all', a comma separated string or a list) into a list of region names"""
+    if not regions:
+        return []
+    if isinstance(regions, str):
+        if regions.strip().lower() == 'all':
+            return get_enabled_regions(session)
+        regions = regions.split(',')
+    return [r.strip() for r in regions if r and r.strip()]
+
+
+def tag_region(finding, region):
+    """Return a copy of a finding tagged with the region it came from"""
+    tagged = dict(finding)
+    tagged['Region'] = region
+    return tagged
+
+
+def scan_regions(session, check, regions, max_workers=DEFAULT_REGION_WORKERS):
+    """Run a regional check in every region in parallel and merge the results.
+
+    Returns (findings, errors): findings are tagged with 'Region', errors maps
+    region -> error message for regions that failed.
+    """
+    findings = []
+    errors = {}
+    if not regions:
+        return findings, errors
+
+    workers = max(1, min(max_workers, len(regions)))
+    with ScanThreadPool(max_workers=workers, thread_name_prefix='cspm-region') as pool:
+        futures = {region: pool.submit(check, session, region=region) for region in regions}
+        for region, future in futures.items():
+            try:
+                findings.extend(tag_region(f, region) for f in future.result())
+            except ScanCancelled:
+                raise
+            except Exception as e:
+                errors[region] = str(e)
+                print(f"[WARN] {getattr(check, '__name__', check)} failed in {region}: {e}")
+    return findings, errors
@@ -1,7 +1,27 @@
-import pandas as pd
-from tabulate import tabulate
+import csv
+import gzip
+import json
 import os
 
+from tabulate import tabulate
+
+# Columns of the consolidated scan report, in order
+REPORT_FIELDS = ('check', 'resource', 'region', 'account', 'risk', 'detail')
+
+# Per check: the finding field naming the resource, its risk level, and the
+# per-check CSV view (file name, resource column)
+CHECK_REPORTING = {
+    's3': {'resource': 'Bucket', 'risk': 'High', 'view': ('public_s3_buckets.csv', 'Bucket')},
+    'iam': {'resource': 'UserName', 'risk': 'Medium', 'view': ('iam_admin_users.csv', 'AdminUser')},
+    'ec2': {'resource': 'InstanceId', 'risk': 'High', 'view': ('public_ec2_instances.csv', 'InstanceId')},
+    'cloudtrail': {'resource': 'Trail', 'risk': 'Medium', 'view': ('cloudtrail_status.csv', 'Trail')},
+    'sg': {'resource': 'GroupId', 'risk': 'High', 'view': ('security_groups.csv', 'GroupId')},
+    'exposure': {'resource': 'InstanceId', 'risk': 'Critical', 'view': ('network_exposure.csv', 'InstanceId')},
+}
+
+# Rule engine findings (rules.py) name their resource and risk themselves
+RULE_REPORTING = {'resource': 'Resource', 'risk': 'Medium'}
+
 def print_report(data, title="Report"):
     print(f"\n--- {title} ---")
     if not data:
@@ -9,14 +29,172 @@ def print_report(data, title="Report"):
         return
     print(tabulate(data, headers="keys"))
 
-import pandas as pd
-import os
+def _open(path, mode):
+    # Transparent gzip for *.gz paths
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', newline='', encoding='utf-8')
+    return open(path, mode, newline='', encoding='utf-8')
+
+def _format(path, fmt=None):
+    if fmt:
+        return fmt
+    name = path[:-3] if path.endswith('.gz') else path
+    return 'jsonl' if name.endswith(('.jsonl', '.json')) else 'csv'
+
+class FindingWriter:
+    """Write findings to CSV or JSONL one row at a time, without holding them in memory.
+
+    The format comes from the file extension unless fmt is given, and paths
+    ending in .gz are gzip compressed. CSV columns are fieldnames, or the
+    keys of the first row written.
+    """
+
+    def __init__(self, path, fmt=None, fieldnames=None):
+        self.path = path
+        self.fmt = _format(path, fmt)
+        self.fieldnames = list(fieldnames) if fieldnames else None
+        self.count = 0
+        self._file = None
+        self._csv = None
+
+    def __enter__(self):
+        # Ensure the folder exists
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self._file = _open(self.path, 'w')
+        return self
+
+    def __exit__(self, *exc):
+        self._file.close()
+
+    def write(self, row):
+        if self.fmt == 'jsonl':
+            self._file.write(json.dumps(row, default=str) + '\n')
+        else:
+            if self._csv is None:
+                self._csv = csv.DictWriter(self._file, fieldnames=self.fieldnames or list(row), extrasaction='ignore')
+                self._csv.writeheader()
+            self._csv.writerow(row)
+        self.count += 1
+
+    def write_all(self, rows):
+        for row in rows:
+            self.write(row)
+        return self.count
+
+def write_findings(rows, path, fmt=None, fieldnames=None):
+    """Stream an iterable of finding dicts to a CSV or JSONL file, returns the number of rows"""
+    with FindingWriter(path, fmt, fieldnames) as writer:
+        return writer.write_all(rows)
 
 def export_csv(data, path):
-    # Ensure the folder exists
-    os.makedirs(os.path.dirname(path), exist_ok=True)
-    
-    df = pd.DataFrame(data)
-    df.to_csv(path, index=False)
+    write_findings(data, path, fmt='csv')
 
     print(f"[INFO] Report exported to {path}")
+
+# --- Consolidated report ---
+
+def normalize_finding(check, finding):
+    """One report row: check, resource, region, account, risk and the remaining fields as detail"""
+    reporting = CHECK_REPORTING.get(check, RULE_REPORTING)
+    if not isinstance(finding, dict):
+        # S3/IAM findings are plain names outside multi-account scans
+        return {'check': check, 'resource': finding, 'region': None, 'account': None,
+                'risk': reporting['risk'], 'detail': {}}
+    resource_field = reporting['resource']
+    return {
+        'check': check,
+        'resource': finding.get(resource_field),
+        'region': finding.get('Region'),
+        'account': finding.get('Account'),
+        'risk': finding.get('Risk', reporting['risk']),
+        'detail': {k: v for k, v in finding.items() if k not in (resource_field, 'Region', 'Account', 'Risk')},
+    }
+
+def iter_scan_findings(scan):
+    """(check, finding) pairs from a run_scan or run_multi_account_scan result"""
+    if 'accounts' in scan:
+        for account in scan['accounts'].values():
+            for name, result in account['checks'].items():
+                for finding in result['findings']:
+                    yield name, finding
+        return
+    for name, result in scan['checks'].items():
+        for finding in result['findings']:
+            yield name, finding
+
+def write_report(findings, path, fmt=None):
+    """Write (check, finding) pairs to one normalized report in a single pass.
+
+    JSONL keeps detail as an object; CSV stores it as a JSON string so the
+    columns stay fixed. Returns the number of rows written.
+    """
+    fmt = _format(path, fmt)
+    rows = (normalize_finding(check, finding) for check, finding in findings)
+    if fmt == 'csv':
+        rows = (dict(row, detail=json.dumps(row['detail'], default=str)) for row in rows)
+    count = write_findings(rows, path, fmt, REPORT_FIELDS)
+    print(f"[INFO] {count} finding(s) written to {path}")
+    return count
+
+def write_delta_report(delta, path, fmt=None):
+    """Write only the changes of a scan (see fingerprints.diff_scan): the report columns plus 'change'"""
+    fmt = _format(path, fmt)
+
+    def rows():
+        for check, findings in delta['new'].items():
+            for finding in findings:
+                yield dict(normalize_finding(check, finding), change='new')
+        for check, resolved in delta['resolved'].items():
+            risk = CHECK_REPORTING.get(check, {}).get('risk', 'Medium')
+            for entry in resolved:
+                yield {'check': check, 'resource': entry['resource'], 'region': entry['region'],
+                       'account': entry['account'], 'risk': risk, 'detail': entry['detail'], 'change': 'resolved'}
+
+    out = rows()
+    if fmt == 'csv':
+        out = (dict(row, detail=json.dumps(row['detail'], default=str)) for row in out)
+    count = write_findings(out, path, fmt, REPORT_FIELDS + ('change',))
+    print(f"[INFO] {count} change(s) written to {path}")
+    return count
+
+def read_report(path, fmt=None):
+    """Stream rows back from a report written by write_report"""
+    fmt = _format(path, fmt)
+    with _open(path, 'r') as f:
+        if fmt == 'jsonl':
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            for row in csv.DictReader(f):
+                row['detail'] = json.loads(row['detail']) if row.get('detail') else {}
+                yield {k: (v if v != '' else None) for k, v in row.items()}
+
+def export_views(report_path, out_dir, checks=None):
+    """Per-check CSV files (the pre-report layout) generated from a consolidated report in one pass.
+
+    Returns the paths written, by check.
+    """
+    writers = {}
+    try:
+        for row in read_report(report_path):
+            check = row['check']
+            if check not in CHECK_REPORTING or (checks and check not in checks):
+                continue
+            if check not in writers:
+                filename, _ = CHECK_REPORTING[check]['view']
+                writers[check] = FindingWriter(os.path.join(out_dir, filename), 'csv').__enter__()
+            _, column = CHECK_REPORTING[check]['view']
+            view = {column: row['resource']}
+            view.update(row['detail'])
+            if row['region']:
+                view['Region'] = row['region']
+            if row['account']:
+                view['Account'] = row['account']
+            if row.get('change'):
+                view['Change'] = row['change']
+            writers[check].write(view)
+    finally:
+        for writer in writers.values():
+            writer.__exit__(None, None, None)
+    return {check: writer.path for check, writer in writers.items()}
@@ -0,0 +1,204 @@
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+from modules.cache import state_path
+
+# Dashboard finding lists, in the order the API returns them: (category, results key)
+CATEGORIES = (
+    ('s3', 's3_findings'),
+    ('iam', 'iam_findings'),
+    ('ec2', 'ec2_findings'),
+    ('cloudtrail', 'cloudtrail_findings'),
+    ('sg', 'sg_findings'),
+    ('exposure', 'exposure_findings'),
+)
+
+# Completed scans kept in the history (CSPM_RESULTS_HISTORY)
+DEFAULT_HISTORY = 50
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scans (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    started TEXT NOT NULL,
+    finished TEXT,
+    status TEXT NOT NULL,
+    meta TEXT NOT NULL DEFAULT '{}'
+);
+CREATE TABLE IF NOT EXISTS findings (
+    scan_id INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    category TEXT NOT NULL,
+    risk TEXT,
+    region TEXT,
+    account TEXT,
+    data TEXT NOT NULL,
+    PRIMARY KEY (scan_id, seq)
+);
+CREATE INDEX IF NOT EXISTS findings_filter ON findings (scan_id, category, risk, region);
+"""
+
+
+class ResultsStore:
+    """Scan results and history in SQLite, one immutable snapshot per scan.
+
+    queue_scan() registers a scan with its parameters and returns its ID;
+    several scans can be queued or running at once. A scan's findings are
+    written together with the 'completed' status in one transaction by
+    complete_scan(), so readers only ever see whole scans. Readers work on
+    the latest completed scan unless asked for a specific scan ID.
+    Statuses: queued, scanning, completed, error and cancelled.
+    """
+
+    def __init__(self, path=None, history=None):
+        self.path = path or state_path('results.db')
+        self.history = history or int(os.getenv('CSPM_RESULTS_HISTORY', DEFAULT_HISTORY))
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript(SCHEMA)
+        # Scans still queued or running were cut short by a restart
+        with self.lock:
+            self.db.execute(
+                "UPDATE scans SET status = 'error', meta = json_set(meta, '$.error', 'interrupted') "
+                "WHERE status IN ('queued', 'scanning')"
+            )
+            self.db.commit()
+
+    def _scan(self, row):
+        if row is None:
+            return None
+        return dict(json.loads(row['meta']), id=row['id'], started=row['started'], finished=row['finished'],
+                    status=row['status'])
+
+    def queue_scan(self, params=None):
+        """Register a queued scan with the parameters it was requested with and return its ID"""
+        with self.lock:
+            cursor = self.db.execute(
+                "INSERT INTO scans (started, status, meta) VALUES (?, 'queued', ?)",
+                (datetime.now().isoformat(), json.dumps({'params': params or {}}, default=str)),
+            )
+            self.db.commit()
+            return cursor.lastrowid
+
+    def _finish(self, scan_id, status, **meta):
+        with self.lock:
+            self.db.execute(
+                "UPDATE scans SET status = ?, finished = ?, meta = json_patch(meta, ?) WHERE id = ?",
+                (status, datetime.now().isoformat(), json.dumps(meta, default=str), scan_id),
+            )
+            self.db.commit()
+
+    def start_scan(self, scan_id):
+        """Mark a queued scan as running"""
+        with self.lock:
+            self.db.execute(
+                "UPDATE scans SET status = 'scanning', started = ? WHERE id = ?",
+                (datetime.now().isoformat(), scan_id),
+            )
+            self.db.commit()
+
+    def complete_scan(self, scan_id, results, meta, carry_forward=()):
+        """Store a scan's findings (dashboard lists by results key) and metadata atomically.
+
+        carry_forward lists categories the scan didn't cover (e.g. the checks a
+        scheduled scan skipped): their findings and check metadata are copied
+        from the latest completed scan, so every snapshot shows the whole posture.
+        """
+        rows = []
+        for category, key in CATEGORIES:
+            if category in carry_forward:
+                continue
+            for finding in results.get(key, []):
+                rows.append((scan_id, len(rows), category, finding.get('risk'), finding.get('region'),
+                             finding.get('account'), json.dumps(finding, default=str)))
+        counts = {category: len(results.get(key, [])) for category, key in CATEGORIES}
+        with self.lock:
+            with self.db:
+                self.db.executemany('INSERT INTO findings VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+                previous = self._scan(self.db.execute(
+                    "SELECT * FROM scans WHERE status = 'completed' ORDER BY id DESC LIMIT 1").fetchone())
+                if carry_forward and previous:
+                    carried = list(carry_forward)
+                    self.db.execute(
+                        f"INSERT INTO findings SELECT ?, seq + ?, category, risk, region, account, data FROM findings "
+                        f"WHERE scan_id = ? AND category IN ({','.join('?' * len(carried))})",
+                        [scan_id, len(rows), previous['id']] + carried,
+                    )
+                    counts.update({category: previous.get('counts', {}).get(category, 0) for category in carried})
+                    meta = dict(meta, carried_forward=carried, checks=dict(
+                        {name: check for name, check in previous.get('checks', {}).items() if name in carried},
+                        **meta.get('checks', {})))
+                meta = dict(meta, counts=counts, total_issues=sum(counts.values()))
+                self.db.execute(
+                    "UPDATE scans SET status = 'completed', finished = ?, meta = json_patch(meta, ?) WHERE id = ?",
+                    (datetime.now().isoformat(), json.dumps(meta, default=str), scan_id),
+                )
+            self._prune()
+
+    def fail_scan(self, scan_id, error):
+        self._finish(scan_id, 'error', error=error)
+
+    def cancel_scan(self, scan_id):
+        self._finish(scan_id, 'cancelled')
+
+    def _prune(self):
+        # Caller holds the lock
+        old = [row[0] for row in self.db.execute(
+            "SELECT id FROM scans WHERE status = 'completed' ORDER BY id DESC LIMIT -1 OFFSET ?", (self.history,)
+        )]
+        if old:
+            with self.db:
+                marks = ','.join('?' * len(old))
+                self.db.execute(f"DELETE FROM findings WHERE scan_id IN ({marks})", old)
+                self.db.execute(f"DELETE FROM scans WHERE id IN ({marks})", old)
+
+    def latest(self, completed=False):
+        """The most recent scan (running, failed or completed), or the most recent completed one"""
+        where = "WHERE status = 'completed' " if completed else ''
+        with self.lock:
+            row = self.db.execute(f"SELECT * FROM scans {where}ORDER BY id DESC LIMIT 1").fetchone()
+        return self._scan(row)
+
+    def get_scan(self, scan_id):
+        with self.lock:
+            row = self.db.execute("SELECT * FROM scans WHERE id = ?", (scan_id,)).fetchone()
+        return self._scan(row)
+
+    def scans(self, limit=20, status=None):
+        """Scan history, newest first, without findings"""
+        where = f"WHERE status IN ({','.join('?' * len(status))}) " if status else ''
+        with self.lock:
+            rows = self.db.execute(
+                f"SELECT * FROM scans {where}ORDER BY id DESC LIMIT ?", list(status or ()) + [limit]
+            ).fetchall()
+        return [self._scan(row) for row in rows]
+
+    def findings(self, scan_id, category=None, risk=None, region=None, account=None, offset=0, limit=None):
+        """(findings by results key, total matching) for one scan, filtered and paginated"""
+        clauses, params = ['scan_id = ?'], [scan_id]
+        for column, value in (('category', category), ('risk', risk), ('region', region), ('account', account)):
+            if value:
+                values = value if isinstance(value, (list, tuple)) else [value]
+                clauses.append(f"{column} COLLATE NOCASE IN ({','.join('?' * len(values))})")
+                params.extend(values)
+        where = ' AND '.join(clauses)
+        page = ' LIMIT ? OFFSET ?' if limit is not None else ''
+        page_params = [limit, offset] if limit is not None else []
+        with self.lock:
+            total = self.db.execute(f"SELECT COUNT(*) FROM findings WHERE {where}", params).fetchone()[0]
+            rows = self.db.execute(
+                f"SELECT category, data FROM findings WHERE {where} ORDER BY seq{page}", params + page_params
+            ).fetchall()
+        results = {key: [] for _, key in CATEGORIES}
+        keys = dict(CATEGORIES)
+        for row in rows:
+            results[keys[row['category']]].append(json.loads(row['data']))
+        return results, total
+
+    def close(self):
+        with self.lock:
+            self.db.close()
@@ -0,0 +1,259 @@
+import os
+import re
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+
+# Rules shipped with the tool, used unless CSPM_RULES or --rules names another file
+DEFAULT_RULES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rules.yaml')
+
+RISKS = ('Low', 'Medium', 'High', 'Critical')
+
+_MISSING = object()
+
+
+def _get(record, path):
+    """Value of a dotted field path in a record, _MISSING if any part is absent"""
+    value = record
+    for part in path.split('.'):
+        if not isinstance(value, dict) or part not in value:
+            return _MISSING
+        value = value[part]
+    return value
+
+
+def _compare(op):
+    def test(expected):
+        def predicate(value):
+            try:
+                return value is not _MISSING and value is not None and op(value, expected)
+            except TypeError:
+                return False
+        return predicate
+    return test
+
+
+def _items_test(quantifier):
+    def test(condition):
+        # Dict items are matched with a nested condition, scalars with a value test
+        inner = compile_condition(condition) if _is_condition(condition) else _value_test(condition)
+
+        def predicate(value):
+            if not isinstance(value, (list, tuple)):
+                return False
+            return quantifier(inner(item) for item in value)
+        return predicate
+    return test
+
+
+def _regex(pattern):
+    compiled = re.compile(pattern)
+    return lambda value: isinstance(value, str) and compiled.search(value) is not None
+
+
+# Value tests: {field: {operator: argument}}
+OPERATORS = {
+    'equals': lambda expected: lambda value: value == expected,
+    'not_equals': lambda expected: lambda value: value != expected,
+    'in': lambda expected: lambda value: value in expected,
+    'not_in': lambda expected: lambda value: value not in expected,
+    'contains': lambda expected: lambda value: isinstance(value, (str, list, tuple, dict)) and expected in value,
+    'startswith': lambda expected: lambda value: isinstance(value, str) and value.startswith(expected),
+    'matches': _regex,
+    'exists': lambda expected: lambda value: (value is not _MISSING and value is not None) == bool(expected),
+    'empty': lambda expected: lambda value: (value is _MISSING or not value) == bool(expected),
+    'lt': _compare(lambda a, b: a < b),
+    'lte': _compare(lambda a, b: a <= b),
+    'gt': _compare(lambda a, b: a > b),
+    'gte': _compare(lambda a, b: a >= b),
+    'any': _items_test(any),
+    'all': _items_test(all),
+}
+
+
+def _is_condition(condition):
+    """True for a record condition ({field: test} / all / any / not), False for a value test.
+
+    'all' and 'any' are both: with a list they combine conditions, otherwise
+    they test the items of a list value.
+    """
+    if not isinstance(condition, dict):
+        return False
+    return any(key not in OPERATORS or (key in ('all', 'any') and isinstance(value, list))
+               for key, value in condition.items())
+
+
+def _value_test(test):
+    if not isinstance(test, dict):
+        # A bare value means equality
+        return OPERATORS['equals'](test)
+    tests = []
+    for op, argument in test.items():
+        if op not in OPERATORS:
+            raise ValueError(f"unknown operator '{op}' (choose from {', '.join(OPERATORS)})")
+        tests.append(OPERATORS[op](argument))
+    return lambda value: all(t(value) for t in tests)
+
+
+def compile_condition(condition):
+    """Compile a rule's 'where' condition into a predicate over one record.
+
+    A condition is a mapping of dotted field paths to value tests, all of
+    which must hold, or one of the logical forms {'all': [conditions]},
+    {'any': [conditions]}, {'not': condition}. A value test is a bare
+    value (equality) or a mapping of operators (see OPERATORS) to their
+    argument; 'any'/'all' apply a condition or test to the items of a list.
+    """
+    if not isinstance(condition, dict) or not condition:
+        raise ValueError(f"condition must be a non-empty mapping, got {condition!r}")
+    predicates = []
+    for key, value in condition.items():
+        if key in ('all', 'any'):
+            if not isinstance(value, list):
+                raise ValueError(f"'{key}' takes a list of conditions")
+            inner = [compile_condition(c) for c in value]
+            quantifier = all if key == 'all' else any
+            predicates.append(lambda record, inner=inner, quantifier=quantifier:
+                              quantifier(p(record) for p in inner))
+        elif key == 'not':
+            inner = compile_condition(value)
+            predicates.append(lambda record, inner=inner: not inner(record))
+        else:
+            test = _value_test(value)
+            predicates.append(lambda record, path=key, test=test: test(_get(record, path)))
+    if len(predicates) == 1:
+        return predicates[0]
+    return lambda record: all(p(record) for p in predicates)
+
+
+class Rule:
+    """A compiled rule: which resource type it applies to, its predicate and how to report a match"""
+
+    def __init__(self, spec):
+        from modules.inventory import COLLECTED_BY
+        from modules.scanner import CHECKS
+
+        self.id = spec.get('id')
+        if not self.id:
+            raise ValueError(f"rule without an id: {spec!r}")
+        if self.id in CHECKS:
+            # Reports and fingerprints key findings by check name
+            raise ValueError(f"rule id '{self.id}' is the name of a built-in check")
+        self.title = spec.get('title', self.id)
+        self.resource = spec.get('resource')
+        if self.resource not in COLLECTED_BY:
+            raise ValueError(f"rule '{self.id}': unknown resource '{self.resource}' "
+                             f"(choose from {', '.join(COLLECTED_BY)})")
+        self.risk = spec.get('risk', 'Medium')
+        if self.risk not in RISKS:
+            raise ValueError(f"rule '{self.id}': risk must be one of {', '.join(RISKS)}")
+        self.report = list(spec.get('report', []))
+        try:
+            self.predicate = compile_condition(spec.get('where'))
+        except ValueError as e:
+            raise ValueError(f"rule '{self.id}': {e}") from None
+
+    def finding(self, record):
+        finding = {'Resource': record['id'], 'ResourceType': self.resource, 'Title': self.title, 'Risk': self.risk}
+        for field in self.report:
+            value = _get(record, field)
+            finding[field] = None if value is _MISSING else value
+        if record.get('region'):
+            finding['Region'] = record['region']
+        return finding
+
+
+def load_rules(path=None):
+    """Read and compile a YAML rule file (a list under 'rules'). Raises ValueError for invalid rules."""
+    import yaml
+
+    path = path or os.getenv('CSPM_RULES') or DEFAULT_RULES_FILE
+    with open(path) as f:
+        config = yaml.safe_load(f) or {}
+    rules = [Rule(spec) for spec in config.get('rules', [])]
+    ids = [rule.id for rule in rules]
+    duplicates = sorted({i for i in ids if ids.count(i) > 1})
+    if duplicates:
+        raise ValueError(f"duplicate rule id(s): {', '.join(duplicates)}")
+    return rules
+
+
+class RuleEngine:
+    """Evaluates compiled rules against an Inventory in a single pass.
+
+    Rules are grouped by resource type, so every record is visited once
+    and tested against just the rules for its type.
+    """
+
+    def __init__(self, rules):
+        self.rules = list(rules)
+        self.by_resource = defaultdict(list)
+        for rule in self.rules:
+            self.by_resource[rule.resource].append(rule)
+
+    @property
+    def resource_types(self):
+        return list(self.by_resource)
+
+    def evaluate(self, inventory):
+        """{rule id: [findings]} for every rule"""
+        findings = {rule.id: [] for rule in self.rules}
+        for resource_type, rules in self.by_resource.items():
+            for record in inventory.of_type(resource_type):
+                for rule in rules:
+                    if rule.predicate(record):
+                        findings[rule.id].append(rule.finding(record))
+        return findings
+
+
+def run_rule_scan(session, rules=None, regions=None, s3_prefix=None):
+    """Collect the inventory the rules need, then evaluate every rule against it.
+
+    Returns a run_scan-shaped result with one entry per rule under 'checks'
+    (findings carry 'Resource', 'Risk' and 'Title'). A rule whose resources
+    couldn't be collected in some region has 'region_errors', or 'error'
+    if nothing could be collected.
+    """
+    from modules.inventory import COLLECTED_BY, build_inventory
+
+    rules = load_rules() if rules is None else rules
+    engine = RuleEngine(rules)
+    scan = {
+        'started': datetime.now().isoformat(),
+        'started_utc': datetime.now(timezone.utc).isoformat(),
+        'finished': None,
+        'mode': 'rules',
+        'regions': [],
+        'duration': None,
+        'checks': {},
+        'total_issues': 0,
+        'errors': 0,
+    }
+    start = time.perf_counter()
+    inventory = build_inventory(session, engine.resource_types, regions=regions, s3_prefix=s3_prefix)
+    scan['regions'] = inventory.regions
+    scan['inventory'] = inventory.counts()
+
+    evaluated = time.perf_counter()
+    findings = engine.evaluate(inventory)
+    evaluation = round(time.perf_counter() - evaluated, 3)
+
+    for rule in engine.rules:
+        collector = COLLECTED_BY[rule.resource]
+        errors = {region or 'global': error for (name, region), error in inventory.errors.items() if name == collector}
+        failed = errors and (len(errors) == len(inventory.regions) or 'global' in errors)
+        scan['checks'][rule.id] = {
+            'check': rule.id,
+            'title': rule.title,
+            'status': 'error' if failed else 'completed',
+            'findings': findings[rule.id],
+            'duration': evaluation,
+            'error': '; '.join(f"{k}: {v}" for k, v in errors.items()) if failed else None,
+            'region_errors': {} if failed else errors,
+        }
+
+    scan['total_issues'] = sum(len(r['findings']) for r in scan['checks'].values())
+    scan['errors'] = sum(1 for r in scan['checks'].values() if r['error'])
+    scan['duration'] = round(time.perf_counter() - start, 3)
+    scan['finished'] = datetime.now().isoformat()
+    return scan
@@ -1,19 +1,158 @@
-def list_s3_buckets(session):
-    s3 = session.client('s3')
-    response = s3.list_buckets()
-    return [bucket['Name'] for bucket in response.get('Buckets', [])]
-
-def check_public_buckets(session):
-    s3 = session.client('s3')
-    public_buckets = []
-    for bucket in list_s3_buckets(session):
+from collections import deque
+
+from botocore.exceptions import ClientError
+
+from modules.aws_config import get_client
+from modules.context import ScanThreadPool
+
+DEFAULT_BUCKET_WORKERS = 16
+
+PUBLIC_GRANTEES = {
+    'http://acs.amazonaws.com/groups/global/AllUsers': 'ACL grants AllUsers',
+    'http://acs.amazonaws.com/groups/global/AuthenticatedUsers': 'ACL grants AuthenticatedUsers',
+}
+
+# Error codes that just mean "not configured" rather than a failure
+MISSING_CONFIG_ERRORS = {'NoSuchPublicAccessBlockConfiguration', 'NoSuchBucketPolicy', 'NoSuchTagSet'}
+
+
+def _error_code(error):
+    return error.response.get('Error', {}).get('Code', '')
+
+
+def _bucket_region(s3, bucket):
+    location = s3.get_bucket_location(Bucket=bucket).get('LocationConstraint')
+    # us-east-1 is reported as None and the legacy eu-west-1 alias as 'EU'
+    if not location:
+        return 'us-east-1'
+    if location == 'EU':
+        return 'eu-west-1'
+    return location
+
+
+def _list_buckets(s3, prefix=None):
+    """Yield (name, region) for every bucket, region is None if ListBuckets didn't return it"""
+    params = {'Prefix': prefix} if prefix else {}
+    paginator = s3.get_paginator('list_buckets')
+    for page in paginator.paginate(**params):
+        for bucket in page.get('Buckets', []):
+            yield bucket['Name'], bucket.get('BucketRegion')
+
+
+def list_s3_buckets(session, prefix=None):
+    s3 = get_client(session, 's3')
+    return [name for name, _ in _list_buckets(s3, prefix)]
+
+
+def _matches_tags(s3, bucket, tags):
+    try:
+        tag_set = s3.get_bucket_tagging(Bucket=bucket).get('TagSet', [])
+    except ClientError as e:
+        if _error_code(e) in MISSING_CONFIG_ERRORS:
+            return False
+        raise
+    bucket_tags = {t['Key']: t['Value'] for t in tag_set}
+    return all(bucket_tags.get(key) == value for key, value in tags.items())
+
+
+def _public_access_block(s3, bucket):
+    try:
+        return s3.get_public_access_block(Bucket=bucket).get('PublicAccessBlockConfiguration', {})
+    except ClientError as e:
+        if _error_code(e) in MISSING_CONFIG_ERRORS:
+            return {}
+        raise
+
+
+def _policy_is_public(s3, bucket):
+    try:
+        return s3.get_bucket_policy_status(Bucket=bucket).get('PolicyStatus', {}).get('IsPublic', False)
+    except ClientError as e:
+        if _error_code(e) in MISSING_CONFIG_ERRORS:
+            return False
+        raise
+
+
+def _acl_reasons(s3, bucket):
+    reasons = []
+    for grant in s3.get_bucket_acl(Bucket=bucket).get('Grants', []):
+        grantee = grant.get('Grantee', {})
+        reason = PUBLIC_GRANTEES.get(grantee.get('URI', '')) if grantee.get('Type') == 'Group' else None
+        if reason and reason not in reasons:
+            reasons.append(reason)
+    return reasons
+
+
+def check_bucket(session, bucket, region=None, tags=None):
+    """Evaluate one bucket in its home region. Returns None if it is filtered out by tags."""
+    if not region:
+        region = _bucket_region(get_client(session, 's3'), bucket)
+    s3 = get_client(session, 's3', region)
+
+    if tags and not _matches_tags(s3, bucket, tags):
+        return None
+
+    block = _public_access_block(s3, bucket)
+    reasons = []
+    # Public access block settings override ACLs and bucket policies
+    if not (block.get('BlockPublicAcls') or block.get('IgnorePublicAcls')):
+        reasons.extend(_acl_reasons(s3, bucket))
+    if not block.get('RestrictPublicBuckets') and _policy_is_public(s3, bucket):
+        reasons.append('Bucket policy is public')
+
+    return {
+        'Bucket': bucket,
+        'Region': region,
+        'Public': bool(reasons),
+        'Reasons': reasons,
+    }
+
+
+def iter_bucket_results(session, prefix=None, tags=None, buckets=None, max_workers=DEFAULT_BUCKET_WORKERS):
+    """Check bucket exposure concurrently, each bucket against its home region.
+
+    prefix limits the scan to bucket names starting with it (filtered by
+    ListBuckets itself), tags to buckets carrying all of the given tags.
+    buckets, a list of bucket names, skips ListBuckets and only checks
+    those (used by incremental scans). Yields one result per scanned bucket
+    in listing order; buckets we can't read are reported with an 'Error'.
+    Only a window of max_workers * 2 buckets is in flight at a time, so
+    memory doesn't grow with the number of buckets.
+    """
+    if buckets is None:
+        buckets = _list_buckets(get_client(session, 's3'), prefix)
+    else:
+        buckets = ((name, None) for name in buckets if not prefix or name.startswith(prefix))
+
+    def scan(bucket, region):
         try:
-            acl = s3.get_bucket_acl(Bucket=bucket)
-            for grant in acl.get('Grants', []):
-                grantee = grant.get('Grantee', {})
-                if grantee.get('Type') == 'Group' and 'AllUsers' in grantee.get('URI', ''):
-                    public_buckets.append(bucket)
+            return check_bucket(session, bucket, region, tags)
         except Exception as e:
-            # skip buckets we can't access
-            continue
-    return public_buckets
+            return {'Bucket': bucket, 'Region': region, 'Public': False, 'Reasons': [], 'Error': str(e)}
+
+    pending = deque()
+    with ScanThreadPool(max_workers=max(1, max_workers), thread_name_prefix='cspm-s3') as pool:
+        for bucket, region in buckets:
+            pending.append(pool.submit(scan, bucket, region))
+            if len(pending) >= max_workers * 2:
+                result = pending.popleft().result()
+                if result is not None:
+                    yield result
+        while pending:
+            result = pending.popleft().result()
+            if result is not None:
+                yield result
+
+
+def scan_buckets(session, prefix=None, tags=None, buckets=None, max_workers=DEFAULT_BUCKET_WORKERS):
+    return list(iter_bucket_results(session, prefix, tags, buckets, max_workers))
+
+
+def iter_public_buckets(session, prefix=None, tags=None, buckets=None):
+    for result in iter_bucket_results(session, prefix, tags, buckets):
+        if result['Public']:
+            yield result['Bucket']
+
+
+def check_public_buckets(session, prefix=None, tags=None, buckets=None):
+    return list(iter_public_buckets(session, prefix, tags, buckets))
@@ -0,0 +1,303 @@
+import functools
+import importlib
+import time
+from datetime import datetime, timezone
+
+from modules.context import ScanThreadPool, scan_setting, scan_settings
+
+# Check name -> 'module:function'. Every check takes a boto3 session. Check
+# modules (and boto3/numpy behind them) are only imported once a check is
+# actually run, see get_check().
+CHECKS = {
+    's3': 'modules.s3_check:check_public_buckets',
+    'iam': 'modules.iam_check:list_admin_users',
+    'ec2': 'modules.ec2_check:check_public_ec2',
+    'cloudtrail': 'modules.cloudtrail_check:check_cloudtrail_enabled',
+    'sg': 'modules.sg_check:check_security_groups',
+    'exposure': 'modules.exposure:check_network_exposure',
+}
+
+# The same checks as generators that yield findings as each page of results
+# is processed, used to report progress while a check is still running
+STREAMING_CHECKS = {
+    's3': 'modules.s3_check:iter_public_buckets',
+    'iam': 'modules.iam_check:iter_admin_users',
+    'ec2': 'modules.ec2_check:iter_public_ec2',
+    'cloudtrail': 'modules.cloudtrail_check:iter_cloudtrail_issues',
+    'sg': 'modules.sg_check:iter_security_group_findings',
+    'exposure': 'modules.exposure:iter_exposure_findings',
+}
+
+# Checks that look at a single region and can be fanned out across regions.
+REGIONAL_CHECKS = {'ec2', 'cloudtrail', 'sg', 'exposure'}
+
+DEFAULT_MAX_WORKERS = 5
+
+
+@functools.lru_cache(maxsize=None)
+def get_check(name):
+    """Import and return the check function registered under name"""
+    module_name, function_name = CHECKS[name].split(':')
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+def _streaming_check(name, progress=None, cancelled=None):
+    """A check function that reports its findings to progress as they are found.
+
+    Publishes 'findings' events in batches and, for each region, a
+    'region_completed' event with the region's finding count or error.
+    Once the cancelled event is set, the check stops at its next finding
+    with ScanCancelled.
+    """
+    from modules.progress import FindingBatcher, ScanCancelled
+    from modules.regions import tag_region
+
+    module_name, function_name = STREAMING_CHECKS[name].split(':')
+    iter_check = getattr(importlib.import_module(module_name), function_name)
+
+    def check(session, **kwargs):
+        region = kwargs.get('region')
+
+        def publish(batch):
+            if progress is None:
+                return
+            if region:
+                batch = [tag_region(finding, region) for finding in batch]
+            progress('findings', {'check': name, 'region': region, 'findings': batch})
+
+        batcher = FindingBatcher(publish)
+        findings = []
+        try:
+            if cancelled is not None and cancelled.is_set():
+                raise ScanCancelled(name)
+            for finding in iter_check(session, **kwargs):
+                findings.append(finding)
+                batcher.add(finding)
+                if cancelled is not None and cancelled.is_set():
+                    raise ScanCancelled(name)
+        except ScanCancelled:
+            raise
+        except Exception as e:
+            batcher.flush()
+            if progress and region:
+                progress('region_completed', {'check': name, 'region': region, 'findings': len(findings),
+                                              'error': str(e)})
+            raise
+        batcher.flush()
+        if progress and region:
+            progress('region_completed', {'check': name, 'region': region, 'findings': len(findings), 'error': None})
+        return findings
+
+    check.__name__ = function_name
+    return check
+
+
+def _checkpointed(name, check, checkpoint, progress=None):
+    """A check function that saves each unit (region) it completes to checkpoint.
+
+    A unit completed by an interrupted run of the same scan isn't run
+    again: its saved findings are returned (and published to progress).
+    """
+    from modules.progress import FindingBatcher
+    from modules.regions import tag_region
+
+    def run(session, **kwargs):
+        region = kwargs.get('region')
+        findings = checkpoint.unit(name, region)
+        if findings is None:
+            findings = check(session, **kwargs)
+            checkpoint.complete_unit(name, region, findings)
+            return findings
+        listings = scan_setting('listings')
+        if listings is not None:
+            # Checks sharing a listing with this one don't wait for it
+            listings.skip(name, region)
+        if progress:
+            batcher = FindingBatcher(lambda batch: progress('findings', {
+                'check': name, 'region': region,
+                'findings': [tag_region(f, region) for f in batch] if region else batch,
+            }))
+            for finding in findings:
+                batcher.add(finding)
+            batcher.flush()
+            if region:
+                progress('region_completed', {'check': name, 'region': region, 'findings': len(findings),
+                                              'error': None, 'resumed': True})
+        return findings
+
+    run.__name__ = getattr(check, '__name__', name)
+    return run
+
+
+def _run_check(name, check, session, regions=None, options=None, progress=None, cancelled=None,
+               checkpoint=None):
+    """Run one check and capture its findings, timing and error.
+
+    With a progress callback, progress(event, data) is called from the
+    worker threads with 'check_started', 'findings', 'region_completed' and
+    'check_completed' events while the check runs. ScanCancelled is not
+    recorded as a check error but raised to the caller. With a
+    ScanCheckpoint, every completed region (or the whole check, if it
+    isn't regional) is saved to it and reused when the scan is resumed.
+    """
+    # Imported here like the check modules: regions pulls in boto3 through aws_config
+    from modules.progress import ScanCancelled
+    from modules.regions import scan_regions
+
+    result = {
+        'check': name,
+        'status': 'running',
+        'findings': [],
+        'started': datetime.now().isoformat(),
+        'finished': None,
+        'duration': None,
+        'error': None,
+    }
+    start = time.perf_counter()
+    if progress or cancelled is not None:
+        check = _streaming_check(name, progress, cancelled)
+    if progress:
+        progress('check_started', {'check': name})
+    if options:
+        check = functools.partial(check, **options)
+    if checkpoint is not None:
+        check = _checkpointed(name, check, checkpoint, progress)
+    try:
+        if regions and name in REGIONAL_CHECKS:
+            result['findings'], result['region_errors'] = scan_regions(session, check, regions)
+            if len(result['region_errors']) == len(regions):
+                raise RuntimeError(f"failed in every region ({len(regions)})")
+        else:
+            result['findings'] = check(session)
+        result['status'] = 'completed'
+    except ScanCancelled:
+        raise
+    except Exception as e:
+        result['status'] = 'error'
+        result['error'] = str(e)
+        print(f"[WARN] Check '{name}' failed: {e}")
+    result['duration'] = round(time.perf_counter() - start, 3)
+    result['finished'] = datetime.now().isoformat()
+    if progress:
+        progress('check_completed', {
+            'check': name,
+            'status': result['status'],
+            'findings': len(result['findings']),
+            'duration': result['duration'],
+            'error': result['error'],
+            'region_errors': result.get('region_errors', {}),
+        })
+    return result
+
+
+def run_scan(session, checks=None, regions=None, check_options=None, cache=None, refresh=False,
+             max_workers=DEFAULT_MAX_WORKERS, progress=None, cancelled=None, checkpoints=None, restart=False):
+    """Run the selected checks concurrently and return one structured result.
+
+    A failing check is recorded with its error and does not affect the others.
+    With regions ('all' or a list), the regional checks are fanned out across
+    those regions and their findings are tagged with 'Region'.
+    check_options maps a check name to extra keyword arguments for it,
+    e.g. {'s3': {'prefix': 'logs-'}}.
+    With an InventoryCache, repeat calls within the TTL are served locally;
+    refresh=True bypasses the cached entries and re-fetches everything.
+    progress, if given, is called as progress(event, data) while the scan
+    runs: 'scan_started' with the checks and regions, then per check events
+    (see _run_check) as checks, regions and pages of findings complete.
+    Checks that read the same listing (ec2, sg and exposure) share one
+    fetch of it per region.
+    Setting the cancelled event (a threading.Event) stops the scan at the
+    next finding, region or check, and run_scan raises ScanCancelled.
+    With a CheckpointStore, the findings of every completed check and
+    region are checkpointed as the scan goes, and a scan that was
+    interrupted (crashed, killed or cancelled) is resumed by the next
+    run_scan with the same account, checks, regions, options and refresh,
+    skipping what it already completed; restart=True discards it and
+    starts over. The result then has a 'checkpoint' summary.
+    """
+    from modules.inventory import ScanListings
+    from modules.regions import resolve_regions
+
+    names = list(checks) if checks else list(CHECKS)
+    check_options = check_options or {}
+    unknown = [name for name in names if name not in CHECKS]
+    if unknown:
+        raise ValueError(f"Unknown check(s): {', '.join(unknown)}")
+
+    scan = {
+        'started': datetime.now().isoformat(),
+        'started_utc': datetime.now(timezone.utc).isoformat(),
+        'finished': None,
+        'regions': [],
+        'check_options': check_options,
+        'duration': None,
+        'checks': {},
+        'total_issues': 0,
+        'errors': 0,
+    }
+    start = time.perf_counter()
+
+    # Import the selected checks before the worker threads start, concurrent
+    # first imports of the same module would serialize on the import lock
+    # anyway
+    for name in names:
+        get_check(name)
+
+    # Resolve credentials once up front so the worker threads don't race
+    # on the session's lazy credential provider setup.
+    session.get_credentials()
+    if cache is not None:
+        try:
+            scan['account'] = cache.attach(session)
+        except Exception as e:
+            print(f"[WARN] Inventory cache disabled for this scan: {e}")
+    checkpoint = None
+    if checkpoints is not None:
+        credentials = session.get_credentials()
+        checkpoint = checkpoints.open({
+            'account': scan.get('account') or (credentials.access_key if credentials else None),
+            'checks': sorted(names),
+            'regions': regions if isinstance(regions, str) else sorted(regions or []),
+            'check_options': check_options,
+            # A forced refresh doesn't pick up findings read from the cache
+            'refresh': bool(refresh),
+        }, restart=restart)
+        if checkpoint.resumed:
+            print(f"[INFO] Resuming interrupted scan {checkpoint.id}")
+    try:
+        # The checks run on ScanThreadPool workers, which carry these settings to the cache
+        # hooks and to the checks sharing a listing (e.g. ec2 and exposure read every instance)
+        listings = ScanListings(names)
+        with scan_settings(cache_refresh=bool(refresh), listings=listings):
+            if regions and REGIONAL_CHECKS.intersection(names):
+                scan['regions'] = resolve_regions(session, regions)
+            if progress:
+                progress('scan_started', {'checks': names, 'regions': scan['regions'],
+                                          'resumed': bool(checkpoint and checkpoint.resumed)})
+
+            workers = max(1, min(max_workers, len(names)))
+            with ScanThreadPool(max_workers=workers, thread_name_prefix='cspm-check') as pool:
+                # Checks sharing a listing start first, so none of them falls behind the others
+                futures = {
+                    name: pool.submit(_run_check, name, get_check(name), session, scan['regions'],
+                                      check_options.get(name), progress, cancelled, checkpoint)
+                    for name in sorted(names, key=lambda name: not listings.reads(name))
+                }
+                for name in names:
+                    scan['checks'][name] = futures[name].result()
+    except BaseException:
+        # Crashed, interrupted or cancelled: keep what was collected for the next run
+        if checkpoint is not None:
+            checkpoint.release()
+        raise
+    if cache is not None:
+        cache.flush()
+    if checkpoint is not None:
+        checkpoint.finish()
+        scan['checkpoint'] = checkpoint.summary()
+
+    scan['total_issues'] = sum(len(r['findings']) for r in scan['checks'].values())
+    scan['errors'] = sum(1 for r in scan['checks'].values() if r['error'])
+    scan['duration'] = round(time.perf_counter() - start, 3)
+    scan['finished'] = datetime.now().isoformat()
+    return scan
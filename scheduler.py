@@ -0,0 +1,153 @@
+import json
+import os
+import random
+import threading
+import time
+
+from modules.cache import state_path
+
+# Seconds between scheduled runs of each check, matched to how quickly the
+# resources change. Override with CSPM_SCHEDULE_<CHECK> (seconds, 0 disables
+# the check), e.g. CSPM_SCHEDULE_SG=120 or CSPM_SCHEDULE_IAM=0.
+DEFAULT_INTERVALS = {
+    'sg': 300,
+    'exposure': 300,
+    'ec2': 900,
+    'cloudtrail': 3600,
+    's3': 3600,
+    'iam': 86400,
+}
+
+# Every run is pushed back by a random part of this fraction of the
+# interval (CSPM_SCHEDULE_JITTER), so checks and dashboard instances don't
+# hit AWS in lockstep
+DEFAULT_JITTER = 0.1
+
+# Checks without any state yet start within this many seconds
+FIRST_RUN_SPREAD = 60
+
+# Longest sleep between looking for due checks
+MAX_SLEEP = 30
+
+
+def intervals_from_env():
+    intervals = {}
+    for check, interval in DEFAULT_INTERVALS.items():
+        interval = int(os.getenv(f"CSPM_SCHEDULE_{check.upper()}", interval))
+        if interval > 0:
+            intervals[check] = interval
+    return intervals
+
+
+class Scheduler:
+    """Runs checks periodically in the background, each on its own interval.
+
+    Due checks are handed to submit(checks), which queues one scan for them
+    and returns its job ID. A check whose previous scheduled job is still
+    queued or running (is_active(job_id)) is skipped until its next slot
+    rather than piling up. Last and next run times are kept in
+    .cspm/schedule.json, so a restart picks up the schedule where it was.
+    """
+
+    def __init__(self, submit, is_active, intervals=None, jitter=DEFAULT_JITTER, state_file=None):
+        self.submit = submit
+        self.is_active = is_active
+        self.intervals = intervals if intervals is not None else intervals_from_env()
+        self.jitter = jitter
+        self.state_file = state_file or state_path('schedule.json')
+        self.lock = threading.Lock()
+        self.state = self._load_state()
+        self._stop = threading.Event()
+        self._thread = None
+
+        now = time.time()
+        for check in self.intervals:
+            entry = self.state.setdefault(check, {'last_run': None, 'last_job': None, 'skipped': 0})
+            if not entry.get('next_run'):
+                entry['next_run'] = now + random.uniform(0, min(FIRST_RUN_SPREAD, self.intervals[check]))
+
+    def _load_state(self):
+        if not os.path.exists(self.state_file):
+            return {}
+        try:
+            with open(self.state_file) as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"[WARN] Ignoring unreadable schedule state {self.state_file}: {e}")
+            return {}
+
+    def _save_state(self):
+        tmp_path = f"{self.state_file}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.state, f)
+        os.replace(tmp_path, self.state_file)
+
+    def _next_run(self, check, now):
+        interval = self.intervals[check]
+        return now + interval + random.uniform(0, interval * self.jitter)
+
+    def tick(self, now=None):
+        """Submit the checks that are due. Returns the job ID, or None if nothing was submitted."""
+        now = now or time.time()
+        with self.lock:
+            due = []
+            for check in self.intervals:
+                entry = self.state[check]
+                if entry['next_run'] > now:
+                    continue
+                entry['next_run'] = self._next_run(check, now)
+                if entry['last_job'] is not None and self.is_active(entry['last_job']):
+                    entry['skipped'] = entry.get('skipped', 0) + 1
+                    print(f"[INFO] Scheduled '{check}' scan skipped, job {entry['last_job']} is still running")
+                    continue
+                due.append(check)
+            job_id = None
+            if due:
+                try:
+                    job_id = self.submit(due)
+                except Exception as e:
+                    print(f"[WARN] Scheduled scan of {', '.join(due)} failed to start: {e}")
+                else:
+                    for check in due:
+                        self.state[check].update(last_run=now, last_job=job_id)
+                    print(f"[INFO] Scheduled scan {job_id}: {', '.join(due)}")
+            self._save_state()
+        return job_id
+
+    def status(self):
+        """Interval, last and next run per check"""
+        with self.lock:
+            return {check: dict(self.state[check], interval=interval) for check, interval in self.intervals.items()}
+
+    def _sleep(self):
+        with self.lock:
+            next_run = min((self.state[check]['next_run'] for check in self.intervals), default=None)
+        if next_run is None:
+            return MAX_SLEEP
+        return min(MAX_SLEEP, max(0.0, next_run - time.time()))
+
+    def _run(self):
+        while not self._stop.wait(self._sleep()):
+            try:
+                self.tick()
+            except Exception as e:
+                print(f"[WARN] Scheduler tick failed: {e}")
+
+    def start(self):
+        if self._thread is None and self.intervals:
+            self._thread = threading.Thread(target=self._run, name='cspm-scheduler', daemon=True)
+            self._thread.start()
+            print("[INFO] Scheduler started: " + ', '.join(f"{c} every {i}s" for c, i in self.intervals.items()))
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+def scheduler_from_env(submit, is_active):
+    """Scheduler configured from the environment, or None unless CSPM_SCHEDULE=1"""
+    if os.getenv('CSPM_SCHEDULE', '0') != '1':
+        return None
+    return Scheduler(submit, is_active, jitter=float(os.getenv('CSPM_SCHEDULE_JITTER', DEFAULT_JITTER)))
@@ -1,18 +1,217 @@
-import boto3
-
-def check_security_groups(session):
-    client = session.client('ec2')
-    response = client.describe_security_groups()
-    
-    findings = []
-    for sg in response['SecurityGroups']:
+import ipaddress
+from collections import defaultdict
+
+import numpy as np
+
+from modules.aws_config import MAX_FILTER_VALUES, get_client
+from modules.inventory import shared_listing
+
+ALL_PORTS = (0, 65535)
+
+# IpProtocol can be a name or an IANA number; '-1' means all protocols
+PROTOCOL_NAMES = {'6': 'tcp', '17': 'udp', '1': 'icmp', '58': 'icmpv6'}
+PROTOCOL_CODES = {'-1': 0, 'tcp': 1, 'udp': 2, 'icmp': 3, 'icmpv6': 4}
+
+
+def _normalize_protocol(protocol):
+    protocol = str(protocol).lower()
+    return PROTOCOL_NAMES.get(protocol, protocol)
+
+
+def _port_range(perm, protocol):
+    if protocol == '-1':
+        return ALL_PORTS
+    from_port, to_port = perm.get('FromPort'), perm.get('ToPort')
+    # ICMP uses FromPort/ToPort for type/code, and -1 means "all"
+    if from_port is None or from_port == -1 or protocol in ('icmp', 'icmpv6'):
+        return ALL_PORTS if from_port in (None, -1) else (from_port, from_port)
+    return from_port, (to_port if to_port not in (None, -1) else from_port)
+
+
+def iter_rules(security_groups):
+    """Flatten security groups into one dict per (ingress rule, source)"""
+    for sg in security_groups:
         for perm in sg.get('IpPermissions', []):
-            for ip_range in perm.get('IpRanges', []):
-                if ip_range.get('CidrIp') == '0.0.0.0/0':
-                    findings.append({
-                        "GroupId": sg['GroupId'],
-                        "Port": perm.get('FromPort'),
-                        "Protocol": perm.get('IpProtocol'),
-                        "Description": sg.get('Description', 'No description')
-                    })
-    return findings
+            protocol = _normalize_protocol(perm.get('IpProtocol', '-1'))
+            from_port, to_port = _port_range(perm, protocol)
+            base = {
+                'GroupId': sg['GroupId'],
+                'Protocol': protocol,
+                'FromPort': from_port,
+                'ToPort': to_port,
+                'Description': sg.get('Description', 'No description'),
+            }
+            sources = (
+                [('ipv4', r.get('CidrIp')) for r in perm.get('IpRanges', [])]
+                + [('ipv6', r.get('CidrIpv6')) for r in perm.get('Ipv6Ranges', [])]
+                + [('prefix-list', r.get('PrefixListId')) for r in perm.get('PrefixListIds', [])]
+                + [('security-group', r.get('GroupId')) for r in perm.get('UserIdGroupPairs', [])]
+            )
+            for source_type, source in sources:
+                yield dict(base, SourceType=source_type, Source=source)
+
+
+class SecurityGroupIndex:
+    """In-memory exposure index over every ingress rule of a set of security groups.
+
+    Queries are answered from the index without further API calls. Port and
+    CIDR matching is done on numpy arrays so it stays fast for 100k+ rules.
+    """
+
+    def __init__(self, security_groups):
+        self.groups = {}
+        self.rules = []
+        self._by_group = defaultdict(list)
+        self._by_source_group = defaultdict(list)
+        self._query_cache = {}
+
+        for sg in security_groups:
+            self.groups[sg['GroupId']] = sg
+        for rule in iter_rules(self.groups.values()):
+            self.rules.append(rule)
+
+        networks = {}
+        # Sorted so that unique group positions map straight to sorted group IDs
+        group_ids = sorted(self.groups)
+        group_positions = {group_id: i for i, group_id in enumerate(group_ids)}
+        self._group_ids = np.array(group_ids, dtype=object)
+        self._ipv6 = []
+        rule_groups, from_ports, to_ports, protocols = [], [], [], []
+        internet, ipv4, ipv4_net, ipv4_mask = [], [], [], []
+
+        for i, rule in enumerate(self.rules):
+            self._by_group[rule['GroupId']].append(i)
+            rule_groups.append(group_positions[rule['GroupId']])
+            from_ports.append(rule['FromPort'])
+            to_ports.append(rule['ToPort'])
+            protocols.append(PROTOCOL_CODES.get(rule['Protocol'], -1))
+            if rule['SourceType'] == 'security-group':
+                self._by_source_group[rule['Source']].append(i)
+
+            network = None
+            if rule['SourceType'] in ('ipv4', 'ipv6') and rule['Source']:
+                # Parse each distinct CIDR once, most accounts reuse a handful of them
+                if rule['Source'] not in networks:
+                    try:
+                        networks[rule['Source']] = ipaddress.ip_network(rule['Source'], strict=False)
+                    except ValueError:
+                        networks[rule['Source']] = None
+                network = networks[rule['Source']]
+
+            internet.append(network is not None and network.prefixlen == 0)
+            is_ipv4 = network is not None and network.version == 4
+            ipv4.append(is_ipv4)
+            ipv4_net.append(int(network.network_address) if is_ipv4 else 0)
+            ipv4_mask.append(int(network.netmask) if is_ipv4 else 0)
+            if network is not None and network.version == 6:
+                self._ipv6.append((i, network))
+
+        self._rule_groups = np.array(rule_groups, dtype=np.int32)
+        self._from_ports = np.array(from_ports, dtype=np.int32)
+        self._to_ports = np.array(to_ports, dtype=np.int32)
+        self._protocols = np.array(protocols, dtype=np.int8)
+        self._internet = np.array(internet, dtype=bool)
+        # IPv4 sources as integer network/mask pairs for vectorized address checks
+        self._ipv4 = np.array(ipv4, dtype=bool)
+        self._ipv4_net = np.array(ipv4_net, dtype=np.uint32)
+        self._ipv4_mask = np.array(ipv4_mask, dtype=np.uint32)
+
+    def _port_mask(self, port, protocol):
+        protocol_code = PROTOCOL_CODES.get(_normalize_protocol(protocol), -1)
+        mask = (self._protocols == 0) | (self._protocols == protocol_code)
+        if port is not None:
+            mask &= (self._from_ports <= port) & (self._to_ports >= port)
+        return mask
+
+    def _select(self, mask):
+        return [self.rules[i] for i in np.flatnonzero(mask)]
+
+    def internet_rules(self):
+        """Every rule open to 0.0.0.0/0 or ::/0"""
+        return self._select(self._internet)
+
+    def rules_for_port(self, port, protocol='tcp', internet_only=True):
+        """Rules that allow traffic on a port, by default only from the internet"""
+        mask = self._port_mask(port, protocol)
+        if internet_only:
+            mask &= self._internet
+        return self._select(mask)
+
+    def groups_exposing_port(self, port, protocol='tcp'):
+        """Group IDs that expose a port to the internet, e.g. groups_exposing_port(22)"""
+        key = (port, _normalize_protocol(protocol))
+        if key not in self._query_cache:
+            mask = self._port_mask(port, protocol) & self._internet
+            self._query_cache[key] = self._group_ids[np.unique(self._rule_groups[mask])].tolist()
+        return self._query_cache[key]
+
+    def rules_allowing_ip(self, ip, port=None, protocol='tcp'):
+        """Rules whose CIDR source contains the given address"""
+        address = ipaddress.ip_address(ip)
+        mask = self._port_mask(port, protocol)
+        if address.version == 4:
+            value = np.uint32(int(address))
+            mask &= self._ipv4 & ((value & self._ipv4_mask) == self._ipv4_net)
+        else:
+            matches = np.zeros(len(self.rules), dtype=bool)
+            for i, network in self._ipv6:
+                matches[i] = address in network
+            mask &= matches
+        return self._select(mask)
+
+    def group_exposure(self, group_id, internet_only=False):
+        """What a security group allows in, optionally only from the internet"""
+        indexes = self._by_group.get(group_id, [])
+        if internet_only:
+            indexes = [i for i in indexes if self._internet[i]]
+        return [self.rules[i] for i in indexes]
+
+    def rules_referencing_group(self, group_id):
+        """Rules in other groups that allow traffic from members of group_id"""
+        return [self.rules[i] for i in self._by_source_group.get(group_id, [])]
+
+
+def iter_security_group_pages(session, region=None, group_ids=None):
+    """Yield security groups one DescribeSecurityGroups page at a time"""
+    client = get_client(session, 'ec2', region)
+    paginator = client.get_paginator('describe_security_groups')
+    if group_ids is not None:
+        # A filter rather than GroupIds, so deleted groups don't fail the call
+        group_ids = list(group_ids)
+        pages = (page for i in range(0, len(group_ids), MAX_FILTER_VALUES)
+                 for page in paginator.paginate(Filters=[{'Name': 'group-id',
+                                                          'Values': group_ids[i:i + MAX_FILTER_VALUES]}]))
+    else:
+        listings = shared_listing('security_groups')
+        pages = listings.pages('security_groups', region, paginator) if listings else paginator.paginate()
+    for page in pages:
+        yield page.get('SecurityGroups', [])
+
+
+def get_security_groups(session, region=None, group_ids=None):
+    security_groups = []
+    for page in iter_security_group_pages(session, region, group_ids):
+        security_groups.extend(page)
+    return security_groups
+
+
+def build_security_group_index(session, region=None):
+    return SecurityGroupIndex(get_security_groups(session, region))
+
+
+def iter_security_group_findings(session, region=None, group_ids=None):
+    """Yield rules open to the internet page by page, only one page of groups is held at a time"""
+    for page in iter_security_group_pages(session, region, group_ids):
+        for rule in SecurityGroupIndex(page).internet_rules():
+            yield {
+                "GroupId": rule['GroupId'],
+                "Port": rule['FromPort'],
+                "ToPort": rule['ToPort'],
+                "Protocol": rule['Protocol'],
+                "Cidr": rule['Source'],
+                "Description": rule['Description']
+            }
+
+
+def check_security_groups(session, region=None, group_ids=None):
+    return list(iter_security_group_findings(session, region, group_ids))
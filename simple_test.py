@@ -106,6 +106,19 @@ def test_ec2_specifically():
     except Exception as e:
         print(f"❌ EC2 setup failed: {e}")
 
+def test_multi_account():
+    """Assume the audit role in every account from CSPM_ACCOUNTS_FILE"""
+    print("\n🏢 Testing Multi-Account Access...")
+    try:
+        from modules.accounts import load_accounts, test_accounts
+        for result in test_accounts(boto3.Session(), load_accounts()):
+            if result['status'] == 'connected':
+                print(f"✅ {result['account_id']} ({result['name']}): {result['user_arn']}")
+            else:
+                print(f"❌ {result['account_id']} ({result['name']}): {result['error']}")
+    except Exception as e:
+        print(f"❌ Multi-account test failed: {e}")
+
 def simple_permission_test():
     """Test what AWS permissions we actually have"""
     print("\n🔐 Testing AWS Permissions...")
@@ -168,6 +181,10 @@ def main():
     # Test EC2 specifically since it worked
     test_ec2_specifically()
     
+    # Multi-account access, when an accounts file is configured
+    if os.getenv('CSPM_ACCOUNTS_FILE'):
+        test_multi_account()
+    
     print("\n" + "=" * 60)
     print("📋 QUICK TESTING RECOMMENDATIONS:")
     print("=" * 60)